@@ -1,14 +1,23 @@
 import numpy as np
 
+from stable_baselines.common.vec_env import VecFrameStack
+
 
 class Buffer(object):
-    def __init__(self, env, n_steps, size=50000):
+    def __init__(self, env, n_steps, size=50000, n_stack=None):
         """
         A buffer for observations, actions, rewards, mu's, states, masks and dones values
 
+        The fields of the sampled segments are gathered with one advanced index each, into output arrays that are
+        reused by the next calls to `get`. With frame-stacked observations, each frame is stored once (the encoded
+        observations): the stacks are gathered from the frames with an index-based view (one advanced index per
+        stack position), and the frames preceding an episode start are zeroed, like in `VecFrameStack`.
+
         :param env: (Gym environment) The environment to learn from
         :param n_steps: (int) The number of steps to run for each environment
         :param size: (int) The buffer size in number of steps
+        :param n_stack: (int) The number of frames stacked along the last axis of the observations
+            (default: the n_stack of the environment if it is a VecFrameStack, 1 otherwise)
         """
         self.n_env = env.num_envs
         self.n_steps = n_steps
@@ -20,6 +29,7 @@ class Buffer(object):
             self.raw_pixels = True
             self.height, self.width, self.n_channels = env.observation_space.shape
             self.obs_dtype = np.uint8
+            self.obs_shape = (self.height, self.width, self.n_channels)
         else:
             self.raw_pixels = False
             if len(env.observation_space.shape) == 1:
@@ -27,14 +37,29 @@ class Buffer(object):
             else:
                 self.obs_dim = 1
             self.obs_dtype = np.float32
+            self.obs_shape = (self.obs_dim,)
+
+        if n_stack is None:
+            n_stack = env.n_stack if isinstance(env, VecFrameStack) else 1
+        assert self.obs_shape[-1] % n_stack == 0, "The last axis of the observations must hold the stacked frames"
+        self.n_stack = n_stack
+        self.frame_shape = self.obs_shape[:-1] + (self.obs_shape[-1] // n_stack,)
+        # Frames stored per environment in each loc: the older frames of the first stack, then the newest frame of
+        # each of the n_steps + 1 observations
+        self.n_frames = n_stack - 1 + n_steps + 1
+        # Frames of the stack of each observation, relative to the first frame of its segment
+        self._stack_offsets = np.arange(n_steps + 1)[:, np.newaxis] + np.arange(n_stack)
 
         # Memory
         self.enc_obs = None
+        self.first_frames = None
         self.actions = None
         self.rewards = None
         self.mus = None
         self.dones = None
         self.masks = None
+        # Output arrays of `get`, allocated at the first call
+        self._out = {}
 
         # Size indexes
         self.next_idx = 0
@@ -59,32 +84,44 @@ class Buffer(object):
         """
         return self.num_in_buffer > 0
 
-    def decode(self, enc_obs):
+    def _output(self, key, shape, dtype):
+        """
+        :param key: (str) the field
+        :param shape: (tuple) shape of the output of the field
+        :param dtype: (np.dtype) dtype of the output of the field
+        :return: (np.ndarray) the output array of the field, reused by the calls to `get`
         """
-        Get the stacked frames of an observation
+        out = self._out.get(key)
+        if out is None:
+            out = self._out[key] = np.empty(shape, dtype=dtype)
+        return out
 
-        :param enc_obs: ([float]) the encoded observation
-        :return: ([float]) the decoded observation
+    def decode(self, enc_obs, frame_idx=None, first_frames=None):
+        """
+        Get the stacked frames of the observations of sampled segments
+
+        :param enc_obs: (np.ndarray) without frame stacking, the observations of the segments, of shape
+            [n_env, n_steps + 1] + observation shape. Otherwise, the stored frames, flattened on the first axis.
+        :param frame_idx: (np.ndarray) index in enc_obs of the frames of each stack (oldest first),
+            of shape [n_env, n_steps + 1, n_stack] (None without frame stacking)
+        :param first_frames: (np.ndarray) index of the first frame of each stack that is not zeroed,
+            of shape [n_env, n_steps + 1] (None without frame stacking)
+        :return: (np.ndarray) the decoded observations, of shape [n_env, n_steps + 1] + observation shape,
+            in an array reused by the next calls
         """
-        # enc_obs has shape [n_envs, n_steps + 1, nh, nw, nc]
-        # dones has shape [n_envs, n_steps, nh, nw, nc]
-        # returns stacked obs of shape [n_env, (n_steps + 1), nh, nw, nc]
         n_env, n_steps = self.n_env, self.n_steps
-        if self.raw_pixels:
-            obs_dim = [self.height, self.width, self.n_channels]
-        else:
-            obs_dim = [self.obs_dim]
-
-        obs = np.zeros([1, n_steps + 1, n_env] + obs_dim, dtype=self.obs_dtype)
-        # [n_steps + nstack, n_env, nh, nw, nc]
-        x_var = np.reshape(enc_obs, [n_env, n_steps + 1] + obs_dim).swapaxes(1, 0)
-        obs[-1, :] = x_var
-
-        if self.raw_pixels:
-            obs = obs.transpose((2, 1, 3, 4, 0, 5))
-        else:
-            obs = obs.transpose((2, 1, 3, 0))
-        return np.reshape(obs, [n_env, (n_steps + 1)] + obs_dim[:-1] + [obs_dim[-1]])
+        if self.n_stack == 1:
+            return np.reshape(enc_obs, (n_env, n_steps + 1) + self.obs_shape)
+
+        obs = self._output('obs', (n_env, n_steps + 1) + self.obs_shape, self.obs_dtype)
+        # The frames are stacked along the last axis, oldest first
+        stacked_view = obs.reshape((n_env, n_steps + 1) + self.frame_shape[:-1] + (self.n_stack, self.frame_shape[-1]))
+        for stack_idx in range(self.n_stack):
+            # Written in the block of the frame (faster than moving the stack axis of the gathered frames)
+            stacked_view[..., stack_idx, :] = enc_obs[frame_idx[..., stack_idx]]
+            # The frames older than the start of the episode are zeroed
+            stacked_view[..., stack_idx, :][first_frames > stack_idx] = 0
+        return obs
 
     def put(self, enc_obs, actions, rewards, mus, dones, masks):
         """
@@ -97,19 +134,36 @@ class Buffer(object):
         :param dones: ([bool])
         :param masks: ([bool])
         """
-        # enc_obs [n_env, (n_steps + n_stack), nh, nw, nc]
+        # enc_obs [n_env, (n_steps + 1), nh, nw, n_stack * nc]
         # actions, rewards, dones [n_env, n_steps]
         # mus [n_env, n_steps, n_act]
+        # masks [n_env, n_steps + 1], whether each observation is the first of an episode
 
-        if self.enc_obs is None:
-            self.enc_obs = np.empty([self.size] + list(enc_obs.shape), dtype=self.obs_dtype)
+        if self.actions is None:
+            self.enc_obs = np.empty([self.size, self.n_env, self.n_frames] + list(self.frame_shape),
+                                    dtype=self.obs_dtype)
+            self.first_frames = np.zeros([self.size] + list(masks.shape), dtype=np.int8)
             self.actions = np.empty([self.size] + list(actions.shape), dtype=np.int32)
             self.rewards = np.empty([self.size] + list(rewards.shape), dtype=np.float32)
             self.mus = np.empty([self.size] + list(mus.shape), dtype=np.float32)
             self.dones = np.empty([self.size] + list(dones.shape), dtype=np.bool)
             self.masks = np.empty([self.size] + list(masks.shape), dtype=np.bool)
 
-        self.enc_obs[self.next_idx] = enc_obs
+        enc_obs = np.reshape(enc_obs, (self.n_env, self.n_steps + 1) + self.obs_shape)
+        frames = self.enc_obs[self.next_idx]
+        if self.n_stack == 1:
+            frames[...] = enc_obs
+        else:
+            frame_size = self.frame_shape[-1]
+            # The older frames of the first stack, then the newest frame of each observation
+            first_stack = enc_obs[:, 0, ..., :-frame_size].reshape(
+                (self.n_env,) + self.frame_shape[:-1] + (self.n_stack - 1, frame_size))
+            frames[:, :self.n_stack - 1] = np.moveaxis(first_stack, -2, 1)
+            frames[:, self.n_stack - 1:] = enc_obs[..., -frame_size:]
+            # The frames preceding the last episode start of each stack are zeroed
+            steps = np.arange(self.n_steps + 1)
+            last_starts = np.maximum.accumulate(np.where(masks, steps, -self.n_stack), axis=1)
+            self.first_frames[self.next_idx] = np.clip(last_starts - steps + self.n_stack - 1, 0, self.n_stack - 1)
         self.actions[self.next_idx] = actions
         self.rewards[self.next_idx] = rewards
         self.mus[self.next_idx] = mus
@@ -128,16 +182,26 @@ class Buffer(object):
         :param envx: ([int]) the idx for the environments
         :return: ([float]) the askes frames from the list
         """
-        n_env = self.n_env
-        out = np.empty([n_env] + list(arr.shape[2:]), dtype=arr.dtype)
-        for i in range(n_env):
-            out[i] = arr[idx[i], envx[i]]
-        return out
+        return arr[idx, envx]
+
+    def _gather(self, key, arr, flat_idx):
+        """
+        Gather the sampled segments of a field, with one advanced index, into its output array
+
+        :param key: (str) the field
+        :param arr: (np.ndarray) the stored field, of shape [size, n_env, ...]
+        :param flat_idx: (np.ndarray) the indices of the sampled segments in the first two (flattened) axes
+        :return: (np.ndarray) the sampled segments, in an array reused by the next calls
+        """
+        out = self._output(key, flat_idx.shape + arr.shape[2:], arr.dtype)
+        return np.take(arr.reshape((-1,) + arr.shape[2:]), flat_idx, axis=0, out=out)
 
     def get(self):
         """
         randomly read a frame from the buffer
 
+        The returned arrays are overwritten by the next call.
+
         :return: ([float], [float], [float], [float], [bool], [float])
                  observations, actions, rewards, mus, dones, maskes
         """
@@ -151,12 +215,18 @@ class Buffer(object):
         # Sample exactly one id per env. If you sample across envs, then higher correlation in samples from same env.
         idx = np.random.randint(0, self.num_in_buffer, n_env)
         envx = np.arange(n_env)
+        flat_idx = idx * n_env + envx
 
-        dones = self.take(self.dones, idx, envx)
-        enc_obs = self.take(self.enc_obs, idx, envx)
-        obs = self.decode(enc_obs)
-        actions = self.take(self.actions, idx, envx)
-        rewards = self.take(self.rewards, idx, envx)
-        mus = self.take(self.mus, idx, envx)
-        masks = self.take(self.masks, idx, envx)
+        dones = self._gather('dones', self.dones, flat_idx)
+        if self.n_stack == 1:
+            obs = self.decode(self._gather('enc_obs', self.enc_obs, flat_idx))
+        else:
+            # Stack view: the frames of each stack are consecutive in the stored frames of the segment
+            frame_idx = flat_idx[:, np.newaxis, np.newaxis] * self.n_frames + self._stack_offsets
+            obs = self.decode(self.enc_obs.reshape((-1,) + self.frame_shape), frame_idx,
+                              self._gather('first_frames', self.first_frames, flat_idx))
+        actions = self._gather('actions', self.actions, flat_idx)
+        rewards = self._gather('rewards', self.rewards, flat_idx)
+        mus = self._gather('mus', self.mus, flat_idx)
+        masks = self._gather('masks', self.masks, flat_idx)
         return obs, actions, rewards, mus, dones, masks
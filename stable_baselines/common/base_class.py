@@ -38,10 +38,12 @@ class BaseRLModel(ABC):
         results, you must set `n_cpu_tf_sess` to 1.
     :param n_cpu_tf_sess: (int) The number of threads for TensorFlow operations
         If None, the number of cpu of the current machine will be used.
+    :param supports_vec_env: (bool) Can this model, which does not require a vectorized environment,
+        learn from a vectorized environment with more than one environment
     """
 
     def __init__(self, policy, env, verbose=0, *, requires_vec_env, policy_base,
-                 policy_kwargs=None, seed=None, n_cpu_tf_sess=None):
+                 policy_kwargs=None, seed=None, n_cpu_tf_sess=None, supports_vec_env=False):
         if isinstance(policy, str) and policy_base is not None:
             self.policy = get_policy_from_name(policy_base, policy)
         else:
@@ -49,6 +51,7 @@ class BaseRLModel(ABC):
         self.env = env
         self.verbose = verbose
         self._requires_vec_env = requires_vec_env
+        self._supports_vec_env = supports_vec_env
         self.policy_kwargs = {} if policy_kwargs is None else policy_kwargs
         self.observation_space = None
         self.action_space = None
@@ -82,6 +85,8 @@ class BaseRLModel(ABC):
                     if self.verbose >= 1:
                         print("Wrapping the env in a DummyVecEnv.")
                     self.n_envs = 1
+            elif supports_vec_env and isinstance(env, VecEnv) and env.num_envs > 1:
+                self.n_envs = env.num_envs
             else:
                 if isinstance(env, VecEnv):
                     if env.num_envs == 1:
@@ -139,6 +144,9 @@ class BaseRLModel(ABC):
                 "Error: the environment passed must have the same number of environments as the model was trained on." \
                 "This is due to the Lstm policy not being capable of changing the number of environments."
             self.n_envs = env.num_envs
+        elif self._supports_vec_env and isinstance(env, VecEnv) and env.num_envs > 1:
+            self._vectorize_action = False
+            self.n_envs = env.num_envs
         else:
             # for models that dont want vectorized environment, check if they make sense and adapt them.
             # Otherwise tell the user about this issue
@@ -294,18 +302,30 @@ class BaseRLModel(ABC):
 
         NOTE: only Box and Discrete spaces are supported for now.
 
+        The actor (and value function) updates of a minibatch are done in one session call. When the environment
+        is wrapped in a VecNormalize, its observation statistics are computed with one pass over the training set
+        beforehand, and are frozen during the pretraining. The minibatches are normalized on the host before the
+        feed (in place, the data loader returns copies): the observation placeholders returned by
+        `_get_pretrain_placeholders` belong to policies already built by the algorithm, so normalizing in the graph
+        would need each algorithm to build another instance of its policy on the normalized observations. For the
+        same reason, the minibatches come from the prefetching data loader rather than a `tf.data` pipeline.
+
         :param dataset: (ExpertDataset) Dataset manager
         :param n_epochs: (int) Number of iterations on the training set
         :param learning_rate: (float) Learning rate
         :param adam_epsilon: (float) the epsilon value for the adam optimizer
         :param val_interval: (int) Report training and validation losses every n epochs.
             By default, every 10th of the maximum number of epochs.
+        :param train_vf: (bool) Also train the value function on the value targets of the dataset
+            (the dataset must be created with ``use_vf=True``, continuous actions only)
+        :param discount_rate: (float) Unused, the discount factor of the value targets is the one of the dataset
         :return: (BaseRLModel) the pretrained model
         """
         continuous_actions = isinstance(self.action_space, gym.spaces.Box)
         discrete_actions = isinstance(self.action_space, gym.spaces.Discrete)
 
         assert discrete_actions or continuous_actions, 'Only Discrete and Box action spaces are supported'
+        assert not train_vf or continuous_actions, 'The value function can only be pretrained with Box action spaces'
 
         # Validate the model every 10% of the total number of iteration
         if val_interval is None:
@@ -319,11 +339,11 @@ class BaseRLModel(ABC):
             with tf.variable_scope('pretrain'):
                 if continuous_actions:
                     if train_vf:
-                        obs_ph, actions_ph, deterministic_actions_ph, vf_obs_ph, rew_ph, vf_ph = self._get_pretrain_placeholders(get_vf=True)
+                        obs_ph, actions_ph, deterministic_actions_ph, vf_obs_ph, vf_target_ph, vf_ph = \
+                            self._get_pretrain_placeholders(get_vf=True)
                     else:
                         obs_ph, actions_ph, deterministic_actions_ph = self._get_pretrain_placeholders()
                     loss = tf.reduce_mean(tf.square(actions_ph - deterministic_actions_ph))
-                    loss_vf = tf.reduce_mean(tf.square(rew_ph - vf_ph))
                 else:
                     obs_ph, actions_ph, actions_logits_ph = self._get_pretrain_placeholders()
                     # actions_ph has a shape if (n_batch,), we reshape it to (n_batch, 1)
@@ -337,22 +357,35 @@ class BaseRLModel(ABC):
                     loss = tf.reduce_mean(loss)
                 optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate, epsilon=adam_epsilon)
                 optim_op = optimizer.minimize(loss, var_list=self.params)
-                optimizer_vf = tf.train.AdamOptimizer(learning_rate=learning_rate, epsilon=adam_epsilon)
-                optim_op_vf = optimizer_vf.minimize(loss_vf, var_list=[var for var in self.params if var.name.startswith("model/vf")])
+                losses = [loss]
+                if train_vf:
+                    # The value targets are NaN for the timesteps without target: they are masked in the graph,
+                    # so that the whole minibatch is fed once for the actor and value updates
+                    has_target = tf.logical_not(tf.is_nan(vf_target_ph))
+                    vf_error = tf.where(has_target, vf_target_ph - vf_ph, tf.zeros_like(vf_ph))
+                    n_targets = tf.maximum(tf.reduce_sum(tf.cast(has_target, tf.float32)), 1.0)
+                    loss_vf = tf.reduce_sum(tf.square(vf_error)) / n_targets
+                    optimizer_vf = tf.train.AdamOptimizer(learning_rate=learning_rate, epsilon=adam_epsilon)
+                    optim_op_vf = optimizer_vf.minimize(loss_vf, var_list=[var for var in self.params
+                                                                           if var.name.startswith("model/vf")])
+                    optim_op = tf.group(optim_op, optim_op_vf)
+                    losses.append(loss_vf)
 
             self.sess.run(tf.global_variables_initializer())
 
-        is_vec_normalize = False
-        if isinstance(self.env, VecNormalize):
-            is_vec_normalize = True
-            # Pretrain Normalization over dataset
-            its = 0
-            while its < 1e5:
-                for _ in range(len(dataset.train_loader)):
-                    expert_obs, expert_actions, vf_vals = dataset.get_next_batch('train')
-                    obs = self.env._normalize_observation(expert_obs)
-                    #vf_vals = self.env._normalize_reward(np.array(vf_vals) * (1 - 0.99 / 1))
-                its += len(dataset.train_loader)
+        normalize_obs = isinstance(self.env, VecNormalize) and self.env.norm_obs
+        if normalize_obs and self.env.training:
+            self._update_obs_rms_from_dataset(dataset)
+
+        def _feed_dict(batch):
+            expert_obs = batch[0]
+            if normalize_obs:
+                # The minibatches are copies, they can be normalized in place
+                expert_obs, = self.env.normalize_obs_batches(expert_obs)
+            feed_dict = {obs_ph: expert_obs, actions_ph: batch[1]}
+            if train_vf:
+                feed_dict.update({vf_obs_ph: expert_obs, vf_target_ph: batch[2]})
+            return feed_dict
 
         if self.verbose > 0:
             print("Pretraining with Behavior Cloning...")
@@ -360,91 +393,53 @@ class BaseRLModel(ABC):
         self.env.training = False
 
         for epoch_idx in range(int(n_epochs)):
-            train_loss = 0.0
-            if train_vf:
-                train_loss_vf = 0.0
+            train_losses = np.zeros(len(losses))
             # Full pass on the training set
             for _ in range(len(dataset.train_loader)):
-                batch = dataset.get_next_batch('train')
-                expert_obs, expert_actions = batch[0], batch[1]
-                if is_vec_normalize:
-                    expert_obs = self.env._normalize_observation(expert_obs)
-
-                feed_dict = {
-                    obs_ph: expert_obs,
-                    actions_ph: expert_actions,
-                }
-
-                train_loss_, _ = self.sess.run([loss, optim_op], feed_dict)
-                train_loss += train_loss_
-
-                if train_vf:
-                    vf_vals = np.array(batch[2])
-
-                    #if is_vec_normalize:
-                    #    vf_vals = self.env._normalize_reward(vf_vals) * 1 / (1 - discount_rate)
-
-                    feed_dict = {
-                        vf_obs_ph: expert_obs[~np.isnan(vf_vals)],
-                        rew_ph: vf_vals[~np.isnan(vf_vals)]
-                    }
-
-                    train_loss_vf_, _ = self.sess.run([loss_vf, optim_op_vf], feed_dict)
-                    train_loss_vf += train_loss_vf_
-
-            train_loss /= len(dataset.train_loader)
-            if train_vf:
-                train_loss_vf /= len(dataset.train_loader)
+                train_losses += self.sess.run(losses + [optim_op], _feed_dict(dataset.get_next_batch('train')))[:-1]
+            train_losses /= len(dataset.train_loader)
 
             if self.verbose > 0 and (epoch_idx + 1) % val_interval == 0:
-                val_loss = 0.0
-                if train_vf:
-                    val_loss_vf = 0.0
+                val_losses = np.zeros(len(losses))
                 # Full pass on the validation set
                 for _ in range(len(dataset.val_loader)):
-                    batch = dataset.get_next_batch('val')
-                    expert_obs, expert_actions = batch[0], batch[1]
-                    if is_vec_normalize:
-                        expert_obs = self.env._normalize_observation(expert_obs)
-                    val_loss_, = self.sess.run([loss], {obs_ph: expert_obs,
-                                                        actions_ph: expert_actions})
-                    val_loss += val_loss_
-
-                    if train_vf:
-                        vf_vals = np.array(batch[2])
-
-                        #if is_vec_normalize:
-                        #    vf_vals = self.env._normalize_reward(vf_vals) * 1 / (1 - discount_rate)
-
-                        feed_dict = {
-                            vf_obs_ph: expert_obs[~np.isnan(vf_vals)],
-                            rew_ph: vf_vals[~np.isnan(vf_vals)]
-                        }
-
-                        val_loss_vf_, = self.sess.run([loss_vf], feed_dict)
-                        val_loss_vf += val_loss_vf_
-
-                val_loss /= len(dataset.val_loader)
-                if train_vf:
-                    val_loss_vf /= len(dataset.val_loader)
+                    val_losses += self.sess.run(losses, _feed_dict(dataset.get_next_batch('val')))
+                val_losses /= len(dataset.val_loader)
 
                 if self.verbose > 0:
                     print("==== Training progress {:.2f}% ====".format(100 * (epoch_idx + 1) / n_epochs))
                     print('Epoch {}'.format(epoch_idx + 1))
-                    print("Training loss: {:.6f}, Validation loss: {:.6f}".format(train_loss, val_loss))
+                    print("Training loss: {:.6f}, Validation loss: {:.6f}".format(train_losses[0], val_losses[0]))
                     if train_vf:
-                        print("VF Training loss: {:.6f}, Validation loss: {:.6f}".format(train_loss_vf, val_loss_vf))
+                        print("VF Training loss: {:.6f}, Validation loss: {:.6f}".format(train_losses[1],
+                                                                                        val_losses[1]))
                     print()
-            # Free memory
-            del expert_obs, expert_actions
-            if train_vf:
-                del vf_vals
 
         self.env.training = True
         if self.verbose > 0:
             print("Pretraining done.")
         return self
 
+    def _update_obs_rms_from_dataset(self, dataset, chunk_size=10000):
+        """
+        Update the observation statistics of the VecNormalize environment with one pass over the training set
+        of an expert dataset, merging the statistics of chunks of observations.
+
+        :param dataset: (ExpertDataset) Dataset manager
+        :param chunk_size: (int) number of observations per chunk
+        """
+        obs_rms = self.env.obs_rms
+        if dataset.train_loader.load_images:
+            # The images are loaded by the dataloader, one epoch covers the training set
+            for _ in range(len(dataset.train_loader)):
+                obs_rms.update(dataset.get_next_batch('train')[0])
+        else:
+            # The validation set is left out of the statistics (sorted, for sequential reads of the observations)
+            train_indices = np.sort(dataset.train_loader.original_indices)
+            for start in range(0, len(train_indices), chunk_size):
+                obs_rms.update(np.asarray(dataset.observations[train_indices[start:start + chunk_size]],
+                                          dtype=np.float64))
+
     @abstractmethod
     def learn(self, total_timesteps, callback=None, log_interval=100, tb_log_name="run",
               reset_num_timesteps=True):
@@ -1039,14 +1034,16 @@ class OffPolicyRLModel(BaseRLModel):
         results, you must set `n_cpu_tf_sess` to 1.
     :param n_cpu_tf_sess: (int) The number of threads for TensorFlow operations
         If None, the number of cpu of the current machine will be used.
+    :param supports_vec_env: (bool) Can this model learn from a vectorized environment with more than one environment
     """
 
     def __init__(self, policy, env, replay_buffer=None, _init_setup_model=False, verbose=0, *,
                  requires_vec_env=False, policy_base=None,
-                 policy_kwargs=None, seed=None, n_cpu_tf_sess=None, write_freq=1):
+                 policy_kwargs=None, seed=None, n_cpu_tf_sess=None, write_freq=1, supports_vec_env=False):
         super(OffPolicyRLModel, self).__init__(policy, env, verbose=verbose, requires_vec_env=requires_vec_env,
                                                policy_base=policy_base, policy_kwargs=policy_kwargs,
-                                               seed=seed, n_cpu_tf_sess=n_cpu_tf_sess)
+                                               seed=seed, n_cpu_tf_sess=n_cpu_tf_sess,
+                                               supports_vec_env=supports_vec_env)
 
         self.replay_buffer = replay_buffer
         self.write_freq = write_freq
@@ -1072,6 +1069,76 @@ class OffPolicyRLModel(BaseRLModel):
     def save(self, save_path, cloudpickle=False):
         pass
 
+    def _sample_vec_env_actions(self, n_actions=None):
+        """
+        Sample one random action per environment of a multi-env VecEnv (warmup or random exploration).
+
+        :param n_actions: (int) number of actions, defaults to the number of environments
+        :return: (np.ndarray) the actions, of shape (n_actions,) + action_space.shape
+        """
+        if n_actions is None:
+            n_actions = self.n_envs
+        return np.array([self.env.action_space.sample() for _ in range(n_actions)])
+
+    def _vec_env_reset(self):
+        """
+        Reset a multi-env VecEnv. When the VecEnv steps asynchronously (see SubprocVecEnv `async_batch_size`),
+        only the observations of the first ready environments are returned.
+
+        :return: (np.ndarray, np.ndarray) the observations and the indices of the corresponding environments
+        """
+        if getattr(self.env, "async_batch_size", None) is None:
+            return self.env.reset(), np.arange(self.n_envs)
+        assert not isinstance(self.env, VecEnvWrapper), \
+            "Error: asynchronous stepping requires the VecEnv not to be wrapped"
+        self.env.async_reset()
+        obs, _, _, _, env_ids = self.env.recv()
+        # Last observation and action of each environment, they form the transitions of the completed steps
+        self._async_obs = np.zeros((self.n_envs,) + obs.shape[1:], dtype=obs.dtype)
+        self._async_actions = np.zeros((self.n_envs,) + self.action_space.shape, dtype=np.float32)
+        return obs, env_ids
+
+    def _vec_env_step(self, obs, action, unscaled_action, env_ids):
+        """
+        Step the environments `env_ids` of a multi-env VecEnv (all of them unless it steps asynchronously).
+        When the VecEnv steps asynchronously, the transitions of the first environments whose step is completed
+        are returned, which may have been started by a previous call.
+
+        :param obs: (np.ndarray) the observations of the environments
+        :param action: (np.ndarray) the actions of the policy, scaled to [-1, 1]
+        :param unscaled_action: (np.ndarray) the actions sent to the environments
+        :param env_ids: (np.ndarray) the indices of the environments
+        :return: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, [dict], np.ndarray) the observations,
+            actions, new observations, rewards, dones, infos and environment indices of the completed steps
+        """
+        if getattr(self.env, "async_batch_size", None) is None:
+            new_obs, reward, done, infos = self.env.step(unscaled_action)
+            return obs, action, new_obs, reward, done, infos, env_ids
+        self._async_obs[env_ids] = obs
+        self._async_actions[env_ids] = action
+        self.env.send(unscaled_action, env_ids)
+        new_obs, reward, done, infos, done_ids = self.env.recv()
+        return self._async_obs[done_ids], self._async_actions[done_ids], new_obs, reward, done, infos, done_ids
+
+    @staticmethod
+    def _get_vec_env_next_obs(new_obs, dones, infos, terminal_obs_fn=None):
+        """
+        Retrieve the next observations to store in the replay buffer after a step of a multi-env VecEnv.
+        The VecEnv resets the environments that are done, their last observation is found in their info dict.
+
+        :param new_obs: (np.ndarray) the observations returned by the VecEnv
+        :param dones: (np.ndarray) the done flags returned by the VecEnv
+        :param infos: ([dict]) the info dicts returned by the VecEnv
+        :param terminal_obs_fn: (callable) transformation applied to the terminal observations (e.g. normalization)
+        :return: (np.ndarray) the next observations
+        """
+        next_obs = np.copy(new_obs)
+        for env_idx in np.flatnonzero(dones):
+            terminal_obs = infos[env_idx].get("terminal_observation")
+            if terminal_obs is not None:
+                next_obs[env_idx] = terminal_obs if terminal_obs_fn is None else terminal_obs_fn(terminal_obs)
+        return next_obs
+
     @classmethod
     def load(cls, load_path, env=None, custom_objects=None, **kwargs):
         """
@@ -1,4 +1,5 @@
 from collections import OrderedDict
+from typing import Union
 
 import numpy as np
 from gym import GoalEnv, spaces
@@ -101,11 +102,16 @@ class BitFlippingEnv(GoalEnv):
     def compute_reward(self,
                        achieved_goal: np.ndarray,
                        desired_goal: np.ndarray,
-                       _info) -> float:
+                       _info) -> Union[float, np.ndarray]:
         # Deceptive reward: it is positive only when the goal is achieved
-        if self.discrete_obs_space:
-            return 0.0 if achieved_goal == desired_goal else -1.0
-        return 0.0 if (achieved_goal == desired_goal).all() else -1.0
+        # Vectorized: achieved_goal and desired_goal can be batches of goals
+        achieved_goal, desired_goal = np.asarray(achieved_goal), np.asarray(desired_goal)
+        if achieved_goal.ndim == 0:
+            distance = np.abs(achieved_goal - desired_goal)
+        else:
+            distance = np.linalg.norm(achieved_goal - desired_goal, axis=-1)
+        reward = -(distance > 0).astype(np.float32)
+        return float(reward) if reward.ndim == 0 else reward
 
     def render(self, mode='human'):
         if mode == 'rgb_array':
@@ -1,5 +1,5 @@
 import random
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Tuple
 
 import numpy as np
 
@@ -7,17 +7,235 @@ from stable_baselines.common.segment_tree import SumSegmentTree, MinSegmentTree
 from stable_baselines.common.vec_env import VecNormalize
 
 
+class ColumnarStorage(object):
+    def __init__(self, size: int):
+        """
+        Array-backed storage for transitions, used by ReplayBuffer when ``columnar=True``.
+
+        One array of shape (size, *field_shape) is preallocated per transition field the first time a transition
+        is stored; transitions are then written in place and gathered with a single fancy index per field.
+        It behaves like the list it replaces: indexing with an int returns the transition as a tuple.
+
+        :param size: (int) Max number of transitions to store
+        """
+        self._maxsize = int(size)
+        self._columns = None
+        self._len = 0
+
+    # Fields that are not stored in their own array but rebuilt from the other ones (see SharedObsStorage)
+    _derived_fields = ()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError("storage index out of range")
+        return tuple(values[0] for values in self.gather([idx]))
+
+    def __setitem__(self, idx, data):
+        for column, value in zip(self._columns, data):
+            if column is not None:
+                column[idx] = value
+
+    def __iter__(self):
+        for idx in range(self._len):
+            yield self[idx]
+
+    @property
+    def columns(self) -> List[np.ndarray]:
+        """[np.ndarray]: the preallocated arrays, one per transition field (None before the first write)"""
+        return self._columns
+
+    def _allocate(self, data):
+        """
+        Allocate one array per field, using the shape and dtype of a single transition.
+
+        :param data: (tuple) a transition (obs_t, action, reward, obs_tp1, done, *extra_data)
+        """
+        self._columns = []
+        for field_idx, value in enumerate(data):
+            if field_idx in self._derived_fields:
+                self._columns.append(None)
+                continue
+            value = np.asarray(value)
+            dtype = value.dtype
+            if field_idx == 2:
+                # Rewards are often returned as ints by discrete environments
+                dtype = np.result_type(dtype, np.float32)
+            self._columns.append(np.zeros((self._maxsize,) + value.shape, dtype=dtype))
+
+    def append(self, data):
+        """
+        Store a transition in the first free slot.
+
+        :param data: (tuple) the transition
+        """
+        if self._columns is None:
+            self._allocate(data)
+        self[self._len] = data
+        self._len += 1
+
+    def write(self, start: int, data):
+        """
+        Store a batch of transitions starting at index ``start``, wrapping around at the end of the storage.
+
+        :param start: (int) index of the first transition to write
+        :param data: ([np.ndarray]) one array per field, the first dimension being the batch
+        :return: (int) the index following the last written transition
+        """
+        data = [np.asarray(values) for values in data]
+        n_transitions = len(data[0])
+        if n_transitions == 0:
+            return start
+        if self._columns is None:
+            self._allocate([values[0] for values in data])
+        if n_transitions > self._maxsize:
+            # Only the last transitions would survive the overwrite
+            start = (start + n_transitions - self._maxsize) % self._maxsize
+            data = [values[-self._maxsize:] for values in data]
+            n_transitions = self._maxsize
+
+        first = min(n_transitions, self._maxsize - start)
+        for column, values in zip(self._columns, data):
+            if column is None:
+                continue
+            column[start:start + first] = values[:first]
+            column[:n_transitions - first] = values[first:]
+        self._len = max(self._len, min(start + n_transitions, self._maxsize))
+        return (start + n_transitions) % self._maxsize
+
+    def gather(self, idxes) -> List[np.ndarray]:
+        """
+        Gather the transitions at the given indexes.
+
+        :param idxes: (Union[List[int], np.ndarray]) indexes of the transitions
+        :return: ([np.ndarray]) one batch array per field
+        """
+        idxes = np.asarray(idxes, dtype=np.int64)
+        return [column[idxes] if column is not None else None for column in self._columns]
+
+
+class SharedObsStorage(ColumnarStorage):
+    def __init__(self, size: int):
+        """
+        Columnar storage that keeps each observation only once, used by ReplayBuffer when ``shared_obs=True``.
+
+        When a transition starts from the next observation of the transition stored just before it (consecutive
+        steps of the same episode), that next observation is not stored: it is read from the following slot at
+        gather time. The remaining next observations (episode ends, artificial HER transitions and the last stored
+        transition) are kept in a dictionary indexed by slot. The transitions of a batch written with `write` must
+        therefore be consecutive steps (e.g. of a single environment), otherwise all their next observations are
+        stored in the dictionary.
+
+        :param size: (int) Max number of transitions to store
+        """
+        super(SharedObsStorage, self).__init__(size)
+        self._next_obs = {}
+        self._has_next_obs = np.zeros((self._maxsize,), dtype=bool)
+        self._last_idx = None
+
+    _derived_fields = (3,)
+
+    def __setitem__(self, idx, data):
+        super(SharedObsStorage, self).__setitem__(idx, data)
+        obs_column = self._columns[0]
+        self._next_obs.pop(idx, None)
+        last_idx = self._last_idx
+        if last_idx is not None and self._has_next_obs[last_idx] and (last_idx + 1) % self._maxsize == idx and \
+                np.array_equal(self._next_obs[last_idx], obs_column[idx]):
+            # The previous transition continues with this one, its next observation is the current observation
+            del self._next_obs[last_idx]
+            self._has_next_obs[last_idx] = False
+        self._next_obs[idx] = np.array(data[3], dtype=obs_column.dtype)
+        self._has_next_obs[idx] = True
+        self._last_idx = idx
+
+    def write(self, start: int, data):
+        """
+        Store a batch of transitions starting at index ``start``, wrapping around at the end of the storage.
+
+        :param start: (int) index of the first transition to write
+        :param data: ([np.ndarray]) one array per field, the first dimension being the batch
+        :return: (int) the index following the last written transition
+        """
+        data = [np.asarray(values) for values in data]
+        n_transitions = len(data[0])
+        if n_transitions == 0:
+            return start
+        if n_transitions > self._maxsize:
+            # Only the last transitions would survive the overwrite
+            start = (start + n_transitions - self._maxsize) % self._maxsize
+            data = [values[-self._maxsize:] for values in data]
+            n_transitions = self._maxsize
+        last_idx = self._last_idx
+        next_idx = super(SharedObsStorage, self).write(start, data)
+        obs_column = self._columns[0]
+        obses_t, obses_tp1 = data[0].astype(obs_column.dtype, copy=False), data[3].astype(obs_column.dtype, copy=False)
+        idxes = (start + np.arange(n_transitions)) % self._maxsize
+
+        if last_idx is not None and self._has_next_obs[last_idx] and (last_idx + 1) % self._maxsize == start and \
+                np.array_equal(self._next_obs[last_idx], obs_column[start]):
+            # The previous transition continues with the first one of the batch
+            del self._next_obs[last_idx]
+            self._has_next_obs[last_idx] = False
+        for idx in idxes[self._has_next_obs[idxes]]:
+            self._next_obs.pop(int(idx), None)
+
+        # Inside the batch, the transitions whose next observation is not the observation of the following one
+        has_next_obs = np.ones((n_transitions,), dtype=bool)
+        has_next_obs[:-1] = np.any((obses_tp1[:-1] != obses_t[1:]).reshape(n_transitions - 1, -1), axis=1)
+        self._has_next_obs[idxes] = has_next_obs
+        for i in np.flatnonzero(has_next_obs):
+            self._next_obs[int(idxes[i])] = np.array(obses_tp1[i])
+        self._last_idx = int(idxes[-1])
+        return next_idx
+
+    @property
+    def n_next_obs(self) -> int:
+        """int: number of next observations stored explicitly"""
+        return len(self._next_obs)
+
+    def gather(self, idxes) -> List[np.ndarray]:
+        """
+        Gather the transitions at the given indexes, rebuilding the next observations.
+
+        :param idxes: (Union[List[int], np.ndarray]) indexes of the transitions
+        :return: ([np.ndarray]) one batch array per field
+        """
+        idxes = np.asarray(idxes, dtype=np.int64)
+        fields = super(SharedObsStorage, self).gather(idxes)
+        obses_tp1 = self._columns[0][(idxes + 1) % self._maxsize]
+        for i in np.flatnonzero(self._has_next_obs[idxes]):
+            obses_tp1[i] = self._next_obs[idxes[i]]
+        fields[3] = obses_tp1
+        return fields
+
+
 class ReplayBuffer(object):
     __name__ = "ReplayBuffer"
-    def __init__(self, size: int, extra_data_names=()):
+    def __init__(self, size: int, extra_data_names=(), columnar=False, shared_obs=False):
         """
         Implements a ring buffer (FIFO).
 
         :param size: (int)  Max number of transitions to store in the buffer. When the buffer overflows the old
             memories are dropped.
+        :param extra_data_names: ([str]) names of the extra data stored with each transition
+        :param columnar: (bool) Store the transitions in preallocated arrays (one per field) instead of a list of
+            tuples. This saves memory and makes sampling a single gather per field.
+        :param shared_obs: (bool) Store each observation only once: the next observation of a transition is
+            rebuilt from the observation of the following one, except at episode ends. Implies ``columnar``.
         """
-        self._storage = []
         self._maxsize = int(size)
+        self._columnar = columnar or shared_obs
+        if shared_obs:
+            self._storage = SharedObsStorage(self._maxsize)
+        elif columnar:
+            self._storage = ColumnarStorage(self._maxsize)
+        else:
+            self._storage = []
         self._next_idx = 0
         self._extra_data_names = sorted(extra_data_names)
 
@@ -34,6 +252,11 @@ class ReplayBuffer(object):
         """float: Max capacity of the buffer"""
         return self._maxsize
 
+    @property
+    def shared_obs(self) -> bool:
+        """bool: whether each observation is stored only once (see SharedObsStorage)"""
+        return isinstance(self._storage, SharedObsStorage)
+
     def can_sample(self, n_samples: int) -> bool:
         """
         Check if n_samples samples can be sampled
@@ -71,7 +294,7 @@ class ReplayBuffer(object):
             self._storage[self._next_idx] = data
         self._next_idx = (self._next_idx + 1) % self._maxsize
 
-    def extend(self, obs_t, action, reward, obs_tp1, done):
+    def extend(self, obs_t, action, reward, obs_tp1, done, *extra_data, **extra_data_kwargs):
         """
         add a new batch of transitions to the buffer
 
@@ -84,7 +307,12 @@ class ReplayBuffer(object):
         Note: uses the same names as .add to keep compatibility with named argument passing
                 but expects iterables and arrays with more than 1 dimensions
         """
-        for data in zip(obs_t, action, reward, obs_tp1, done):
+        batch = (obs_t, action, reward, obs_tp1, done, *extra_data,
+                 *[extra_data_kwargs[k] for k in sorted(extra_data_kwargs)])
+        if self._columnar:
+            self._next_idx = self._storage.write(self._next_idx, batch)
+            return
+        for data in zip(*batch):
             if self._next_idx >= len(self._storage):
                 self._storage.append(data)
             else:
@@ -101,6 +329,17 @@ class ReplayBuffer(object):
             return env.normalize_obs(obs)
         return obs
 
+    @staticmethod
+    def _normalize_obs_pair(obs: np.ndarray, next_obs: np.ndarray,
+                            env: Optional[VecNormalize] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Helper for normalizing the sampled observations and next observations together,
+        in place as they are gathered from the storage.
+        """
+        if env is not None:
+            return env.normalize_obs_batches(obs, next_obs)
+        return obs, next_obs
+
     @staticmethod
     def _normalize_reward(reward: np.ndarray,
                           env: Optional[VecNormalize] = None) -> np.ndarray:
@@ -112,6 +351,12 @@ class ReplayBuffer(object):
         return reward
 
     def _encode_sample(self, idxes: Union[List[int], np.ndarray], env: Optional[VecNormalize] = None):
+        if self._columnar:
+            obses_t, actions, rewards, obses_tp1, dones, *extra_columns = self._storage.gather(idxes)
+            extra_data = {name: extra_columns[i] for i, name in enumerate(self._extra_data_names)}
+            obses_t, obses_tp1 = self._normalize_obs_pair(obses_t, obses_tp1, env)
+            return obses_t, actions, self._normalize_reward(rewards, env), obses_tp1, dones, extra_data
+
         obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
         extra_data = {name: [] for name in self._extra_data_names}
         for i in idxes:
@@ -132,9 +377,9 @@ class ReplayBuffer(object):
 
         extra_data = {k: np.array(v) for k, v in extra_data.items()}
 
-        return self._normalize_obs(np.array(obses_t), env), np.array(actions), \
-               self._normalize_reward(np.array(rewards), env), self._normalize_obs(np.array(obses_tp1), env), \
-                np.array(dones), extra_data
+        obses_t, obses_tp1 = self._normalize_obs_pair(np.array(obses_t), np.array(obses_tp1), env)
+        return obses_t, np.array(actions), self._normalize_reward(np.array(rewards), env), obses_tp1, \
+            np.array(dones), extra_data
 
     def sample(self, batch_size: int, env: Optional[VecNormalize] = None, **_kwargs):
         """
@@ -151,7 +396,10 @@ class ReplayBuffer(object):
             - done_mask: (numpy bool) done_mask[i] = 1 if executing act_batch[i] resulted in the end of an episode
                 and 0 otherwise.
         """
-        idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        if self._columnar:
+            idxes = np.random.randint(0, len(self._storage), size=batch_size)
+        else:
+            idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
         return self._encode_sample(idxes, env=env)
 
 
@@ -160,13 +408,32 @@ class RecurrentReplayBuffer(ReplayBuffer):
     __name__ = "RecurrentReplayBuffer"
 
     def __init__(self, size, sequence_length=1, scan_length=0, extra_data_names=(), rnn_inputs=(), her_k=4):
-        super().__init__(size)
-        self._sample_cycle = 0
+        """
+        Replay buffer of episodes, sampling sequences of consecutive transitions for recurrent policies.
+
+        The timesteps of the stored episodes are written contiguously in a preallocated ring of transitions
+        (see ColumnarStorage), an episode that does not fit at the end of the ring being written at its start.
+        The episodes are indexed by a ring of (start, length) entries, so that the sequences (and the scan
+        timesteps preceding them) are gathered with a single fancy index per field.
+
+        :param size: (int) Max number of timesteps to store in the buffer. When the buffer overflows the oldest
+            episodes are dropped.
+        :param sequence_length: (int) number of consecutive timesteps of each sampled sequence
+        :param scan_length: (int) number of timesteps preceding each sequence used to compute the RNN states
+        :param extra_data_names: ([str]) names of the extra data stored with each transition, only the first
+            timestep of the sequence (or of the scan) is returned for the data whose name contains "state"
+        :param rnn_inputs: ([str]) names of the data returned for the scan timesteps
+        :param her_k: (int) number of HER transitions that can be added for each timestep (see `add_her`)
+        """
+        super().__init__(size, columnar=True)
         self.her_k = her_k
         self._extra_data_names = sorted(extra_data_names)
         self._data_name_to_idx = {"obs": 0, "action": 1, "reward": 2, "obs_tp1": 3, "done": 4,
                                   **{name: 5 + i for i, name in enumerate(self._extra_data_names)}}
+        # For RNN states only the first state in the sequence (or in the scan) is sampled
+        self._state_names = [name for name in self._extra_data_names if "state" in name]
         self._current_episode_data = []
+        self._current_episode_her = {}
         self.sequence_length = sequence_length
         assert self.sequence_length >= 1
         self.scan_length = scan_length
@@ -174,115 +441,146 @@ class RecurrentReplayBuffer(ReplayBuffer):
         assert self.scan_length == 0 or len(self._rnn_inputs) > 0
         self._is_full = False
 
+        # Ring of the stored episodes, from the oldest (at _ep_head) to the newest
+        self._ep_capacity = self._maxsize // (self.sequence_length + self.scan_length) + 1
+        self._ep_start = np.zeros((self._ep_capacity,), dtype=np.int64)
+        self._ep_len = np.zeros((self._ep_capacity,), dtype=np.int64)
+        self._ep_head = 0
+        self._n_episodes = 0
+        self._n_stored = 0
+
+        # HER transitions (obs, reward, obs_tp1) of each timestep, allocated by the first call to add_her
+        self._her_columns = None
+        self._n_her = None
+
     def add(self, obs_t, action, reward, obs_tp1, done, *extra_data, **extra_data_kwargs):
-        if self.her_k > 0:
-            obs_t = [obs_t]
-            obs_tp1 = [obs_tp1]
-            reward = [reward]
-        data = [obs_t, action, reward, obs_tp1, done, *extra_data, *[extra_data_kwargs[k] for k in sorted(extra_data_kwargs)]]  # Data needs to be mutable
+        data = [obs_t, action, reward, obs_tp1, done, *extra_data,
+                *[extra_data_kwargs[k] for k in sorted(extra_data_kwargs)]]
         self._current_episode_data.append(data)
-        self._sample_cycle += 1
         if done:
             self.store_episode()
 
+    def _pop_episode(self):
+        """
+        Drop the oldest stored episode.
+        """
+        self._n_stored -= self._ep_len[self._ep_head]
+        self._ep_head = (self._ep_head + 1) % self._ep_capacity
+        self._n_episodes -= 1
+
+    def _reserve(self, n_steps):
+        """
+        Find where to write an episode, dropping the episodes it overwrites.
+
+        :param n_steps: (int) length of the episode
+        :return: (int) index of the first timestep of the episode in the storage
+        """
+        assert n_steps <= self._maxsize, "The episode is longer than the buffer"
+        start = self._next_idx
+        if start + n_steps > self._maxsize:
+            # The episode does not fit at the end of the storage: drop the (oldest) episodes stored there
+            while self._n_episodes > 0 and self._ep_start[self._ep_head] >= start:
+                self._pop_episode()
+            start = 0
+            self._is_full = True
+        while self._n_episodes > 0 and start <= self._ep_start[self._ep_head] < start + n_steps:
+            self._pop_episode()
+        self._next_idx = start + n_steps
+        return start
+
     def store_episode(self):
-        if len(self._current_episode_data) >= self.sequence_length + self.scan_length:
-            if self._sample_cycle >= self.buffer_size:
-                self._next_idx = 0
-                self._sample_cycle = 0
-                self._is_full = True
-            if not self._is_full:
-                self._storage.append(self._current_episode_data)
-            else:
-                try:
-                    self._storage[self._next_idx] = self._current_episode_data 
-                except IndexError:
-                    self._storage.append(self._current_episode_data)
-                self._next_idx += 1
-        else:
-            if self.her_k > 0:
-                self._sample_cycle -= sum([len(t[0]) for t in self._current_episode_data])
-            else:
-                self._sample_cycle -= len(self._current_episode_data)
+        n_steps = len(self._current_episode_data)
+        if n_steps >= self.sequence_length + self.scan_length:
+            start = self._reserve(n_steps)
+            n_fields = len(self._current_episode_data[0])
+            self._storage.write(start, [np.array([step_data[field_idx] for step_data in self._current_episode_data])
+                                        for field_idx in range(n_fields)])
+            if self._n_her is not None:
+                self._n_her[start:start + n_steps] = 0
+            for timestep, her_data in self._current_episode_her.items():
+                for obs, reward, obs_tp1 in her_data:
+                    self._write_her(start + timestep, obs, reward, obs_tp1)
+
+            ep_slot = (self._ep_head + self._n_episodes) % self._ep_capacity
+            self._ep_start[ep_slot] = start
+            self._ep_len[ep_slot] = n_steps
+            self._n_episodes += 1
+            self._n_stored += n_steps
         self._current_episode_data = []
+        self._current_episode_her = {}
+
+    def _write_her(self, idx, obs, reward, obs_tp1):
+        """
+        Store a HER transition of the timestep at index idx of the storage.
+        """
+        if self._her_columns is None:
+            self._her_columns = [np.zeros((self._maxsize, self.her_k + 2) + np.shape(value),
+                                          dtype=np.asarray(value).dtype)
+                                 for value in (obs, reward, obs_tp1)]
+            self._n_her = np.zeros((self._maxsize,), dtype=np.int16)
+        her_idx = self._n_her[idx]
+        # Sampling picks one of the first her_k + 2 HER transitions of a timestep
+        if her_idx < self.her_k + 2:
+            for column, value in zip(self._her_columns, (obs, reward, obs_tp1)):
+                column[idx, her_idx] = value
+            self._n_her[idx] += 1
 
     def add_her(self, obs, obs_tp1, reward, timestep, ep_index=None):
         assert self.her_k > 0
         if ep_index is not None:
-            episode_data = self._storage[ep_index]
+            self._write_her(self._ep_start[ep_index] + timestep, obs, reward, obs_tp1)
         else:
-            episode_data = self._current_episode_data
-        episode_data[timestep][0].append(obs)
-        episode_data[timestep][2].append(reward)
-        episode_data[timestep][3].append(obs_tp1)
-        self._sample_cycle += 1
+            self._current_episode_her.setdefault(timestep, []).append((obs, reward, obs_tp1))
 
     def sample(self, batch_size, sequence_length=None, **_kwargs):
         if sequence_length is None:
             sequence_length = self.sequence_length
         assert batch_size % sequence_length == 0
+        n_sequences = batch_size // sequence_length
+
+        ep_idxes = (self._ep_head + np.random.randint(0, self._n_episodes, size=n_sequences)) % self._ep_capacity
+        ep_starts = self._ep_start[ep_idxes]
+        ep_ts = np.random.randint(self.scan_length, self._ep_len[ep_idxes] - sequence_length + 1)
+        seq_idxes = ((ep_starts + ep_ts)[:, None] + np.arange(sequence_length)).ravel()
+
+        obses_t, actions, rewards, obses_tp1, dones, *extra_columns = self._storage.gather(seq_idxes)
+        if self.her_k > 0 and self._her_columns is not None:
+            # One of the stored HER transitions for each sequence, 0 being the original transition
+            her_idxes = np.repeat(np.random.randint(0, self.her_k + 3, size=n_sequences), sequence_length) - 1
+            use_her = (her_idxes >= 0) & (her_idxes < self._n_her[seq_idxes])
+            her_columns = [column[seq_idxes[use_her], her_idxes[use_her]] for column in self._her_columns]
+            obses_t[use_her], rewards[use_her], obses_tp1[use_her] = her_columns
+
+        extra_data = {}
+        state_idxes = ep_starts + ep_ts - self.scan_length
+        for name, values in zip(self._extra_data_names, extra_columns):
+            if name in self._state_names:
+                extra_data[name] = self._storage.columns[self._data_name_to_idx[name]][state_idxes]
+            else:
+                extra_data[name] = values
+        if self.scan_length > 0:
+            scan_idxes = (state_idxes[:, None] + np.arange(self.scan_length)).ravel()
+            for scan_data_name in self._rnn_inputs:
+                column = self._storage.columns[self._data_name_to_idx[scan_data_name]]
+                extra_data["scan_{}".format(scan_data_name)] = column[scan_idxes]
 
-        ep_idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size // sequence_length)]
-        ep_ts = [random.randint(self.scan_length, len(self._storage[ep_i]) - 1 - (sequence_length - 1)) for ep_i in
-                 ep_idxes]
-        extra_data = {name: [] for name in self._extra_data_names}
-        extra_data.update({"scan_{}".format(name): [] for name in self._rnn_inputs})
-
-        obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
-        for i, ep_i in enumerate(ep_idxes):
-            ep_data = self.storage[ep_i]
-            ep_t = ep_ts[i]
-            if self.her_k > 0:
-                her_idx = random.randint(0, self.her_k + 2)
-            for scan_t in range(ep_t - self.scan_length, ep_t):
-                for scan_data_name in self._rnn_inputs:
-                    data = ep_data[scan_t][self._data_name_to_idx[scan_data_name]]
-                    if self.her_k > 0 and self._data_name_to_idx[scan_data_name] in [self._data_name_to_idx[n] for n in
-                                                                                     ["obs", "reward", "obs_tp1"]]:
-                        data = data[0]
-                    extra_data["scan_{}".format(scan_data_name)].append(data)
-            for seq_i in range(sequence_length):
-                obs_t, action, reward, obs_tp1, done, *extra_timestep_data = ep_data[ep_t + seq_i]
-                if self.her_k > 0:
-                    try:  # TODO: fix indexing with last timestep data not having her data
-                        obs_t, obs_tp1, reward = obs_t[her_idx], obs_tp1[her_idx], reward[her_idx]
-                    except IndexError:
-                        obs_t, obs_tp1, reward = obs_t[0], obs_tp1[0], reward[0]
-                obses_t.append(np.array(obs_t, copy=False))
-                actions.append(np.array(action, copy=False))
-                rewards.append(reward)
-                obses_tp1.append(np.array(obs_tp1, copy=False))
-                dones.append(done)
-                for data_i, extra_data_name in enumerate(self._extra_data_names):
-                    if "state" in extra_data_name:
-                        if seq_i > 0:  # For RNN states only get the first state in the sequence (or in the scan)
-                            continue
-                        data = ep_data[ep_t + seq_i - self.scan_length][self._data_name_to_idx[extra_data_name]]
-                    else:
-                        data = extra_timestep_data[data_i]
-                    if np.ndim(data) == 0:
-                        extra_data[extra_data_name].append(data)
-                    else:
-                        extra_data[extra_data_name].append(np.array(data, copy=False))
-
-        extra_data = {k: np.array(v) for k, v in extra_data.items()}
-        extra_data["state_idxs"] = list(zip(ep_idxes, [t + sequence_length for t in ep_ts]))
+        extra_data["state_idxs"] = list(zip(ep_idxes, ep_ts + sequence_length))
         if self.scan_length > 0:
             extra_data["state_idxs_scan"] = list(zip(ep_idxes, ep_ts))
 
-        return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones), extra_data
+        return obses_t, actions, rewards, obses_tp1, dones, extra_data
 
     def update_state(self, idxs, data):
-        for i, (ep_idx, t) in enumerate(idxs):
-            try:
-                for state_name, state_val in data.items():
-                    self.storage[ep_idx][t][self._data_name_to_idx[state_name]] = state_val[i, :]
-            except IndexError:  # Hidden state computed for last sample in episode, doesnt belong to any sample
-                pass
+        idxs = np.asarray(idxs, dtype=np.int64).reshape(-1, 2)
+        ep_idxes, ts = idxs[:, 0], idxs[:, 1]
+        # Hidden state computed for last sample in episode, doesnt belong to any sample
+        valid = ts < self._ep_len[ep_idxes]
+        idxes = self._ep_start[ep_idxes[valid]] + ts[valid]
+        for state_name, state_val in data.items():
+            self._storage.columns[self._data_name_to_idx[state_name]][idxes] = np.asarray(state_val)[valid]
 
-    def __len__(self):  # TODO: consider if this is important enough to do right
-        return max(self._sample_cycle - ((len(self._current_episode_data) - 1) * (1 + self.her_k) + 1), 0) \
-            if not self._is_full else self.buffer_size
+    def __len__(self):
+        return int(self._n_stored)
 
     def is_full(self):
         return self._is_full
@@ -467,7 +765,7 @@ class DRRecurrentReplayBuffer(ReplayBuffer):
 class PrioritizedReplayBuffer(ReplayBuffer):
     __name__ = "PrioritizedReplayBuffer"
 
-    def __init__(self, size, alpha):
+    def __init__(self, size, alpha, columnar=False, shared_obs=False):
         """
         Create Prioritized Replay buffer.
 
@@ -476,8 +774,10 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         :param size: (int) Max number of transitions to store in the buffer. When the buffer overflows the old memories
             are dropped.
         :param alpha: (float) how much prioritization is used (0 - no prioritization, 1 - full prioritization)
+        :param columnar: (bool) Store the transitions in preallocated arrays (see ReplayBuffer)
+        :param shared_obs: (bool) Store each observation only once (see ReplayBuffer)
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
+        super(PrioritizedReplayBuffer, self).__init__(size, columnar=columnar, shared_obs=shared_obs)
         assert alpha >= 0
         self._alpha = alpha
 
@@ -489,6 +789,21 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
 
+    def adopt_storage(self, replay_buffer):
+        """
+        Take over the transitions of a ReplayBuffer in place (they are not copied), with the max priority.
+
+        :param replay_buffer: (ReplayBuffer) the buffer whose storage is taken over, of the same size
+        """
+        assert replay_buffer.buffer_size == self._maxsize
+        self._storage = replay_buffer.storage
+        self._columnar = replay_buffer._columnar
+        self._next_idx = replay_buffer._next_idx
+        self._extra_data_names = replay_buffer._extra_data_names
+        idxes = np.arange(len(self._storage))
+        self._it_sum[idxes] = self._max_priority ** self._alpha
+        self._it_min[idxes] = self._max_priority ** self._alpha
+
     def add(self, obs_t, action, reward, obs_tp1, done):
         """
         add a new transition to the buffer
@@ -519,10 +834,9 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         """
         idx = self._next_idx
         super().extend(obs_t, action, reward, obs_tp1, done)
-        while idx != self._next_idx:
-            self._it_sum[idx] = self._max_priority ** self._alpha
-            self._it_min[idx] = self._max_priority ** self._alpha
-            idx = (idx + 1) % self._maxsize
+        idxes = (idx + np.arange(min(len(obs_t), self._maxsize))) % self._maxsize
+        self._it_sum[idxes] = self._max_priority ** self._alpha
+        self._it_min[idxes] = self._max_priority ** self._alpha
 
     def _sample_proportional(self, batch_size):
         mass = []
@@ -587,21 +901,35 @@ class PrioritizedReplayBuffer(ReplayBuffer):
 
 
 class DiscrepancyReplayBuffer(ReplayBuffer):
-    def __init__(self, size, scorer):
+    def __init__(self, size, scorer, score_batch_size=256, rescore_chunk_size=10000):
         """
-        Create Prioritized Replay buffer.
+        Create Prioritized Replay buffer, the transitions being sampled proportionally to their score
+        (scaled to [0.1, 1]).
+
+        The scores are kept in a preallocated array and the scaled scores in a sum tree, so that sampling is
+        O(log n) per transition. New transitions are scored in batches, they have the max scaled score until then.
 
         See Also ReplayBuffer.__init__
 
         :param size: (int) Max number of transitions to store in the buffer. When the buffer overflows the old memories
             are dropped.
-        :param alpha: (float) how much prioritization is used (0 - no prioritization, 1 - full prioritization)
+        :param scorer: (function (np.ndarray): np.ndarray) computes the scores of a batch of next observations
+        :param score_batch_size: (int) number of new transitions scored together
+        :param rescore_chunk_size: (int) number of transitions scored together by `update_priorities`
         """
         super(DiscrepancyReplayBuffer, self).__init__(size)
-        self.scores = []
+        self.scores = np.zeros((self._maxsize,), dtype=np.float64)
         self.scorer = scorer
+        self.score_batch_size = score_batch_size
+        self.rescore_chunk_size = rescore_chunk_size
         self.min_score = None
         self.max_score = None
+        self._pending_idxes = []
+
+        it_capacity = 1
+        while it_capacity < size:
+            it_capacity *= 2
+        self._it_sum = SumSegmentTree(it_capacity)
 
     def add(self, obs_t, action, reward, obs_tp1, done):
         """
@@ -614,19 +942,45 @@ class DiscrepancyReplayBuffer(ReplayBuffer):
         :param done: (bool) is the episode done
         """
         idx = self._next_idx
+        super().add(obs_t, action, reward, obs_tp1, done)
+        self._it_sum[idx] = 1.0
+        self._pending_idxes.append(idx)
+        if len(self._pending_idxes) >= self.score_batch_size:
+            self._score_pending()
 
-        score = self.scorer(np.expand_dims(obs_tp1, axis=0))[0][0]
-        if self.min_score is None or score < self.min_score:
-            self.min_score = score
-        if self.max_score is None or score > self.max_score:
-            self.max_score = score
-        if self._next_idx >= len(self._storage):
-            self.scores.append(score)
-        else:
-            self.scores[idx] = score
+    def _score(self, idxes):
+        """
+        :param idxes: (np.ndarray) indexes of the transitions to score
+        :return: (np.ndarray) the scores of their next observations
+        """
+        obses_tp1 = np.array([self._storage[idx][3] for idx in idxes])
+        return np.reshape(self.scorer(obses_tp1), (len(idxes), -1))[:, 0]
 
-        super().add(obs_t, action, reward, obs_tp1, done)
-        self.storage[-1] += (self.scorer(np.expand_dims(obs_tp1, axis=0)),)
+    def _score_pending(self):
+        """
+        Score the transitions added since the last call in one batch.
+        """
+        idxes = np.array(self._pending_idxes, dtype=np.int64)
+        self._pending_idxes = []
+        self._set_scores(idxes, self._score(idxes))
+
+    def _set_scores(self, idxes, scores):
+        """
+        Store the scores of transitions and update their sampling weights.
+
+        :param idxes: (np.ndarray) indexes of the transitions
+        :param scores: (np.ndarray) their scores
+        """
+        self.scores[idxes] = scores
+        min_score, max_score = np.min(scores), np.max(scores)
+        if self.min_score is None or min_score < self.min_score or max_score > self.max_score:
+            self.min_score = min_score if self.min_score is None else min(self.min_score, min_score)
+            self.max_score = max_score if self.max_score is None else max(self.max_score, max_score)
+            # The scaling changed, rescale the weights of all the scored transitions
+            scored = np.ones((len(self),), dtype=bool)
+            scored[self._pending_idxes] = False
+            idxes = np.flatnonzero(scored)
+        self._it_sum[idxes] = self._scale_scores(self.scores[idxes])
 
     def sample(self, batch_size, **_kwargs):
         """
@@ -652,27 +1006,26 @@ class DiscrepancyReplayBuffer(ReplayBuffer):
         if not self.can_sample(batch_size):
             return self._encode_sample(list(range(len(self))))
 
-        scores = self._scale_scores(np.array(self.scores))
-        idxs = np.random.choice(np.arange(len(scores)), size=(batch_size,), p=scores / np.sum(scores), replace=False)
+        if len(self._pending_idxes) > 0:
+            self._score_pending()
+        mass = np.random.random(size=batch_size) * self._it_sum.sum()
+        idxs = self._it_sum.find_prefixsum_idx(mass)
 
         return self._encode_sample(idxs)
 
     def update_priorities(self):
         """
-        Update priorities of sampled transitions.
-
-        sets priority of transition at index idxes[i] in buffer
-        to priorities[i].
-
-        :param idxes: ([int]) List of idxes of sampled transitions
-        :param priorities: ([float]) List of updated priorities corresponding to transitions at the sampled idxes
-            denoted by variable `idxes`.
+        Rescore all the stored transitions, by chunks of `rescore_chunk_size` transitions.
         """
-        scores = self.scorer([transition[0] for transition in self.storage])[:, 0]
-        for i, transition in enumerate(self.storage):
-            transition[-1] = scores[i]
+        if len(self._pending_idxes) > 0:
+            self._score_pending()
+        for start in range(0, len(self), self.rescore_chunk_size):
+            idxes = np.arange(start, min(start + self.rescore_chunk_size, len(self)))
+            self._set_scores(idxes, self._score(idxes))
 
     def _scale_scores(self, vals):
+        if self.max_score == self.min_score:
+            return np.ones_like(vals)
         return (vals - self.min_score) / (self.max_score - self.min_score) * (1 - 0.1) + 0.1
 
 
@@ -681,19 +1034,27 @@ class StableReplayBuffer(ReplayBuffer):
 
     def __init__(self, size):
         """
-        Create Prioritized Replay buffer.
+        Create Prioritized Replay buffer, the transitions being sampled proportionally to their score clipped to
+        the 10th and 90th percentiles of the stored scores.
+
+        The clipped scores are kept in a sum tree, so that sampling does not depend on the buffer size. The
+        percentiles are only recomputed by `update_priorities`.
 
         See Also ReplayBuffer.__init__
 
         :param size: (int) Max number of transitions to store in the buffer. When the buffer overflows the old memories
             are dropped.
-        :param alpha: (float) how much prioritization is used (0 - no prioritization, 1 - full prioritization)
         """
         super(StableReplayBuffer, self).__init__(size)
-        self.scores = []
+        self.scores = np.full((self._maxsize,), np.nan, dtype=np.float64)
         self.lower_clip = None
         self.upper_clip = None
 
+        it_capacity = 1
+        while it_capacity < size:
+            it_capacity *= 2
+        self._it_sum = SumSegmentTree(it_capacity)
+
     def add(self, obs_t, action, reward, obs_tp1, done, score=None):
         """
         add a new transition to the buffer
@@ -703,15 +1064,21 @@ class StableReplayBuffer(ReplayBuffer):
         :param reward: (float) the reward of the transition
         :param obs_tp1: (Any) the current observation
         :param done: (bool) is the episode done
+        :param score: (float) the score of the transition, transitions without score get the upper clip
         """
         idx = self._next_idx
-
-        if self._next_idx >= len(self._storage):
-            self.scores.append(score)
-        else:
-            self.scores[idx] = score
-
         super().add(obs_t, action, reward, obs_tp1, done)
+        self.scores[idx] = np.nan if score is None else score
+        self._it_sum[idx] = self._clip_scores(self.scores[idx:idx + 1])[0]
+
+    def _clip_scores(self, scores):
+        """
+        :param scores: (np.ndarray) scores of transitions
+        :return: (np.ndarray) their sampling weights: the scores clipped to the cached percentiles
+        """
+        if self.lower_clip is None:
+            return np.where(np.isnan(scores), 1.0, scores)
+        return np.where(np.isnan(scores), self.upper_clip, np.clip(scores, self.lower_clip, self.upper_clip))
 
     def sample(self, batch_size, **_kwargs):
         """
@@ -737,24 +1104,21 @@ class StableReplayBuffer(ReplayBuffer):
         if not self.can_sample(batch_size):
             return self._encode_sample(list(range(len(self))))
 
-        scores = np.array(self.scores)
-        scores = np.clip(scores, np.percentile(scores, 10), np.percentile(scores, 90))
-        idxs = np.random.choice(np.arange(len(self.scores)), size=(batch_size,), p=scores / np.sum(scores),
-                                replace=False)
+        if self.lower_clip is None:
+            self.update_priorities()
+        mass = np.random.random(size=batch_size) * self._it_sum.sum()
+        idxs = self._it_sum.find_prefixsum_idx(mass)
 
         return self._encode_sample(idxs)
 
     def update_priorities(self):
         """
-        Update priorities of sampled transitions.
-
-        sets priority of transition at index idxes[i] in buffer
-        to priorities[i].
-
-        :param idxes: ([int]) List of idxes of sampled transitions
-        :param priorities: ([float]) List of updated priorities corresponding to transitions at the sampled idxes
-            denoted by variable `idxes`.
+        Recompute the clipping bounds (10th and 90th percentiles of the stored scores)
+        and the sampling weights of all the stored transitions.
         """
-        self.lower_clip = np.percentile(self.scores, 10)
-        self.upper_clip = np.percentile(self.scores, 90)
+        scores = self.scores[:len(self)]
+        if np.all(np.isnan(scores)):
+            return
+        self.lower_clip, self.upper_clip = np.nanpercentile(scores, [10, 90])
+        self._it_sum[np.arange(len(self))] = self._clip_scores(scores)
 
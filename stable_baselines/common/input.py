@@ -3,7 +3,20 @@ import tensorflow as tf
 from gym.spaces import Discrete, Box, MultiBinary, MultiDiscrete
 
 
-def observation_input(ob_space, batch_size=None, name='Ob', scale=False):
+def _input_placeholder(shape, dtype, name, default=None):
+    """
+    :param shape: (tuple) shape of the placeholder
+    :param dtype: (tf.DType) dtype of the placeholder
+    :param name: (str) tensorflow variable name of the placeholder
+    :param default: (TensorFlow Tensor) value of the placeholder when it is not fed (None: the placeholder must be fed)
+    :return: (TensorFlow Tensor) the placeholder
+    """
+    if default is None:
+        return tf.placeholder(shape=shape, dtype=dtype, name=name)
+    return tf.placeholder_with_default(tf.cast(default, dtype), shape=shape, name=name)
+
+
+def observation_input(ob_space, batch_size=None, name='Ob', scale=False, default=None):
     """
     Build observation input with encoding depending on the observation space type
 
@@ -14,15 +27,17 @@ def observation_input(ob_space, batch_size=None, name='Ob', scale=False):
                        (default is None, so that resulting input placeholder can take tensors with any batch size)
     :param name: (str) tensorflow variable name for input placeholder
     :param scale: (bool) whether or not to scale the input
+    :param default: (TensorFlow Tensor) value of the input placeholder when it is not fed (e.g. observations stored
+        on the device), if None the placeholder must be fed
     :return: (TensorFlow Tensor, TensorFlow Tensor) input_placeholder, processed_input_tensor
     """
     if isinstance(ob_space, Discrete):
-        observation_ph = tf.placeholder(shape=(batch_size,), dtype=tf.int32, name=name)
+        observation_ph = _input_placeholder((batch_size,), tf.int32, name, default)
         processed_observations = tf.cast(tf.one_hot(observation_ph, ob_space.n), tf.float32)
         return observation_ph, processed_observations
 
     elif isinstance(ob_space, Box):
-        observation_ph = tf.placeholder(shape=(batch_size,) + ob_space.shape, dtype=ob_space.dtype, name=name)
+        observation_ph = _input_placeholder((batch_size,) + ob_space.shape, ob_space.dtype, name, default)
         processed_observations = tf.cast(observation_ph, tf.float32)
         # rescale to [1, 0] if the bounds are defined
         if (scale and
@@ -34,12 +49,12 @@ def observation_input(ob_space, batch_size=None, name='Ob', scale=False):
         return observation_ph, processed_observations
 
     elif isinstance(ob_space, MultiBinary):
-        observation_ph = tf.placeholder(shape=(batch_size, ob_space.n), dtype=tf.int32, name=name)
+        observation_ph = _input_placeholder((batch_size, ob_space.n), tf.int32, name, default)
         processed_observations = tf.cast(observation_ph, tf.float32)
         return observation_ph, processed_observations
 
     elif isinstance(ob_space, MultiDiscrete):
-        observation_ph = tf.placeholder(shape=(batch_size, len(ob_space.nvec)), dtype=tf.int32, name=name)
+        observation_ph = _input_placeholder((batch_size, len(ob_space.nvec)), tf.int32, name, default)
         processed_observations = tf.concat([
             tf.cast(tf.one_hot(input_split, ob_space.nvec[i]), tf.float32) for i, input_split
             in enumerate(tf.split(observation_ph, len(ob_space.nvec), axis=-1))
@@ -168,18 +168,20 @@ class BasePolicy(ABC):
     :param obs_phs: (TensorFlow Tensor, TensorFlow Tensor) a tuple containing an override for observation placeholder
         and the processed observation placeholder respectively
     :param add_action_ph: (bool) whether or not to create an action placeholder
+    :param obs_default: (TensorFlow Tensor) value of the observation placeholder when it is not fed
     """
 
     recurrent = False
 
     def __init__(self, sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=False, scale=False,
-                 obs_phs=None, add_action_ph=False):
+                 obs_phs=None, add_action_ph=False, obs_default=None):
         self.n_env = n_env
         self.n_steps = n_steps
         self.n_batch = n_batch
         with tf.variable_scope("input", reuse=False):
             if obs_phs is None:
-                self._obs_ph, self._processed_obs = observation_input(ob_space, n_batch, scale=scale)
+                self._obs_ph, self._processed_obs = observation_input(ob_space, n_batch, scale=scale,
+                                                                      default=obs_default)
             else:
                 self._obs_ph, self._processed_obs = obs_phs
 
@@ -279,11 +281,13 @@ class ActorCriticPolicy(BasePolicy):
     :param n_batch: (int) The number of batch to run (n_envs * n_steps)
     :param reuse: (bool) If the policy is reusable or not
     :param scale: (bool) whether or not to scale the input
+    :param obs_default: (TensorFlow Tensor) value of the observation placeholder when it is not fed
     """
 
-    def __init__(self, sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=False, scale=False, box_dist_type="gaussian"):
+    def __init__(self, sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=False, scale=False, box_dist_type="gaussian",
+                 obs_default=None):
         super(ActorCriticPolicy, self).__init__(sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=reuse,
-                                                scale=scale)
+                                                scale=scale, obs_default=obs_default)
         self._pdtype = make_proba_dist_type(ac_space)
         self._is_discrete = isinstance(ac_space, Discrete)
         self._policy = None
@@ -616,8 +620,10 @@ class FeedForwardPolicy(ActorCriticPolicy):
     def __init__(self, sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=False, layers=None, net_arch=None,
                  act_fun=tf.tanh, cnn_extractor=nature_cnn, feature_extraction="cnn", dual_critic=False, **kwargs):
         box_dist_type = kwargs.pop("box_dist_type", "guassian")
+        obs_default = kwargs.pop("obs_default", None)
         super(FeedForwardPolicy, self).__init__(sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=reuse,
-                                                scale=(feature_extraction == "cnn"), box_dist_type=box_dist_type)
+                                                scale=(feature_extraction == "cnn"), box_dist_type=box_dist_type,
+                                                obs_default=obs_default)
 
         #self._kwargs_check(feature_extraction, kwargs)
 
@@ -0,0 +1,117 @@
+import numpy as np
+
+
+def compute_gae(rewards, values, dones, last_values, last_dones, gamma, lam, out=None):
+    """
+    Generalized Advantage Estimation, for the rollouts of several environments.
+    The temporal differences are computed for the whole rollouts at once, only the (linear) backward
+    recursion of the advantages is done step by step, for all the environments at once.
+
+    :param rewards: (np.ndarray) the rewards, of shape (n_envs, n_steps)
+    :param values: (np.ndarray) the value estimates, of shape (n_envs, n_steps)
+    :param dones: (np.ndarray) whether the observation of each step is the first of an episode,
+        of shape (n_envs, n_steps)
+    :param last_values: (np.ndarray) the value estimates of the observations following the rollouts, of shape (n_envs,)
+    :param last_dones: (np.ndarray) whether these observations are the first of an episode, of shape (n_envs,)
+    :param gamma: (float) Discount factor
+    :param lam: (float) Factor for trade-off of bias vs variance for Generalized Advantage Estimator
+    :param out: (np.ndarray) array receiving the advantages (allocated if None)
+    :return: (np.ndarray) the advantages, of shape (n_envs, n_steps)
+    """
+    next_nonterminal = np.empty(values.shape, dtype=values.dtype)
+    np.subtract(1.0, dones[:, 1:], out=next_nonterminal[:, :-1])
+    np.subtract(1.0, last_dones, out=next_nonterminal[:, -1])
+    next_values = np.empty_like(next_nonterminal)
+    next_values[:, :-1] = values[:, 1:]
+    next_values[:, -1] = last_values
+
+    # Temporal differences: rewards + gamma * next_values * next_nonterminal - values
+    deltas = np.multiply(next_values, next_nonterminal, out=next_values)
+    deltas *= gamma
+    deltas += rewards
+    deltas -= values
+    coefs = np.multiply(next_nonterminal, gamma * lam, out=next_nonterminal)
+
+    if out is None:
+        out = np.empty_like(deltas)
+    out[:, -1] = deltas[:, -1]
+    for step in range(values.shape[1] - 2, -1, -1):
+        np.multiply(coefs[:, step], out[:, step + 1], out=out[:, step])
+        out[:, step] += deltas[:, step]
+    return out
+
+
+class RolloutStorage(object):
+    def __init__(self, n_envs, n_steps, dtypes=None):
+        """
+        Storage of the transitions of on-policy rollouts, allocated at the first rollout and reused by the
+        next ones. The fields are stored in arrays of shape (n_envs, n_steps) + shape of the field, so that
+        their flattened versions (one rollout after the other) are views, without the swap of the axes.
+
+        :param n_envs: (int) number of environments
+        :param n_steps: (int) number of steps of the rollouts
+        :param dtypes: (dict) dtype of the fields (default: the dtype of the first values added)
+        """
+        self.n_envs = n_envs
+        self.n_steps = n_steps
+        self.dtypes = {} if dtypes is None else dtypes
+        self._arrays = {}
+
+    def __contains__(self, key):
+        return key in self._arrays
+
+    def __getitem__(self, key):
+        """
+        :param key: (str) the field
+        :return: (np.ndarray) the field, of shape (n_envs, n_steps) + shape of the field
+        """
+        return self._arrays[key]
+
+    def _get_array(self, key, step_shape, dtype):
+        """
+        :param key: (str) the field
+        :param step_shape: (tuple) shape of the values of the field for one environment and one step
+        :param dtype: (np.dtype) dtype of the field, if not given in `dtypes`
+        :return: (np.ndarray) the array of the field, allocated if needed
+        """
+        array = self._arrays.get(key)
+        if array is None:
+            array = np.zeros((self.n_envs, self.n_steps) + tuple(step_shape), dtype=self.dtypes.get(key, dtype))
+            self._arrays[key] = array
+        return array
+
+    def add(self, step, **fields):
+        """
+        Write the fields of a step of the rollouts, in place.
+
+        :param step: (int) the step
+        :param fields: (np.ndarray) the value of each field for the environments, with the environment as first axis
+        """
+        for key, value in fields.items():
+            value = np.asarray(value)
+            self._get_array(key, value.shape[1:], value.dtype)[:, step] = value
+
+    def flat(self, key):
+        """
+        :param key: (str) the field
+        :return: (np.ndarray) view of the field, of shape (n_envs * n_steps) + shape of the field,
+            the rollouts of the environments one after the other
+        """
+        array = self._arrays[key]
+        return array.reshape((self.n_envs * self.n_steps,) + array.shape[2:])
+
+    def compute_returns_and_advantages(self, last_values, last_dones, gamma, lam):
+        """
+        Compute the advantages (GAE) and the returns ('advantages' and 'returns' fields) from the 'rewards',
+        'values' and 'dones' fields.
+
+        :param last_values: (np.ndarray) the value estimates of the observations following the rollouts
+        :param last_dones: (np.ndarray) whether these observations are the first of an episode
+        :param gamma: (float) Discount factor
+        :param lam: (float) Factor for trade-off of bias vs variance for Generalized Advantage Estimator
+        """
+        values = self._arrays['values']
+        advantages = self._get_array('advantages', values.shape[2:], values.dtype)
+        compute_gae(self._arrays['rewards'], values, self._arrays['dones'], np.asarray(last_values),
+                    np.asarray(last_dones), gamma, lam, out=advantages)
+        np.add(advantages, values, out=self._get_array('returns', values.shape[2:], values.dtype))
@@ -2,18 +2,34 @@ import numpy as np
 
 
 class RunningMeanStd(object):
-    def __init__(self, epsilon=1e-4, shape=(), mean_mask=None):
+    def __init__(self, epsilon=1e-4, shape=(), mean_mask=None, buffer_size=1024):
         """
         calulates the running mean and std of a data stream
         https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
 
+        Single samples can be pushed into a preallocated buffer (see `push`), which is merged into the statistics
+        as one batch when it is full or when `flush` is called.
+
         :param epsilon: (float) helps with arithmetic issues
         :param shape: (tuple) the shape of the data stream's output
+        :param mean_mask: (np.ndarray) mask of the elements whose mean is kept at zero
+        :param buffer_size: (int) max number of samples pushed before they are merged into the statistics
         """
         self.mean = np.zeros(shape, 'float64')
         self.var = np.ones(shape, 'float64')
         self.count = epsilon
         self.mean_mask = mean_mask
+        self.buffer_size = buffer_size
+        # Allocated at the first `push`
+        self._buffer = None
+        self._n_buffered = 0
+
+    def __setstate__(self, state):
+        # Pickles saved before the buffer was added
+        state.setdefault('buffer_size', 1024)
+        state.setdefault('_buffer', None)
+        state.setdefault('_n_buffered', 0)
+        self.__dict__.update(state)
 
     def update(self, arr):
         batch_mean = np.mean(arr, axis=0)
@@ -30,37 +46,75 @@ class RunningMeanStd(object):
         new_mean = self.mean + delta * batch_count / tot_count
         m_a = self.var * self.count
         m_b = batch_var * batch_count
-        m_2 = m_a + m_b + np.square(delta) * self.count * batch_count / (self.count + batch_count)
-        new_var = m_2 / (self.count + batch_count)
-
-        new_count = batch_count + self.count
+        m_2 = m_a + m_b + np.square(delta) * self.count * batch_count / tot_count
+        new_var = m_2 / tot_count
 
         self.mean = new_mean
         self.var = new_var
-        self.count = new_count
-        
-        
-class RunningMeanStdSerial(object):
-    def __init__(self, epsilon=1e-4, shape=(), mean_mask=None):
+        self.count = tot_count
+
+    def push(self, samples):
         """
-        calulates the running mean and std of a data stream
-        https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+        Buffer samples, without updating the statistics until the buffer is full or `flush` is called.
+
+        :param samples: (np.ndarray) one sample, with the shape of the data stream, or a batch of samples
+        """
+        samples = np.asarray(samples)
+        if samples.shape == self.mean.shape:
+            samples = samples[None]
+        if self._buffer is None:
+            self._buffer = np.zeros((self.buffer_size,) + self.mean.shape, 'float64')
+        while len(samples) > 0:
+            n_copied = min(len(samples), self.buffer_size - self._n_buffered)
+            self._buffer[self._n_buffered:self._n_buffered + n_copied] = samples[:n_copied]
+            self._n_buffered += n_copied
+            samples = samples[n_copied:]
+            if self._n_buffered == self.buffer_size:
+                self.flush()
+
+    @property
+    def n_buffered(self):
+        """
+        :return: (int) number of samples pushed but not merged into the statistics yet
+        """
+        return self._n_buffered
+
+    def flush(self):
+        """
+        Merge the buffered samples into the statistics.
+        """
+        if self._n_buffered > 0:
+            RunningMeanStd.update(self, self._buffer[:self._n_buffered])
+            self._n_buffered = 0
+
+
+class RunningMeanStdSerial(RunningMeanStd):
+    def __init__(self, epsilon=1e-4, shape=(), mean_mask=None, buffer_size=1024):
+        """
+        running mean and std of a data stream updated one sample at a time (Welford's algorithm).
+        The samples can also be buffered with `push`, the statistics include them after `flush`.
 
         :param epsilon: (float) helps with arithmetic issues
         :param shape: (tuple) the shape of the data stream's output
+        :param mean_mask: (np.ndarray) mask of the elements whose mean is kept at zero (by the batch updates)
+        :param buffer_size: (int) max number of samples pushed before they are merged into the statistics
         """
-        self.mean = np.zeros(shape, 'float64')
-        self.var = np.ones(shape, 'float64')
-        self.count = epsilon
-        self.mean_mask = mean_mask
+        super(RunningMeanStdSerial, self).__init__(epsilon=epsilon, shape=shape, mean_mask=mean_mask,
+                                                   buffer_size=buffer_size)
         self.m2 = np.zeros(shape, "float64")
 
     def update(self, arr):
+        """
+        :param arr: (np.ndarray) one sample
+        """
         delta = arr - self.mean
         self.count += 1
-        
+
         self.mean += delta / self.count
         delta2 = arr - self.mean
         self.m2 += delta * delta2
         self.var = self.m2 / self.count
-        
+
+    def update_from_moments(self, batch_mean, batch_var, batch_count):
+        super(RunningMeanStdSerial, self).update_from_moments(batch_mean, batch_var, batch_count)
+        self.m2 = self.var * self.count
@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class ScenarioPool(object):
+    def __init__(self, capacity):
+        """
+        Pool of candidate initial states (scenarios) for active sampling. The observations of the candidates are
+        stored in a preallocated array, so that they are scored against the current critic in one batched call,
+        and the best-scored scenarios are selected with a partial sort.
+
+        :param capacity: (int) max number of candidates. When the pool is full, the new candidates replace
+            the ones with the lowest scores.
+        """
+        self.capacity = capacity
+        # Allocated at the first `add`, when the shape of the observations is known
+        self._obs = None
+        self._states = np.empty((capacity,), dtype=object)
+        # NaN for the candidates that have not been scored yet
+        self._scores = np.full((capacity,), np.nan)
+        # Index of the call to `score` that last scored each candidate (-1 if not scored yet)
+        self._scored_at = np.full((capacity,), -1, dtype=np.int64)
+        self._n_scorings = 0
+        self._n_candidates = 0
+
+    def __len__(self):
+        return self._n_candidates
+
+    @property
+    def n_unscored(self):
+        """
+        :return: (int) number of candidates added since the last call to `score`
+        """
+        return int(np.count_nonzero(np.isnan(self._scores[:self._n_candidates])))
+
+    def _ranking_scores(self):
+        """
+        :return: (np.ndarray) the scores of the candidates, the unscored ones being ranked last
+        """
+        scores = self._scores[:self._n_candidates]
+        return np.where(np.isnan(scores), -np.inf, scores)
+
+    def add(self, observations, states):
+        """
+        Add candidates to the pool.
+
+        :param observations: (np.ndarray) the first observations of the scenarios, used to score them
+        :param states: ([dict]) the scenarios, keyword arguments of the reset of the environment
+        """
+        observations = np.asarray(observations)
+        n_new = min(len(observations), self.capacity)
+        if n_new == 0:
+            return
+        observations, states = observations[-n_new:], list(states)[-n_new:]
+        if self._obs is None:
+            self._obs = np.zeros((self.capacity,) + observations.shape[1:], dtype=observations.dtype)
+
+        n_appended = min(n_new, self.capacity - self._n_candidates)
+        slots = np.arange(self._n_candidates, self._n_candidates + n_appended)
+        if n_appended < n_new:
+            n_replaced = n_new - n_appended
+            lowest = np.argpartition(self._ranking_scores(), n_replaced - 1)[:n_replaced]
+            slots = np.concatenate((slots, lowest))
+        self._obs[slots] = observations
+        self._states[slots] = states
+        self._scores[slots] = np.nan
+        self._scored_at[slots] = -1
+        self._n_candidates += n_appended
+
+    def score(self, scorer, batch_size=None):
+        """
+        (Re)score the candidates, with one call to the scorer.
+
+        :param scorer: (callable) returns the score of each observation of a batch (e.g. the critic discrepancy)
+        :param batch_size: (int) max number of candidates scored: the unscored candidates first, then the ones
+            scored the longest ago, so that the whole pool is rescored over several calls (default: all of them)
+        """
+        if self._n_candidates == 0:
+            return
+        if batch_size is None or batch_size >= self._n_candidates:
+            idxs = np.arange(self._n_candidates)
+        else:
+            idxs = np.argpartition(self._scored_at[:self._n_candidates], batch_size - 1)[:batch_size]
+        self._scores[idxs] = np.reshape(scorer(self._obs[idxs]), (-1,))
+        self._scored_at[idxs] = self._n_scorings
+        self._n_scorings += 1
+
+    def pop(self, n_scenarios=1):
+        """
+        Remove the best-scored candidates from the pool.
+
+        :param n_scenarios: (int) number of scenarios
+        :return: ([dict]) the scenarios, by decreasing score (less if the pool does not contain enough candidates)
+        """
+        n_scenarios = min(n_scenarios, self._n_candidates)
+        if n_scenarios == 0:
+            return []
+        scores = self._ranking_scores()
+        best = np.argpartition(-scores, n_scenarios - 1)[:n_scenarios]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        scenarios = list(self._states[best])
+
+        # Fill the slots of the removed candidates with the last candidates
+        n_remaining = self._n_candidates - n_scenarios
+        is_removed = np.zeros((self._n_candidates,), dtype=bool)
+        is_removed[best] = True
+        holes = np.flatnonzero(is_removed[:n_remaining])
+        movers = n_remaining + np.flatnonzero(~is_removed[n_remaining:])
+        self._obs[holes] = self._obs[movers]
+        self._states[holes] = self._states[movers]
+        self._scores[holes] = self._scores[movers]
+        self._scored_at[holes] = self._scored_at[movers]
+        self._states[n_remaining:self._n_candidates] = None
+        self._scores[n_remaining:self._n_candidates] = np.nan
+        self._scored_at[n_remaining:self._n_candidates] = -1
+        self._n_candidates = n_remaining
+        return scenarios
@@ -31,32 +31,23 @@ class SegmentTree(object):
                `reduce` operation which reduces `operation` over
                a contiguous subsequence of items in the array.
 
+        The tree is stored in a single float64 array: the root is at index 1, the children of node i
+        at 2 * i and 2 * i + 1 and the leaves at [capacity, 2 * capacity). Reducing over the whole array
+        reads the root (O(1)) and other ranges are reduced iteratively from the leaves.
+
         :param capacity: (int) Total size of the array - must be a power of two.
         :param operation: (lambda (Any, Any): Any) operation for combining elements (eg. sum, max) must form a
-            mathematical group together with the set of possible values for array elements (i.e. be associative)
+            mathematical group together with the set of possible values for array elements (i.e. be associative).
+            It must also work elementwise on arrays (eg. np.add, np.minimum).
         :param neutral_element: (Any) neutral element for the operation above. eg. float('-inf') for max and 0 for sum.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._depth = capacity.bit_length() - 1
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
         self.neutral_element = neutral_element
 
-    def _reduce_helper(self, start, end, node, node_start, node_end):
-        if start == node_start and end == node_end:
-            return self._value[node]
-        mid = (node_start + node_end) // 2
-        if end <= mid:
-            return self._reduce_helper(start, end, 2 * node, node_start, mid)
-        else:
-            if mid + 1 <= start:
-                return self._reduce_helper(start, end, 2 * node + 1, mid + 1, node_end)
-            else:
-                return self._operation(
-                    self._reduce_helper(start, mid, 2 * node, node_start, mid),
-                    self._reduce_helper(mid + 1, end, 2 * node + 1, mid + 1, node_end)
-                )
-
     def reduce(self, start=0, end=None):
         """
         Returns result of applying `self.operation`
@@ -72,25 +63,44 @@ class SegmentTree(object):
             end = self._capacity
         if end < 0:
             end += self._capacity
-        end -= 1
-        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+        if start == 0 and end == self._capacity:
+            return self._value[1]
+
+        result = self.neutral_element
+        # Walk up from the leaves, adding the nodes that are fully inside [start, end)
+        start += self._capacity
+        end += self._capacity
+        while start < end:
+            if start & 1:
+                result = self._operation(result, self._value[start])
+                start += 1
+            if end & 1:
+                end -= 1
+                result = self._operation(result, self._value[end])
+            start //= 2
+            end //= 2
+        return result
 
     def __setitem__(self, idx, val):
-        # indexes of the leaf
-        idxs = idx + self._capacity
+        if np.ndim(idx) == 0:
+            idx = int(idx) + self._capacity
+            self._value[idx] = val
+            idx //= 2
+            while idx >= 1:
+                self._value[idx] = self._operation(self._value[2 * idx], self._value[2 * idx + 1])
+                idx //= 2
+            return
+
+        # indexes of the leaves
+        idxs = np.asarray(idx) + self._capacity
         self._value[idxs] = val
-        if isinstance(idxs, int):
-            idxs = np.array([idxs])
-        # go up one level in the tree and remove duplicate indexes
-        idxs = unique(idxs // 2)
-        while len(idxs) > 1 or idxs[0] > 0:
-            # as long as there are non-zero indexes, update the corresponding values
-            self._value[idxs] = self._operation(
-                self._value[2 * idxs],
-                self._value[2 * idxs + 1]
-            )
-            # go up one level in the tree and remove duplicate indexes
-            idxs = unique(idxs // 2)
+        idxs = idxs // 2
+        for _ in range(self._depth):
+            # Update all the nodes of one level at once. Duplicate indexes are not removed:
+            # they are all assigned the same value, which is cheaper than deduplicating at every level
+            self._value[idxs] = self._operation(self._value[2 * idxs], self._value[2 * idxs + 1])
+            # go up one level in the tree
+            idxs //= 2
 
     def __getitem__(self, idx):
         assert np.max(idx) < self._capacity
@@ -105,7 +115,6 @@ class SumSegmentTree(SegmentTree):
             operation=np.add,
             neutral_element=0.0
         )
-        self._value = np.array(self._value)
 
     def sum(self, start=0, end=None):
         """
@@ -135,19 +144,16 @@ class SumSegmentTree(SegmentTree):
         assert np.max(prefixsum) <= self.sum() + 1e-5
         assert isinstance(prefixsum[0], float)
 
-        idx = np.ones(len(prefixsum), dtype=int)
-        cont = np.ones(len(prefixsum), dtype=bool)
-
-        while np.any(cont):  # while not all nodes are leafs
-            idx[cont] = 2 * idx[cont]
-            prefixsum_new = np.where(self._value[idx] <= prefixsum, prefixsum - self._value[idx], prefixsum)
-            # prepare update of prefixsum for all right children
-            idx = np.where(np.logical_or(self._value[idx] > prefixsum, np.logical_not(cont)), idx, idx + 1)
-            # Select child node for non-leaf nodes
-            prefixsum = prefixsum_new
-            # update prefixsum
-            cont = idx < self._capacity
-            # collect leafs
+        prefixsum = np.array(prefixsum, dtype=np.float64)
+        idx = np.ones(len(prefixsum), dtype=np.int64)
+        # All the leaves are at the same depth: one vectorized step per level
+        for _ in range(self._depth):
+            idx *= 2
+            left_value = self._value[idx]
+            # go to the right child if the prefixsum is larger than the left subtree
+            go_right = left_value <= prefixsum
+            prefixsum -= np.where(go_right, left_value, 0.0)
+            idx += go_right
         return idx - self._capacity
 
 
@@ -158,7 +164,6 @@ class MinSegmentTree(SegmentTree):
             operation=np.minimum,
             neutral_element=float('inf')
         )
-        self._value = np.array(self._value)
 
     def min(self, start=0, end=None):
         """
@@ -1,77 +1,327 @@
 import multiprocessing
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from multiprocessing.connection import wait
 from typing import Sequence
 
 import gym
 import numpy as np
 
+from stable_baselines.bench import Monitor
 from stable_baselines.common.vec_env.base_vec_env import VecEnv, CloudpickleWrapper
+from stable_baselines.common.vec_env.util import obs_space_info, dict_to_obs
 
 
-def _worker(remote, parent_remote, env_fn_wrapper):
+class _SharedMemoryBuffers(object):
+    """
+    Observations, rewards and dones of all the environments of a SubprocVecEnv, in shared memory.
+    Each environment writes in its own slot, the observations follow the layout of the observation space
+    (one array per key for Dict and Tuple spaces, see obs_space_info).
+
+    :param ctx: (multiprocessing.context.BaseContext) the multiprocessing context
+    :param n_envs: (int) the number of environments
+    :param observation_space: (gym.spaces.Space) the observation space
+    """
+
+    def __init__(self, ctx, n_envs, observation_space):
+        self.n_envs = n_envs
+        self.observation_space = observation_space
+        self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(observation_space)
+        self._obs_arrays = {key: ctx.RawArray('b', n_envs * int(np.prod(self.obs_shapes[key])) *
+                                              np.dtype(self.obs_dtypes[key]).itemsize)
+                            for key in self.obs_keys}
+        self._reward_array = ctx.RawArray('b', n_envs * np.dtype(np.float64).itemsize)
+        self._done_array = ctx.RawArray('b', n_envs * np.dtype(np.bool_).itemsize)
+        self._views = None
+
+    def __getstate__(self):
+        # The numpy views are rebuilt from the shared arrays in each process
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    @property
+    def views(self):
+        """
+        :return: ((dict<np.ndarray>, np.ndarray, np.ndarray)) numpy views of the shared observations
+            (one array per key, the env index being the first axis), rewards and dones
+        """
+        if self._views is None:
+            obs_views = {key: np.frombuffer(self._obs_arrays[key], dtype=self.obs_dtypes[key])
+                         .reshape((self.n_envs,) + self.obs_shapes[key]) for key in self.obs_keys}
+            self._views = (obs_views, np.frombuffer(self._reward_array, dtype=np.float64),
+                           np.frombuffer(self._done_array, dtype=np.bool_))
+        return self._views
+
+    def write(self, env_idx, observation, reward=None, done=None):
+        """
+        Write the observation (and reward and done) of an environment in its slot.
+
+        :param env_idx: (int) index of the environment
+        :param observation: (np.ndarray, tuple<np.ndarray> or dict<np.ndarray>) the observation
+        :param reward: (float) the reward
+        :param done: (bool) the done signal
+        """
+        obs_views, rewards, dones = self.views
+        for key in self.obs_keys:
+            obs_views[key][env_idx] = observation if key is None else observation[key]
+        if reward is not None:
+            rewards[env_idx] = reward
+            dones[env_idx] = done
+
+    def read(self, indices=None, copy=True):
+        """
+        Read the observations, rewards and dones of environments.
+
+        :param indices: (list<int>) indices of the environments, all of them if None
+        :param copy: (bool) return copies instead of views of the shared memory
+            (the views are overwritten by the next step or reset of the environments)
+        :return: ((np.ndarray, tuple<np.ndarray> or dict<np.ndarray>), np.ndarray, np.ndarray) the observations
+            (following the observation space), rewards and dones
+        """
+        obs_views, rewards, dones = self.views
+        if indices is not None:
+            # Fancy indexing already copies
+            return dict_to_obs(self.observation_space, OrderedDict([(key, obs_views[key][indices])
+                                                                    for key in self.obs_keys])), \
+                rewards[indices], dones[indices]
+        obs = OrderedDict([(key, np.copy(obs_views[key]) if copy else obs_views[key]) for key in self.obs_keys])
+        return dict_to_obs(self.observation_space, obs), np.copy(rewards), np.copy(dones)
+
+
+class _EnvRunner(object):
+    """
+    An environment of a SubprocVecEnv worker, with its reset data gathering and scenario queue.
+
+    The reset data (first observation and initial state of candidate scenarios for active sampling) is generated
+    with a candidate environment created by `candidate_env_fn`, while the worker is idle, so that it never delays
+    the steps. This candidate environment is only created when reset data is gathered, and is closed with the worker.
+    It is seeded with an offset from the seed of the environment (see `_CANDIDATE_SEED_OFFSET`), or, if the
+    environment was not seeded through the worker (e.g. seeded by `env_fn`), from the random state of the
+    environment: otherwise it would replay the resets of the environment.
+    Without `candidate_env_fn`, the reset data is generated by resetting the environment at the end of its episodes,
+    before the reset that starts the next episode.
+
+    :param env_fn: (callable) creates the environment
+    :param candidate_env_fn: (callable) creates the candidate environment, which must not write to the files of
+        the environment (e.g. through a `Monitor`). If None, the environment itself generates the reset data.
+    :param reset_data_size: (int) max number of reset data items kept until `get_reset_data`
+    """
+
+    def __init__(self, env_fn, candidate_env_fn=None, reset_data_size=10):
+        self.env = env_fn()
+        self.candidate_env_fn = candidate_env_fn
+        self.candidate_env = None
+        # Seed of the environment given to the worker, if any
+        self.seed = None
+        self.reset_data_size = reset_data_size
+        self.done_not_reset = False
+        self.reset_data = []
+        self.scenarios_to_run = []
+        self.gather_reset_data = False
+        self.last_step_data = None
+
+    @property
+    def needs_reset_data(self):
+        """
+        :return: (bool) whether reset data should be generated
+        """
+        return self.gather_reset_data and len(self.reset_data) < self.reset_data_size
+
+    @property
+    def generates_when_idle(self):
+        """
+        :return: (bool) whether reset data should be generated by the candidate environment while the worker is idle
+        """
+        return self.candidate_env_fn is not None and self.needs_reset_data
+
+    def generate_reset_data(self):
+        """
+        Generate a reset data item with the candidate environment.
+        """
+        if self.candidate_env is None:
+            candidate_env = self.candidate_env_fn()
+            wrapper = candidate_env
+            while isinstance(wrapper, gym.Wrapper):
+                assert not (isinstance(wrapper, Monitor) and wrapper.file_handler is not None), \
+                    "The candidate environments must not be wrapped in a Monitor writing to a file"
+                wrapper = wrapper.env
+            candidate_env.seed(self._candidate_seed())
+            self.candidate_env = candidate_env
+        self.reset_data.append({"obs": self.candidate_env.reset(),
+                                "initial_state": self.candidate_env.get_initial_state()})
+
+    def _candidate_seed(self):
+        """
+        :return: (int) seed of the candidate environment, different from the one of the environment
+            (None if it cannot be derived)
+        """
+        if self.seed is not None:
+            return self.seed + _CANDIDATE_SEED_OFFSET
+        np_random = getattr(self.env.unwrapped, 'np_random', None)
+        if isinstance(np_random, np.random.RandomState):
+            # Derived from the random state without drawing from it, so that the environment is not affected
+            return int(np.random.RandomState(np_random.get_state()[1]).randint(2 ** 31 - 1))
+        return None
+
+    def close(self):
+        """
+        Close the candidate environment.
+        """
+        if self.candidate_env is not None:
+            self.candidate_env.close()
+            self.candidate_env = None
+
+    def step(self, action):
+        """
+        :param action: (np.ndarray) the action
+        :return: ((np.ndarray, float, bool, dict)) observation, reward, done, information
+        """
+        if self.done_not_reset:
+            return self.last_step_data
+        env = self.env
+        observation, reward, done, info = env.step(action)
+        if done and getattr(env, "training", True):
+            info['terminal_observation'] = observation
+            self.done_not_reset = False
+            if self.candidate_env_fn is None:
+                while self.needs_reset_data:
+                    self.reset_data.append({"obs": env.reset(), "initial_state": env.get_initial_state()})
+            if len(self.scenarios_to_run) > 0:
+                scenario = self.scenarios_to_run.pop()
+                observation = env.reset(**scenario)
+            else:
+                observation = env.reset()
+        elif done:
+            self.done_not_reset = True
+            self.last_step_data = (observation, reward, done, info)
+        return observation, reward, done, info
+
+    def reset(self, args, kwargs):
+        """
+        :param args: (tuple) positional arguments of the reset of the environment
+        :param kwargs: (dict) keyword arguments of the reset of the environment
+        :return: (np.ndarray) the first observation
+        """
+        self.done_not_reset = False
+        self.last_step_data = None
+        return self.env.reset(*args, **kwargs)
+
+    def command(self, cmd, data):
+        """
+        Execute a command that is not step or reset.
+
+        :param cmd: (str) the command
+        :param data: (Any) the data of the command
+        :return: (Any) the result of the command, None for the commands without reply
+        """
+        if cmd == "add_scenarios":
+            if isinstance(data, list):
+                self.scenarios_to_run.extend(data)
+            else:
+                self.scenarios_to_run.append(data)
+        elif cmd == "get_reset_data":
+            reset_data = self.reset_data
+            self.reset_data = []
+            return reset_data
+        elif cmd == "set_gather_reset_data":
+            self.gather_reset_data = data
+        elif cmd == 'render':
+            return self.env.render(*data[0], **data[1])
+        elif cmd == 'seed':
+            self.seed = data
+            if self.candidate_env is not None:
+                self.candidate_env.seed(self._candidate_seed())
+                # The items generated before the seeding are discarded, so that the reset data is reproducible
+                self.reset_data = []
+            return self.env.seed(data)
+        elif cmd == 'env_method':
+            method = getattr(self.env, data[0])
+            return method(*data[1], **data[2])
+        elif cmd == 'get_attr':
+            return getattr(self.env, data)
+        elif cmd == 'set_attr':
+            return setattr(self.env, data[0], data[1])
+        else:
+            raise NotImplementedError
+        return None
+
+
+# Offset between the seed of an environment and the one of its candidate environment (see _EnvRunner), larger than
+# the number of environments, so that the candidates do not replay the resets of other environments
+_CANDIDATE_SEED_OFFSET = 2 ** 20
+# Commands for which the worker does not send a reply
+_NO_REPLY_COMMANDS = ("add_scenarios", "set_gather_reset_data")
+# Marker of the reset data requests (see `SubprocVecEnv.request_reset_data`) among the messages in flight
+_RESET_DATA_REQUEST = None
+
+
+def _worker(remote, parent_remote, env_fn_wrapper, shared_buffers=None, env_idxs=None, reset_data_size=10,
+            candidate_env_fn_wrapper=None):
+    """
+    Worker process running one or several environments.
+
+    Step messages carry one action per environment of the worker, 'step_envs' (asynchronous stepping), reset
+    messages and the other commands carry the local indices of the targeted environments and one payload per
+    environment. Except for the commands in _NO_REPLY_COMMANDS, the worker replies with a list of results,
+    one per targeted environment. While no command is pending, the worker generates the reset data of its
+    environments (see _EnvRunner).
+
+    :param remote: (multiprocessing.Connection) connection to the main process
+    :param parent_remote: (multiprocessing.Connection) main process end of the pipe, closed in the worker
+    :param env_fn_wrapper: (CloudpickleWrapper) wraps the list of functions creating the environments of the worker
+    :param shared_buffers: (_SharedMemoryBuffers) shared memory for the observations, rewards and dones, if used
+    :param env_idxs: ([int]) indices of the environments of the worker in the vectorized environment
+    :param reset_data_size: (int) max number of reset data items kept by each environment
+    :param candidate_env_fn_wrapper: (CloudpickleWrapper) wraps the list of functions creating the candidate
+        environments of the worker (see _EnvRunner), if any
+    """
     parent_remote.close()
-    env = env_fn_wrapper.var()
-    done_not_reset = False
-    reset_data = []
-    scenarios_to_run = []
-    gather_reset_data = False
-    last_step_data = None
+    candidate_env_fns = [None] * len(env_fn_wrapper.var) if candidate_env_fn_wrapper is None \
+        else candidate_env_fn_wrapper.var
+    runners = [_EnvRunner(env_fn, candidate_env_fn, reset_data_size)
+               for env_fn, candidate_env_fn in zip(env_fn_wrapper.var, candidate_env_fns)]
+    if env_idxs is None:
+        env_idxs = list(range(len(runners)))
     while True:
         try:
+            if not remote.poll():
+                idle_runners = [runner for runner in runners if runner.generates_when_idle]
+                if len(idle_runners) > 0:
+                    # One item at a time, to check for commands in between
+                    min(idle_runners, key=lambda runner: len(runner.reset_data)).generate_reset_data()
+                    continue
             cmd, data = remote.recv()
-            if cmd == 'step':
-                if not done_not_reset:
-                    observation, reward, done, info = env.step(data)
-                    if done and getattr(env, "training", True):
-                        if gather_reset_data:
-                            for i in range(5):
-                                r_data = {"obs": env.reset()}
-                                r_data["initial_state"] = env.get_initial_state()
-                                reset_data.append(r_data)
-                        info['terminal_observation'] = observation
-                        done_not_reset = False
-                        if len(scenarios_to_run) > 0:
-                            scenario = scenarios_to_run.pop()
-                            observation = env.reset(**scenario)
-                        else:
-                            observation = env.reset()
-                    elif done:
-                        done_not_reset = True
-                        last_step_data = (observation, reward, done, info)
-                    remote.send((observation, reward, done, info))
-                else:
-                    remote.send(last_step_data)
-            elif cmd == "add_scenarios":
-                if isinstance(data, list):
-                    scenarios_to_run.extend(data)
+            if cmd == 'step' or cmd == 'step_envs':
+                local_idxs, actions = (range(len(runners)), data) if cmd == 'step' else data
+                results = [runners[i].step(action) for i, action in zip(local_idxs, actions)]
+                if shared_buffers is None:
+                    remote.send(results)
                 else:
-                    scenarios_to_run.append(data)
-            elif cmd == "get_reset_data":
-                remote.send(reset_data)
-                reset_data = []
-            elif cmd == "set_gather_reset_data":
-                gather_reset_data = data
+                    # Only the info dicts go through the pipe
+                    for i, (observation, reward, done, _) in zip(local_idxs, results):
+                        shared_buffers.write(env_idxs[i], observation, reward, done)
+                    remote.send([result[3] for result in results])
             elif cmd == 'reset':
-                observation = env.reset(*data[0], **data[1])
-                done_not_reset = False
-                last_step_data = None
-                remote.send(observation)
-            elif cmd == 'render':
-                remote.send(env.render(*data[0], **data[1]))
+                local_idxs, reset_args = data
+                observations = [runners[i].reset(*args) for i, args in zip(local_idxs, reset_args)]
+                if shared_buffers is None:
+                    remote.send(observations)
+                else:
+                    for i, observation in zip(local_idxs, observations):
+                        shared_buffers.write(env_idxs[i], observation)
+                    remote.send([None] * len(observations))
             elif cmd == 'close':
+                for runner in runners:
+                    runner.close()
                 remote.close()
                 break
             elif cmd == 'get_spaces':
-                remote.send((env.observation_space, env.action_space))
-            elif cmd == 'env_method':
-                method = getattr(env, data[0])
-                remote.send(method(*data[1], **data[2]))
-            elif cmd == 'get_attr':
-                remote.send(getattr(env, data))
-            elif cmd == 'set_attr':
-                remote.send(setattr(env, data[0], data[1]))
+                remote.send((runners[0].env.observation_space, runners[0].env.action_space))
             else:
-                raise NotImplementedError
+                local_idxs, payloads = data
+                replies = [runners[i].command(cmd, payload) for i, payload in zip(local_idxs, payloads)]
+                if cmd not in _NO_REPLY_COMMANDS:
+                    remote.send(replies)
         except EOFError:
             break
 
@@ -82,7 +332,8 @@ class SubprocVecEnv(VecEnv):
     process, allowing significant speed up when the environment is computationally complex.
 
     For performance reasons, if your environment is not IO bound, the number of environments should not exceed the
-    number of logical cores on your CPU.
+    number of logical cores on your CPU. With cheap environments, several environments can be run by each process
+    (see `n_envs_per_worker`), one message then carrying the actions and results of all of them.
 
     .. warning::
 
@@ -99,12 +350,36 @@ class SubprocVecEnv(VecEnv):
     :param start_method: (str) method used to start the subprocesses.
            Must be one of the methods returned by multiprocessing.get_all_start_methods().
            Defaults to 'forkserver' on available platforms, and 'spawn' otherwise.
+    :param shared_memory: (bool) The workers write the observations, rewards and dones in shared memory,
+        only the info dicts are sent through the pipes. This avoids pickling large (e.g. image) observations.
+        The observation space is read from an environment created (and closed) in the main process.
+    :param copy_obs: (bool) With shared memory, return copies of the observations. Otherwise the observations
+        returned by `step_wait` and `reset` are views of the shared memory, that are overwritten by the next step.
+    :param n_envs_per_worker: (int) number of environments run sequentially by each process, the environments
+        being assigned to the processes in contiguous blocks (the last process may run fewer environments)
+    :param async_batch_size: (int) enables the asynchronous stepping of the environments (see `async_reset`,
+        `send` and `recv`): `recv` returns the first `async_batch_size` environments whose step is completed,
+        so that slow environments do not stall the others
+    :param reset_data_size: (int) When gathering reset data (see `set_gather_reset_data`), max number of items
+        generated in advance by each environment. With `candidate_env_fns`, the items are generated by the workers
+        while they are idle, otherwise by the environments at the end of their episodes (see `_EnvRunner`).
+        They are retrieved either with a blocking `get_reset_data`, or without waiting for the workers with
+        `request_reset_data` and later `collect_reset_data`.
+    :param candidate_env_fns: ([callable]) functions creating the candidate environments that generate the reset
+        data, one per environment (created when the reset data is first gathered). They must not be wrapped in a
+        `Monitor` writing to a file, e.g. the environment functions of `make_vec_env` with a `monitor_dir` cannot
+        be reused, as the candidates would overwrite the monitor files of the environments.
     """
 
-    def __init__(self, env_fns, start_method=None, sampler_manager=None):
+    def __init__(self, env_fns, start_method=None, sampler_manager=None, shared_memory=False, copy_obs=True,
+                 n_envs_per_worker=1, async_batch_size=None, reset_data_size=10, candidate_env_fns=None):
         self.waiting = False
         self.closed = False
         n_envs = len(env_fns)
+        assert n_envs_per_worker >= 1, "Each worker must run at least one environment"
+        assert candidate_env_fns is None or len(candidate_env_fns) == n_envs, \
+            "There must be one candidate environment function per environment"
+        self.n_envs_per_worker = n_envs_per_worker
 
         if start_method is None:
             # Fork is not a thread safe method (see issue #217)
@@ -114,10 +389,22 @@ class SubprocVecEnv(VecEnv):
             start_method = 'forkserver' if forkserver_available else 'spawn'
         ctx = multiprocessing.get_context(start_method)
 
-        self.remotes, self.work_remotes = zip(*[ctx.Pipe(duplex=True) for _ in range(n_envs)])
+        self.copy_obs = copy_obs
+        self.shared_buffers = None
+        if shared_memory:
+            dummy_env = env_fns[0]()
+            self.shared_buffers = _SharedMemoryBuffers(ctx, n_envs, dummy_env.observation_space)
+            dummy_env.close()
+
+        worker_env_idxs = [list(range(start, min(start + n_envs_per_worker, n_envs)))
+                           for start in range(0, n_envs, n_envs_per_worker)]
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe(duplex=True) for _ in worker_env_idxs])
         self.processes = []
-        for work_remote, remote, env_fn in zip(self.work_remotes, self.remotes, env_fns):
-            args = (work_remote, remote, CloudpickleWrapper(env_fn))
+        for work_remote, remote, env_idxs in zip(self.work_remotes, self.remotes, worker_env_idxs):
+            candidate_env_fn_wrapper = None if candidate_env_fns is None \
+                else CloudpickleWrapper([candidate_env_fns[i] for i in env_idxs])
+            args = (work_remote, remote, CloudpickleWrapper([env_fns[i] for i in env_idxs]),
+                    self.shared_buffers, env_idxs, reset_data_size, candidate_env_fn_wrapper)
             # daemon=True: if the main process crashes, we should not cause things to hang
             process = ctx.Process(target=_worker, args=args, daemon=True)  # pytype:disable=attribute-error
             process.start()
@@ -129,55 +416,173 @@ class SubprocVecEnv(VecEnv):
         self.sampler_manager = sampler_manager
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
 
+        assert async_batch_size is None or 0 < async_batch_size <= n_envs, \
+            "The asynchronous batch size must be between 1 and the number of environments"
+        self.async_batch_size = async_batch_size
+        # Asynchronous stepping: env ids of the step messages sent to each worker and not received yet
+        # (or _RESET_DATA_REQUEST for the reset data requests), and the (env id, result) of the completed steps
+        # not returned yet by `recv`
+        self._in_flight = [deque() for _ in self.remotes]
+        self._ready = []
+        # Reset data received from the workers, not returned yet by `collect_reset_data`
+        self._received_reset_data = []
+
+    def _steps_in_flight(self):
+        """
+        :return: (bool) whether asynchronous steps are pending
+        """
+        return any(env_ids is not _RESET_DATA_REQUEST for in_flight in self._in_flight for env_ids in in_flight)
+
     def step_async(self, actions):
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
+        assert not self._steps_in_flight(), "Asynchronous steps are pending, use `recv`"
+        for worker_idx, remote in enumerate(self.remotes):
+            start = worker_idx * self.n_envs_per_worker
+            remote.send(('step', actions[start:start + self.n_envs_per_worker]))
         self.waiting = True
 
     def step_wait(self):
-        results = [remote.recv() for remote in self.remotes]
+        results = []
+        for worker_idx, remote in enumerate(self.remotes):
+            # The replies to the pending reset data requests come first
+            self._receive_async_steps(worker_idx)
+            results.extend(remote.recv())
         self.waiting = False
+        if self.shared_buffers is not None:
+            obs, rews, dones = self.shared_buffers.read(copy=self.copy_obs)
+            return obs, rews, dones, tuple(results)
         obs, rews, dones, infos = zip(*results)
         return _flatten_obs(obs, self.observation_space), np.stack(rews), np.stack(dones), infos
 
+    def async_reset(self):
+        """
+        Reset all the environments for asynchronous stepping: their first observations are returned by `recv`.
+        """
+        assert self.async_batch_size is not None, "Asynchronous stepping requires an async_batch_size"
+        assert not self._steps_in_flight(), "Asynchronous steps are pending, use `recv`"
+        observations = self._call_envs('reset', [((), {})] * self.num_envs)
+        if self.shared_buffers is not None:
+            _, rewards, dones = self.shared_buffers.views
+            rewards[:] = 0.0
+            dones[:] = False
+            self._ready = [(env_idx, {}) for env_idx in range(self.num_envs)]
+        else:
+            self._ready = [(env_idx, (observation, 0.0, False, {}))
+                           for env_idx, observation in enumerate(observations)]
+
+    def send(self, actions, env_ids):
+        """
+        Step some environments asynchronously, the results are returned by `recv`.
+
+        :param actions: (np.ndarray) the actions, one per environment
+        :param env_ids: (np.ndarray) indices of the environments, as returned by `recv`
+        """
+        env_ids = [int(env_idx) for env_idx in env_ids]
+        for worker_idx, local_idxs, positions in self._get_target_workers(env_ids):
+            self.remotes[worker_idx].send(('step_envs', (local_idxs, [actions[position] for position in positions])))
+            self._in_flight[worker_idx].append([env_ids[position] for position in positions])
+
+    def recv(self):
+        """
+        Wait for the first `async_batch_size` environments whose step (or reset) is completed.
+
+        :return: ((np.ndarray, tuple<np.ndarray> or dict<np.ndarray>), np.ndarray, np.ndarray, [dict], np.ndarray)
+            observations, rewards, dones, information and indices of the environments
+        """
+        while len(self._ready) < self.async_batch_size:
+            pending = [self.remotes[worker_idx] for worker_idx in range(len(self.remotes))
+                       if self._in_flight[worker_idx]]
+            assert len(pending) > 0, "Not enough environments are stepping to fill a batch, use `send`"
+            for remote in wait(pending):
+                self._receive_async_steps(self.remotes.index(remote), n_messages=1)
+        batch, self._ready = self._ready[:self.async_batch_size], self._ready[self.async_batch_size:]
+        env_ids = np.array([env_idx for env_idx, _ in batch])
+        if self.shared_buffers is not None:
+            obs, rews, dones = self.shared_buffers.read(env_ids)
+            return obs, rews, dones, tuple(info for _, info in batch), env_ids
+        obs, rews, dones, infos = zip(*[result for _, result in batch])
+        return _flatten_obs(obs, self.observation_space), np.stack(rews), np.stack(dones), infos, env_ids
+
+    def _receive_async_steps(self, worker_idx, n_messages=None):
+        """
+        Receive the results of asynchronous steps of a worker, they are returned by the next calls to `recv`
+        (and the replies to its reset data requests, returned by `collect_reset_data`).
+
+        :param worker_idx: (int) index of the worker
+        :param n_messages: (int) number of step messages to receive, all the pending ones if None
+        """
+        in_flight = self._in_flight[worker_idx]
+        n_messages = len(in_flight) if n_messages is None else n_messages
+        for _ in range(n_messages):
+            env_ids = in_flight.popleft()
+            replies = self.remotes[worker_idx].recv()
+            if env_ids is _RESET_DATA_REQUEST:
+                for env_reset_data in replies:
+                    self._received_reset_data.extend(env_reset_data)
+            else:
+                self._ready.extend(zip(env_ids, replies))
+
     def seed(self, seed=None):
-        for idx, remote in enumerate(self.remotes):
-            remote.send(('seed', seed + idx))
-        return [remote.recv() for remote in self.remotes]
+        return self._call_envs('seed', [seed + idx for idx in range(self.num_envs)])
 
     def reset(self, indices=None, *args, **kwargs):
         if kwargs and (isinstance(kwargs["state"], list) or isinstance(kwargs["state"], np.ndarray)):
             kwargs_list = True
         else:
             kwargs_list = False
-        for i, remote in enumerate(self._get_target_remotes(indices)):
+        n_targets = len(self._get_indices(indices))
+        reset_args = []
+        for i in range(n_targets):
             if kwargs_list:
                 kwargs_i = {k: v[i] for k, v in kwargs.items()}
             else:
                 kwargs_i = kwargs
-            remote.send(('reset', (args, {**kwargs_i})))
-        obs = [remote.recv() for i, remote in enumerate(self._get_target_remotes(indices))]
+            reset_args.append((args, {**kwargs_i}))
+        obs = self._call_envs('reset', reset_args, indices)
+        if self.shared_buffers is not None:
+            if indices is None:
+                return self.shared_buffers.read(copy=self.copy_obs)[0]
+            return self.shared_buffers.read(self._get_indices(indices))[0]
         return _flatten_obs(obs, self.observation_space)
 
     def add_scenarios(self, scenarios, indices=None):
-        remotes = self._get_target_remotes(indices)
-        remote_data = np.array_split(scenarios, self.num_envs)
-        for i, pipe in enumerate(remotes):
-            pipe.send(('add_scenarios', list(remote_data[i])))
+        n_targets = len(self._get_indices(indices))
+        remote_data = np.array_split(scenarios, n_targets)
+        self._call_envs('add_scenarios', [list(data) for data in remote_data], indices)
 
     def get_reset_data(self, indices=None):
         reset_data = []
-        for pipe in self._get_target_remotes(indices):
-            pipe.send(('get_reset_data', None))
+        for env_reset_data in self._call_envs('get_reset_data', None, indices):
+            reset_data.extend(env_reset_data)
+        return reset_data
 
-        for pipe in self._get_target_remotes(indices):
-            reset_data.extend(pipe.recv())
+    def request_reset_data(self, indices=None):
+        """
+        Ask the environments for their reset data, without waiting for the replies: the reset data is returned
+        by `collect_reset_data` once the replies are received. The requests can be pending during the next steps.
 
+        :param indices: (None,int,Iterable) refers to indices of envs.
+        """
+        for worker_idx, local_idxs, _ in self._get_target_workers(indices):
+            self.remotes[worker_idx].send(('get_reset_data', (local_idxs, [None] * len(local_idxs))))
+            self._in_flight[worker_idx].append(_RESET_DATA_REQUEST)
+
+    def collect_reset_data(self, block=False):
+        """
+        Return the reset data of the requests made with `request_reset_data`, whose replies are received.
+
+        :param block: (bool) wait for the replies to all the pending requests. Otherwise, only the replies that
+            already arrived are received.
+        :return: ([dict]) the reset data items
+        """
+        for worker_idx, remote in enumerate(self.remotes):
+            # The messages are received in order, stopping at the first reply that did not arrive yet
+            while _RESET_DATA_REQUEST in self._in_flight[worker_idx] and (block or remote.poll()):
+                self._receive_async_steps(worker_idx, n_messages=1)
+        reset_data, self._received_reset_data = self._received_reset_data, []
         return reset_data
 
     def set_gather_reset_data(self, status, indices=None):
-        for pipe in self._get_target_remotes(indices):
-            pipe.send(('set_gather_reset_data', status))
+        self._call_envs('set_gather_reset_data', status, indices)
 
     def close(self):
         if self.closed:
@@ -185,6 +590,9 @@ class SubprocVecEnv(VecEnv):
         if self.waiting:
             for remote in self.remotes:
                 remote.recv()
+        for remote, in_flight in zip(self.remotes, self._in_flight):
+            for _ in in_flight:
+                remote.recv()
         for remote in self.remotes:
             remote.send(('close', None))
         for process in self.processes:
@@ -192,11 +600,9 @@ class SubprocVecEnv(VecEnv):
         self.closed = True
 
     def render(self, indices=None, *args, **kwargs):
-        for pipe in self._get_target_remotes(indices):
-            # gather images from subprocesses
-            # `mode` will be taken into account later
-            pipe.send(('render', (args, {**kwargs})))
-        figs = [pipe.recv() for pipe in self._get_target_remotes(indices)]
+        # gather images from subprocesses
+        # `mode` will be taken into account later
+        figs = self._call_envs('render', (args, {**kwargs}), indices)
         if isinstance(indices, int):
             figs = figs[0]
 
@@ -213,43 +619,64 @@ class SubprocVecEnv(VecEnv):
             raise NotImplementedError
 
     def get_images(self):
-        for pipe in self.remotes:
-            pipe.send(('render', {"mode": 'rgb_array'}))
-        imgs = [pipe.recv() for pipe in self.remotes]
-        return imgs
+        return self._call_envs('render', ((), {"mode": 'rgb_array'}))
 
     def get_attr(self, attr_name, indices=None):
         """Return attribute from vectorized environment (see base class)."""
-        target_remotes = self._get_target_remotes(indices)
-        for remote in target_remotes:
-            remote.send(('get_attr', attr_name))
-        return [remote.recv() for remote in target_remotes]
+        return self._call_envs('get_attr', attr_name, indices)
 
     def set_attr(self, attr_name, value, indices=None):
         """Set attribute inside vectorized environments (see base class)."""
-        target_remotes = self._get_target_remotes(indices)
-        for remote in target_remotes:
-            remote.send(('set_attr', (attr_name, value)))
-        for remote in target_remotes:
-            remote.recv()
+        self._call_envs('set_attr', (attr_name, value), indices)
 
     def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
         """Call instance methods of vectorized environments."""
-        target_remotes = self._get_target_remotes(indices)
-        for remote in target_remotes:
-            remote.send(('env_method', (method_name, method_args, method_kwargs)))
-        return [remote.recv() for remote in target_remotes]
+        return self._call_envs('env_method', (method_name, method_args, method_kwargs), indices)
 
-    def _get_target_remotes(self, indices):
+    def _call_envs(self, cmd, payloads, indices=None):
+        """
+        Send a command to the wanted envs, one message per worker process.
+
+        :param cmd: (str) the command
+        :param payloads: ([Any] or Any) the data of the command, a list with one item per targeted env for
+            the 'seed', 'reset' and 'add_scenarios' commands, sent to all the targeted envs otherwise
+        :param indices: (None,int,Iterable) refers to indices of envs.
+        :return: ([Any]) the results, one per targeted env (None for the commands without reply)
+        """
+        per_env_payloads = cmd in ('seed', 'reset', 'add_scenarios')
+        targets = self._get_target_workers(indices)
+        n_targets = sum(len(positions) for _, _, positions in targets)
+        for worker_idx, local_idxs, positions in targets:
+            if per_env_payloads:
+                worker_payloads = [payloads[position] for position in positions]
+            else:
+                worker_payloads = [payloads] * len(positions)
+            self.remotes[worker_idx].send((cmd, (local_idxs, worker_payloads)))
+        results = [None] * n_targets
+        if cmd in _NO_REPLY_COMMANDS:
+            return results
+        for worker_idx, _, positions in targets:
+            # The workers reply in order: the pending asynchronous steps are completed first
+            self._receive_async_steps(worker_idx)
+            for position, result in zip(positions, self.remotes[worker_idx].recv()):
+                results[position] = result
+        return results
+
+    def _get_target_workers(self, indices):
         """
-        Get the connection object needed to communicate with the wanted
-        envs that are in subprocesses.
+        Group the wanted envs by the worker process running them.
 
         :param indices: (None,int,Iterable) refers to indices of envs.
-        :return: ([multiprocessing.Connection]) Connection object to communicate between processes.
+        :return: ([(int, [int], [int])]) for each worker: its index, the indices of the wanted envs in the worker
+            and their positions in `indices`
         """
-        indices = self._get_indices(indices)
-        return [self.remotes[i] for i in indices]
+        targets = OrderedDict()
+        for position, env_idx in enumerate(self._get_indices(indices)):
+            worker_idx, local_idx = divmod(env_idx % self.num_envs, self.n_envs_per_worker)
+            local_idxs, positions = targets.setdefault(worker_idx, ([], []))
+            local_idxs.append(local_idx)
+            positions.append(position)
+        return [(worker_idx, local_idxs, positions) for worker_idx, (local_idxs, positions) in targets.items()]
 
 
 def _flatten_obs(obs, space):
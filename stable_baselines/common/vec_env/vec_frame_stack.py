@@ -10,6 +10,10 @@ class VecFrameStack(VecEnvWrapper):
     """
     Frame stacking wrapper for vectorized environment
 
+    The frames are stored in a circular buffer with the layout of the stacked observations (one block of the last
+    axis per frame): a step only writes the newest frame, and the stacked observations are gathered once,
+    oldest frame first, in a new array.
+
     :param venv: (VecEnv) the vectorized environment to wrap
     :param n_stack: (int) Number of frames to stack
     """
@@ -20,35 +24,62 @@ class VecFrameStack(VecEnvWrapper):
         wrapped_obs_space = venv.observation_space
         low = np.repeat(wrapped_obs_space.low, self.n_stack, axis=-1)
         high = np.repeat(wrapped_obs_space.high, self.n_stack, axis=-1)
-        self.stackedobs = np.zeros((venv.num_envs,) + low.shape, low.dtype)
+        self._frames = np.zeros((venv.num_envs,) + low.shape, low.dtype)
+        self._last_ax_size = wrapped_obs_space.shape[-1]
+        # Index of the block holding the newest frame
+        self._newest = self.n_stack - 1
         observation_space = spaces.Box(low=low, high=high, dtype=venv.observation_space.dtype)
         VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
 
+    @property
+    def stackedobs(self):
+        """
+        :return: (np.ndarray) the stacked observations, oldest frame first
+        """
+        start = (self._newest + 1) % self.n_stack * self._last_ax_size
+        if start == 0:
+            return self._frames.copy()
+        return np.concatenate((self._frames[..., start:], self._frames[..., :start]), axis=-1)
+
+    def _newest_block(self):
+        """
+        :return: (slice) the block of the last axis holding the newest frame
+        """
+        return slice(self._newest * self._last_ax_size, (self._newest + 1) * self._last_ax_size)
+
     def step_wait(self):
         observations, rewards, dones, infos = self.venv.step_wait()
-        last_ax_size = observations.shape[-1]
-        self.stackedobs = np.roll(self.stackedobs, shift=-last_ax_size, axis=-1)
-        for i, done in enumerate(dones):
-            if done:
-                if 'terminal_observation' in infos[i]:
-                    old_terminal = infos[i]['terminal_observation']
-                    new_terminal = np.concatenate(
-                        (self.stackedobs[i, ..., :-last_ax_size], old_terminal), axis=-1)
-                    infos[i]['terminal_observation'] = new_terminal
-                else:
-                    warnings.warn(
-                        "VecFrameStack wrapping a VecEnv without terminal_observation info")
-                self.stackedobs[i] = 0
-        self.stackedobs[..., -observations.shape[-1]:] = observations
-        return self.stackedobs, rewards, dones, infos
+        last_ax_size = self._last_ax_size
+        self._newest = (self._newest + 1) % self.n_stack
+        newest = self._newest_block()
+        self._frames[..., newest] = observations
+        stackedobs = self.stackedobs
+
+        done_idxs = np.flatnonzero(dones)
+        if len(done_idxs) > 0:
+            terminal_idxs = [i for i in done_idxs if 'terminal_observation' in infos[i]]
+            if len(terminal_idxs) < len(done_idxs):
+                warnings.warn("VecFrameStack wrapping a VecEnv without terminal_observation info")
+            if len(terminal_idxs) > 0:
+                terminal_stacks = stackedobs[terminal_idxs]
+                terminal_stacks[..., -last_ax_size:] = np.stack([infos[i]['terminal_observation']
+                                                                 for i in terminal_idxs])
+                for i, terminal_stack in zip(terminal_idxs, terminal_stacks):
+                    infos[i]['terminal_observation'] = terminal_stack
+            # The stacks of the environments that were reset only contain their first observation
+            self._frames[done_idxs] = 0
+            self._frames[done_idxs, ..., newest] = observations[done_idxs]
+            stackedobs[done_idxs, ..., :-last_ax_size] = 0
+        return stackedobs, rewards, dones, infos
 
     def reset(self):
         """
         Reset all environments
         """
         obs = self.venv.reset()
-        self.stackedobs[...] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
+        self._frames[...] = 0
+        self._newest = self.n_stack - 1
+        self._frames[..., self._newest_block()] = obs
         return self.stackedobs
 
     def close(self):
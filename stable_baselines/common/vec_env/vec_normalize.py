@@ -1,5 +1,6 @@
 import pickle
 import warnings
+from typing import Optional, Tuple
 
 import numpy as np
 
@@ -15,6 +16,10 @@ class VecNormalize(VecEnvWrapper):
     The wrapped environment `venv` is not saved, and must be restored manually with
     `set_venv` after being unpickled.
 
+    The observation scale 1 / sqrt(var + epsilon) is cached until `obs_rms` is updated (or replaced), and the
+    observations are normalized with in-place operations on a single output array. Without `copy_obs`, this
+    output array is allocated once and reused by every step and reset.
+
     :param venv: (VecEnv) the vectorized environment to wrap
     :param training: (bool) Whether to update or not the moving average
     :param norm_obs: (bool) Whether to normalize observation or not (default: True)
@@ -23,10 +28,14 @@ class VecNormalize(VecEnvWrapper):
     :param clip_reward: (float) Max value absolute for discounted reward
     :param gamma: (float) discount factor
     :param epsilon: (float) To avoid division by zero
+    :param mean_mask: (np.ndarray) mask of the observation elements whose mean is kept at zero
+    :param copy_obs: (bool) Return new arrays of normalized observations. Otherwise the observations returned by
+        `step_wait` and `reset` are written in one array of shape (num_envs,) + observation shape, overwritten by
+        the next step or reset: the caller must copy them if they are kept (with `norm_obs`)
     """
 
     def __init__(self, venv, training=True, norm_obs=True, norm_reward=True,
-                 clip_obs=10., clip_reward=10., gamma=0.99, epsilon=1e-8, mean_mask=None):
+                 clip_obs=10., clip_reward=10., gamma=0.99, epsilon=1e-8, mean_mask=None, copy_obs=True):
         VecEnvWrapper.__init__(self, venv)
         self.obs_rms = RunningMeanStd(shape=self.observation_space.shape, mean_mask=mean_mask)
         self.ret_rms = RunningMeanStd(shape=())
@@ -41,6 +50,12 @@ class VecNormalize(VecEnvWrapper):
         self.norm_reward = norm_reward
         self.old_obs = None
         self.old_rews = None
+        self.copy_obs = copy_obs
+        # Output array of the normalized observations without `copy_obs`, allocated at the first step or reset
+        self._obs_out = None
+        # Cached observation scale, and the (obs_rms, obs_rms.var, epsilon) it was computed from
+        self._obs_scale = None
+        self._obs_scale_source = None
 
     def __getstate__(self):
         """
@@ -53,6 +68,9 @@ class VecNormalize(VecEnvWrapper):
         del state['class_attributes']
         # these attributes depend on the above and so we would prefer not to pickle
         del state['ret']
+        state['_obs_out'] = None
+        state['_obs_scale'] = None
+        state['_obs_scale_source'] = None
         return state
 
     def __setstate__(self, state):
@@ -62,6 +80,11 @@ class VecNormalize(VecEnvWrapper):
         User must call set_venv() after unpickling before using.
 
         :param state: (dict)"""
+        # Objects pickled before the observation scale was cached, or before `copy_obs` was added
+        self._obs_scale = None
+        self._obs_scale_source = None
+        self.copy_obs = True
+        self._obs_out = None
         self.__dict__.update(state)
         assert 'venv' not in state
         self.venv = None
@@ -94,7 +117,7 @@ class VecNormalize(VecEnvWrapper):
 
         if self.training:
             self.obs_rms.update(obs)
-        obs = self.normalize_obs(obs)
+        obs = self._normalize_new_obs(obs)
 
         if self.training:
             self._update_reward(rews)
@@ -107,17 +130,62 @@ class VecNormalize(VecEnvWrapper):
         self.ret = self.ret * self.gamma + reward
         self.ret_rms.update(self.ret)
 
-    def normalize_obs(self, obs: np.ndarray) -> np.ndarray:
+    def _get_obs_scale(self) -> np.ndarray:
+        """
+        :return: (np.ndarray) 1 / sqrt(var + epsilon), recomputed only when the observation statistics
+            have changed (RunningMeanStd replaces its arrays when updated)
+        """
+        source = self._obs_scale_source
+        if source is None or source[0] is not self.obs_rms or source[1] is not self.obs_rms.var \
+                or source[2] != self.epsilon:
+            self._obs_scale = 1.0 / np.sqrt(self.obs_rms.var + self.epsilon)
+            self._obs_scale_source = (self.obs_rms, self.obs_rms.var, self.epsilon)
+        return self._obs_scale
+
+    def normalize_obs(self, obs: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Normalize observations using this VecNormalize's observations statistics.
         Calling this method does not update statistics.
+
+        :param obs: (np.ndarray) the observations
+        :param out: (np.ndarray) array receiving the normalized observations, can be `obs` itself
+            (a new array is allocated by default)
+        :return: (np.ndarray) the normalized observations
         """
         if self.norm_obs:
-            obs = np.clip((obs - self.obs_rms.mean) / np.sqrt(self.obs_rms.var + self.epsilon),
-                          -self.clip_obs,
-                          self.clip_obs)
+            out = np.subtract(obs, self.obs_rms.mean, out=out)
+            np.multiply(out, self._get_obs_scale(), out=out)
+            # Clip with the ufuncs directly, np.clip has a significant overhead on small arrays
+            np.minimum(out, self.clip_obs, out=out)
+            return np.maximum(out, -self.clip_obs, out=out)
+        if out is not None and out is not obs:
+            out[...] = obs
+            return out
         return obs
 
+    def _normalize_new_obs(self, obs: np.ndarray) -> np.ndarray:
+        """
+        :param obs: (np.ndarray) the observations returned by the wrapped VecEnv
+        :return: (np.ndarray) the normalized observations, in the reused output array without `copy_obs`
+        """
+        if self.copy_obs or not self.norm_obs:
+            return self.normalize_obs(obs)
+        if self._obs_out is None or self._obs_out.shape != obs.shape:
+            self._obs_out = np.empty(obs.shape, dtype=np.result_type(obs.dtype, self.obs_rms.mean.dtype))
+        return self.normalize_obs(obs, out=self._obs_out)
+
+    def normalize_obs_batches(self, *batches: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Normalize several batches of observations (e.g. the observations and next observations sampled from
+        a replay buffer) with the same cached statistics. The batches of floats are normalized in place,
+        so they must not be referenced elsewhere (e.g. gathered from a storage).
+
+        :param batches: (np.ndarray) the batches of observations
+        :return: (tuple<np.ndarray>) the normalized batches
+        """
+        return tuple(self.normalize_obs(batch, out=batch if np.issubdtype(batch.dtype, np.floating)
+                                        and batch.flags.writeable else None) for batch in batches)
+
     def normalize_reward(self, reward: np.ndarray) -> np.ndarray:
         """
         Normalize rewards using this VecNormalize's rewards statistics.
@@ -128,18 +196,23 @@ class VecNormalize(VecEnvWrapper):
                            -self.clip_reward, self.clip_reward)
         return reward
 
-    def get_original_obs(self) -> np.ndarray:
+    def get_original_obs(self, copy: bool = True) -> np.ndarray:
         """
         Returns an unnormalized version of the observations from the most recent
         step or reset.
+
+        :param copy: (bool) Return a copy. Otherwise the returned array is the one received from the wrapped
+            VecEnv, it must not be modified (it is not modified by VecNormalize)
         """
-        return self.old_obs.copy()
+        return self.old_obs.copy() if copy else self.old_obs
 
-    def get_original_reward(self) -> np.ndarray:
+    def get_original_reward(self, copy: bool = True) -> np.ndarray:
         """
         Returns an unnormalized version of the rewards from the most recent step.
+
+        :param copy: (bool) Return a copy. Otherwise the returned array must not be modified
         """
-        return self.old_rews.copy()
+        return self.old_rews.copy() if copy else self.old_rews
 
     def reset(self, indices=None, *args, **kwargs):
         """
@@ -150,7 +223,7 @@ class VecNormalize(VecEnvWrapper):
         self.ret = np.zeros(self.num_envs)
         if self.training:
             self._update_reward(self.ret)
-        return self.normalize_obs(obs)
+        return self._normalize_new_obs(obs)
 
     @staticmethod
     def load(load_path, venv):
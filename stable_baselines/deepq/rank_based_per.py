@@ -1,92 +1,102 @@
-import sys
 import math
-import random
+
 import numpy as np
-from .binary_heap import BinaryHeap
+
+from stable_baselines.common.buffers import ColumnarStorage
 
 
 class RankPrioritizedReplayBuffer(object):
     __name__ = "RankPrioritizedReplayBuffer"
 
-    def __init__(self, size, alpha, learning_starts, batch_size=32):
+    def __init__(self, size, alpha, learning_starts, batch_size=32, rebalance_freq=100):
+        """
+        Rank-based prioritized replay buffer: P(i) = rank(i) ^ (-alpha) / sum_j (rank j) ^ (-alpha),
+        the transition with the highest priority having rank 1.
+
+        The transitions and their priorities are stored in preallocated arrays. The ranks are given by an index
+        sorted (argsort) on the priorities, which is rebuilt by `rebalance`, and when sampling once
+        `update_priorities` has been called `rebalance_freq` times since the last sort. Transitions added since the
+        last sort have the max priority and come first.
+        Sampling is stratified: the rank distribution is split in `batch_size` segments of equal probability
+        and one rank is drawn uniformly in each segment.
+
+        :param size: (int) Max number of transitions to store in the buffer. When the buffer overflows the old
+            memories are dropped.
+        :param alpha: (float) how much prioritization is used (0 - no prioritization, 1 - full prioritization)
+        :param learning_starts: (int) number of transitions stored before sampling starts
+        :param batch_size: (int) number of segments of the rank distribution (one sample per segment)
+        :param rebalance_freq: (int) number of calls to `update_priorities` between two sorts of the rank index
+        """
         self.size = size
-        self.replace_flag = True
         self.priority_size = self.size
 
         self.alpha = alpha
         # partition number N, split total size to N part
         self.partition_num = batch_size
+        self.partition_size = max(int(math.floor(self.size / self.partition_num)), 1)
         self.learning_starts = learning_starts
         self.batch_size = batch_size
+        self.rebalance_freq = rebalance_freq
 
         self.index = 0
         self.record_size = 0
         self.isFull = False
 
-        self._storage = {}
-        self.priority_queue = BinaryHeap(self.priority_size)
+        self._storage = ColumnarStorage(self.size)
+        self._priorities = np.zeros((self.size,), dtype=np.float64)
+        self._max_priority = 1.0
+        # Rank index: slots ordered by decreasing priority (as of the last sort)
+        self._sorted_idxes = np.zeros((0,), dtype=np.int64)
+        # Number of transitions written since the last sort, they are ranked first (most recent first)
+        self._n_new = 0
+        self._ranked_idxes = None
+        self._n_updates = 0
+
+        self._rank_cumsum = None
         self.distributions = self.build_distributions()
 
+    def __len__(self):
+        return self.record_size
+
     def build_distributions(self):
         """
-        preprocess pow of rank
-        (rank i) ^ (-alpha) / sum ((rank i) ^ (-alpha))
-        :return: distributions, dict
-        """
-        res = {}
-        n_partitions = self.partition_num
-        partition_num = 1
-        # each part size
-        partition_size = int(math.floor(self.size / n_partitions))
-
-        for n in range(partition_size, self.size + 1, partition_size):
-            if self.learning_starts <= n <= self.priority_size:
-                distribution = {}
-                # P(i) = (rank i) ^ (-alpha) / sum ((rank i) ^ (-alpha))
-                pdf = list(
-                    map(lambda x: math.pow(x, -self.alpha), range(1, n + 1))
-                )
-                pdf_sum = math.fsum(pdf)
-                distribution['pdf'] = list(map(lambda x: x / pdf_sum, pdf))
-                # split to k segment, and than uniform sample in each k
-                # set k = batch_size, each segment has total probability is 1 / batch_size
-                # strata_ends keep each segment start pos and end pos
-                cdf = np.cumsum(distribution['pdf'])
-                strata_ends = {1: 0, self.batch_size + 1: n}
-                step = 1 / float(self.batch_size)
-                index = 1
-                for s in range(2, self.batch_size + 1):
-                    while cdf[index] < step:
-                        index += 1
-                    strata_ends[s] = index
-                    step += 1 / float(self.batch_size)
-
-                distribution['strata_ends'] = strata_ends
-
-                res[partition_num] = distribution
-
-            partition_num += 1
-
-        return res
+        Precompute the rank distribution and, for each partition (number of stored transitions
+        n = k * size / partition_num), the boundaries of the `batch_size` segments of equal probability.
+
+        :return: (np.ndarray) strata boundaries of shape (partition_num + 1, batch_size + 1): ranks
+            strata[k, s] + 1 to strata[k, s + 1] belong to segment s when sampling among the first
+            k * partition_size ranks
+        """
+        # unnormalized P(rank) = rank ^ (-alpha), its cumulative sum gives the normalizer for any n
+        self._rank_cumsum = np.cumsum(np.power(np.arange(1, self.size + 1, dtype=np.float64), -self.alpha))
+        strata = np.zeros((self.partition_num + 1, self.batch_size + 1), dtype=np.int64)
+        for partition in range(1, self.partition_num + 1):
+            strata[partition] = self._compute_strata(partition * self.partition_size)
+        return strata
+
+    def _compute_strata(self, n_ranks):
+        """
+        Split the rank distribution over the first `n_ranks` ranks in `batch_size` segments of equal probability.
+
+        :param n_ranks: (int) number of ranks
+        :return: (np.ndarray) segment boundaries of shape (batch_size + 1,)
+        """
+        n_ranks = min(n_ranks, self.size)
+        cdf = self._rank_cumsum[:n_ranks]
+        steps = cdf[-1] * np.arange(1, self.batch_size) / self.batch_size
+        ends = np.maximum(np.searchsorted(cdf, steps, side='left'), 1)
+        return np.concatenate(([0], ends, [n_ranks]))
 
     def fix_index(self):
         """
         get next insert index
         :return: index, int
         """
-        if self.record_size <= self.size:
-            self.record_size += 1
-        if self.index % self.size == 0:
-            self.isFull = True if len(self._storage) == self.size else False
-            if self.replace_flag:
-                self.index = 1
-                return self.index
-            else:
-                sys.stderr.write('Experience replay buff is full and replace is set to FALSE!\n')
-                return -1
-        else:
-            self.index += 1
-            return self.index
+        index = self.index
+        self.index = (self.index + 1) % self.size
+        self.record_size = min(self.record_size + 1, self.size)
+        self.isFull = self.record_size == self.size
+        return index
 
     def can_sample(self, batch_size=None):
         if batch_size is None:
@@ -103,17 +113,28 @@ class RankPrioritizedReplayBuffer(object):
         """
         experience = (obs, action, reward, new_obs, done)
         insert_index = self.fix_index()
-        if insert_index > 0:
-            if insert_index in self._storage:
-                del self._storage[insert_index]
-            self._storage[insert_index] = experience
-            # add to priority queue
-            priority = self.priority_queue.get_max_priority()
-            self.priority_queue.update(priority, insert_index)
-            return True
+        if insert_index >= len(self._storage):
+            self._storage.append(experience)
         else:
-            sys.stderr.write('Insert failed\n')
-            return False
+            self._storage[insert_index] = experience
+        self._priorities[insert_index] = self._max_priority
+        self._n_new = min(self._n_new + 1, self.size)
+        self._ranked_idxes = None
+        return True
+
+    def adopt_storage(self, replay_buffer):
+        """
+        Take over the transitions of a ReplayBuffer in place (they are not copied), with the max priority.
+
+        :param replay_buffer: (ReplayBuffer) the buffer whose storage is taken over, of the same size
+        """
+        assert replay_buffer.buffer_size == self.size
+        self._storage = replay_buffer.storage
+        self.index = replay_buffer._next_idx
+        self.record_size = len(self._storage)
+        self.isFull = self.record_size == self.size
+        self._priorities[:self.record_size] = self._max_priority
+        self.rebalance()
 
     def retrieve(self, indices):
         """
@@ -121,25 +142,39 @@ class RankPrioritizedReplayBuffer(object):
         :param indices: list of experience id
         :return: experience replay sample
         """
-        obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
-        for i in indices:
-            if i == 0:
-                i = 1
-            data = self._storage[i]
-            obs_t, action, reward, obs_tp1, done = data
-            obses_t.append(np.array(obs_t, copy=False))
-            actions.append(np.array(action, copy=False))
-            rewards.append(reward)
-            obses_tp1.append(np.array(obs_tp1, copy=False))
-            dones.append(done)
-        return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones)
+        if isinstance(self._storage, ColumnarStorage):
+            obses_t, actions, rewards, obses_tp1, dones = self._storage.gather(indices)[:5]
+            return obses_t, actions, rewards, obses_tp1, dones
+        # list of transitions taken over from a ReplayBuffer (see adopt_storage)
+        transitions = [self._storage[idx] for idx in indices]
+        return tuple(np.array([transition[field] for transition in transitions]) for field in range(5))
 
     def rebalance(self):
         """
-        rebalance priority queue
+        rebuild the rank index by sorting the stored transitions by decreasing priority
         :return: None
         """
-        self.priority_queue.balance_tree()
+        self._sorted_idxes = np.argsort(-self._priorities[:self.record_size], kind='stable')
+        self._n_new = 0
+        self._ranked_idxes = None
+        self._n_updates = 0
+
+    def _get_ranked_idxes(self):
+        """
+        :return: (np.ndarray) the slots ordered by rank: the transitions added since the last sort first,
+            then the sorted ones
+        """
+        if self._ranked_idxes is None:
+            if self._n_new == 0:
+                self._ranked_idxes = self._sorted_idxes
+            else:
+                # the ring buffer is written in order: the new transitions are the last n_new slots before index
+                new_idxes = (self.index - 1 - np.arange(self._n_new)) % self.size
+                is_new = np.zeros((self.size,), dtype=bool)
+                is_new[new_idxes] = True
+                old_idxes = self._sorted_idxes[~is_new[self._sorted_idxes]]
+                self._ranked_idxes = np.concatenate((new_idxes, old_idxes))
+        return self._ranked_idxes
 
     def update_priorities(self, indices, delta):
         """
@@ -148,8 +183,10 @@ class RankPrioritizedReplayBuffer(object):
         :param delta: list of delta, order correspond to indices
         :return: None
         """
-        for i in range(0, len(indices)):
-            self.priority_queue.update(math.fabs(delta[i]), indices[i])
+        priorities = np.abs(np.asarray(delta, dtype=np.float64)).reshape(-1)
+        self._priorities[np.asarray(indices, dtype=np.int64)] = priorities
+        self._max_priority = max(self._max_priority, np.max(priorities))
+        self._n_updates += 1
 
     def sample(self, batch_size=None, beta=0.5):
         """
@@ -161,38 +198,32 @@ class RankPrioritizedReplayBuffer(object):
         """
         if batch_size is None:
             batch_size = self.batch_size
+        assert batch_size == self.batch_size, "The strata are computed for batches of size {}".format(self.batch_size)
 
+        if self._n_updates >= self.rebalance_freq:
+            self.rebalance()
+        ranked_idxes = self._get_ranked_idxes()
         dist_index = max(math.floor(self.record_size / self.size * self.partition_num), 1)
-            # issue 1 by @camigord
-        partition_size = math.floor(self.size / self.partition_num)
-        partition_max = dist_index * partition_size
-        distribution = self.distributions[dist_index]
-        rank_list = []
-        # sample from k segments
-        for n in range(1, batch_size + 1):
-            if distribution['strata_ends'][n] + 1 >= distribution['strata_ends'][n + 1]:
-                index = distribution['strata_ends'][n] + 1
-            else:
-                in_storage = False
-                while not in_storage:
-                    index = random.randint(distribution['strata_ends'][n] + 1,
-                                           distribution['strata_ends'][n + 1])
-                    try:
-                        in_storage = self.priority_queue.priority_to_experience([index])[0] <= self.record_size
-                    except:
-                        in_storage = False
-            rank_list.append(index)
-
-
-        # find all alpha pow, notice that pdf is a list, start from 0
-        alpha_pow = [distribution['pdf'][v - 1] for v in rank_list]
+        partition_max = dist_index * self.partition_size
+        if partition_max <= len(ranked_idxes):
+            strata = self.distributions[dist_index]
+        else:
+            # Less transitions than in the first partition
+            partition_max = len(ranked_idxes)
+            strata = self._compute_strata(partition_max)
+
+        # sample one rank (starting at 1) uniformly in each segment
+        low = strata[:-1] + 1
+        high = np.maximum(strata[1:], low)
+        rank_list = low + np.floor(np.random.rand(batch_size) * (high - low + 1)).astype(np.int64)
+        rank_list = np.minimum(rank_list, high)
+
+        # P(rank) = rank ^ (-alpha) / sum ((rank i) ^ (-alpha))
+        alpha_pow = np.power(rank_list.astype(np.float64), -self.alpha) / self._rank_cumsum[partition_max - 1]
         # w = (N * P(i)) ^ (-beta) / max w
-        w = np.power(np.array(alpha_pow) * partition_max, -beta)
-        w_max = max(w)
-        w = np.divide(w, w_max)
-        # rank list is priority id
-        # convert to experience id
-        rank_e_id = self.priority_queue.priority_to_experience(rank_list)
-        # get experience id according rank_e_id
+        w = np.power(alpha_pow * partition_max, -beta)
+        w = w / np.max(w)
+        # convert rank to experience id
+        rank_e_id = ranked_idxes[rank_list - 1]
         experience = self.retrieve(rank_e_id)
         return tuple(list(experience) + [w, rank_e_id])
@@ -1,3 +1,3 @@
 from stable_baselines.gail.model import GAIL
-from stable_baselines.gail.dataset.dataset import ExpertDataset, DataLoader
+from stable_baselines.gail.dataset.dataset import ExpertDataset, ExpertDatasetWriter, DataLoader
 from stable_baselines.gail.dataset.record_expert import generate_expert_traj
@@ -1,14 +1,129 @@
-import queue
-import time
-from multiprocessing import Queue, Process
+import multiprocessing
+import os
+import struct
 import scipy.signal
 
 import cv2  # pytype:disable=import-error
 import numpy as np
-from joblib import Parallel, delayed
 
 from stable_baselines import logger
 
+# Fields of the on-disk (one ".npy" file per field) format of the expert datasets
+EXPERT_FIELDS = ('obs', 'actions', 'rewards', 'episode_starts', 'episode_returns', 'episode_index')
+
+
+class _NpyAppender(object):
+    """
+    Write an ".npy" file incrementally: the rows are appended to the file, the header (which holds the number
+    of rows) is written with a fixed length and rewritten when the file is closed.
+
+    :param path: (str) path of the file
+    :param dtype: (np.dtype) dtype of the rows (if None, the dtype of the first rows)
+    """
+    # Length of the header, including the magic string: multiple of 64 for the alignment of the data
+    _HEADER_LEN = 256
+
+    def __init__(self, path, dtype=None):
+        self.path = path
+        self.dtype = dtype
+        self.n_rows = 0
+        self._row_shape = None
+        self._file = None
+
+    def append(self, rows):
+        """
+        :param rows: (np.ndarray) the rows to append, the first axis is the row
+        """
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if self._file is None:
+            self.dtype, self._row_shape = rows.dtype, rows.shape[1:]
+            self._file = open(self.path, 'wb')
+            self._write_header()
+        assert rows.shape[1:] == self._row_shape, "Inconsistent shape of the rows of {}".format(self.path)
+        self._file.write(rows.tobytes())
+        self.n_rows += len(rows)
+
+    def _write_header(self):
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+            np.lib.format.dtype_to_descr(self.dtype), (self.n_rows,) + self._row_shape)
+        prefix = np.lib.format.magic(1, 0)
+        # The header length is stored on 2 bytes, and the header ends with a newline
+        header = header.ljust(self._HEADER_LEN - len(prefix) - 3) + '\n'
+        self._file.seek(0)
+        self._file.write(prefix + struct.pack('<H', len(header)) + header.encode('latin1'))
+        self._file.seek(0, os.SEEK_END)
+
+    def close(self):
+        """
+        Write the final header and close the file.
+        """
+        if self._file is not None:
+            self._write_header()
+            self._file.close()
+            self._file = None
+
+
+class ExpertDatasetWriter(object):
+    """
+    Write an expert dataset incrementally, one transition at a time, in the on-disk format that
+    `ExpertDataset` opens with memory-mapping: a folder with one ".npy" file per field, the first axis being the
+    timestep ('obs', 'actions', 'rewards', 'episode_starts') or the episode ('episode_returns', and 'episode_index',
+    the index of the first timestep of each episode).
+
+    :param path: (str) path of the folder (created if needed)
+    :param obs_dtype: (np.dtype) dtype of the observations (if None, the dtype of the first observation).
+        It must be given for the paths of the images, as the length of the strings is fixed.
+    """
+    def __init__(self, path, obs_dtype=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._appenders = {key: _NpyAppender(os.path.join(path, key + '.npy'),
+                                             dtype=obs_dtype if key == 'obs' else None)
+                           for key in EXPERT_FIELDS}
+        self.n_transitions = 0
+
+    def add(self, obs, action, reward, episode_start):
+        """
+        Add a transition.
+
+        :param obs: (np.ndarray or str) the observation (or the path of the image)
+        :param action: (np.ndarray) the action
+        :param reward: (float) the reward
+        :param episode_start: (bool) whether the transition is the first of an episode
+        """
+        if episode_start:
+            self._appenders['episode_index'].append(np.array([self.n_transitions], dtype=np.int64))
+        self._appenders['obs'].append([obs])
+        self._appenders['actions'].append([action])
+        self._appenders['rewards'].append(np.array([reward], dtype=np.float64))
+        self._appenders['episode_starts'].append(np.array([episode_start], dtype=bool))
+        self.n_transitions += 1
+
+    def end_episode(self, episode_return):
+        """
+        :param episode_return: (float) the return of the episode that just ended
+        """
+        self._appenders['episode_returns'].append(np.array([episode_return], dtype=np.float64))
+
+    def close(self):
+        """
+        Finalize the files.
+        """
+        for appender in self._appenders.values():
+            appender.close()
+
+
+def load_expert_traj(path, mmap_mode='r'):
+    """
+    Open an expert dataset saved in the on-disk format written by `ExpertDatasetWriter`.
+
+    :param path: (str) path of the folder
+    :param mmap_mode: (str) memory-mapping mode of the arrays (see `np.load`), None loads them in memory
+    :return: (dict) the fields of the dataset
+    """
+    return {key: np.load(os.path.join(path, key + '.npy'), mmap_mode=mmap_mode)
+            for key in EXPERT_FIELDS if os.path.exists(os.path.join(path, key + '.npy'))}
+
 
 class ExpertDataset(object):
     """
@@ -20,7 +135,12 @@ class ExpertDataset(object):
     the remaining axes index into the data. In case of images, 'obs' contains the relative path to
     the images, to enable space saving from image compression.
 
-    :param expert_path: (str) The path to trajectory data (.npz file). Mutually exclusive with traj_data.
+    For large datasets, the data can instead be saved in a folder with one ".npy" file per key
+    (see `ExpertDatasetWriter`), which is memory-mapped rather than loaded in memory: the minibatches are
+    gathered from the mapped files.
+
+    :param expert_path: (str) The path to trajectory data (.npz file, or folder of ".npy" files).
+        Mutually exclusive with traj_data.
     :param traj_data: (dict) Trajectory data, in format described above. Mutually exclusive with expert_path.
     :param train_fraction: (float) the train validation split (0 to 1)
         for pre-training using behavior cloning (BC)
@@ -30,32 +150,37 @@ class ExpertDataset(object):
     :param verbose: (int) Verbosity
     :param sequential_preprocessing: (bool) Do not use subprocess to preprocess
         the data (slower but use less memory for the CI)
+    :param use_vf: (bool) Compute the value targets (discounted returns) of the timesteps, NaN for the timesteps
+        whose horizon is cut off by the end of the episode
+    :param discount_rate: (float) Discount factor of the value targets
+    :param n_workers: (int) Number of processes preprocessing the minibatches (e.g. decoding the images)
+    :param seed: (int) Seed of the shuffling of the minibatches
     """
     def __init__(self, expert_path=None, traj_data=None, train_fraction=0.7, batch_size=64,
-                 traj_limitation=-1, randomize=True, verbose=1, sequential_preprocessing=False, use_vf=False, discount_rate=0.99):
+                 traj_limitation=-1, randomize=True, verbose=1, sequential_preprocessing=False, use_vf=False, discount_rate=0.99,
+                 n_workers=1, seed=None):
         if traj_data is not None and expert_path is not None:
             raise ValueError("Cannot specify both 'traj_data' and 'expert_path'")
         if traj_data is None and expert_path is None:
             raise ValueError("Must specify one of 'traj_data' or 'expert_path'")
         if traj_data is None:
-            traj_data = np.load(expert_path, allow_pickle=True)
+            if os.path.isdir(expert_path):
+                traj_data = load_expert_traj(expert_path)
+            else:
+                traj_data = np.load(expert_path, allow_pickle=True)
         if verbose > 0:
             for key, val in traj_data.items():
                 print(key, val.shape)
 
         # Array of bool where episode_starts[i] = True for each new episode
         episode_starts = traj_data['episode_starts']
+        episode_start_idxs = np.flatnonzero(episode_starts)
 
         traj_limit_idx = len(traj_data['obs'])
 
-        if traj_limitation > 0:
-            n_episodes = 0
-            # Retrieve the index corresponding
-            # to the traj_limitation trajectory
-            for idx, episode_start in enumerate(episode_starts):
-                n_episodes += int(episode_start)
-                if n_episodes == (traj_limitation + 1):
-                    traj_limit_idx = idx - 1
+        if 0 < traj_limitation < len(episode_start_idxs):
+            # Index of the first timestep of the first trajectory that is not used
+            traj_limit_idx = episode_start_idxs[traj_limitation]
 
         observations = traj_data['obs'][:traj_limit_idx]
         actions = traj_data['actions'][:traj_limit_idx]
@@ -85,40 +210,41 @@ class ExpertDataset(object):
         self.actions = actions
 
         if use_vf:
-            self.vf_vals = {}
-            eps_start_i = np.nonzero(traj_data["episode_starts"])[0]
-            for i in range(1, len(eps_start_i)):
-                ep_rews = rewards[eps_start_i[i - 1]:eps_start_i[i]]
+            # Dense value targets, NaN where there is no target
+            self.vf_vals = np.full((len(observations),), np.nan)
+            # The timesteps whose horizon is cut off by episode end
+            horizon_len = int(-np.log(20) / np.log(discount_rate))
+            for ep_start, ep_end in zip(episode_start_idxs[:-1], episode_start_idxs[1:]):
+                if ep_start >= traj_limit_idx:
+                    break
+                ep_rews = np.reshape(rewards[ep_start:ep_end], (-1,))
                 sefr = scipy.signal.lfilter([1], [1, -discount_rate], x=ep_rews[::-1])[::-1]
-
-                # The timesteps whose horizon is cut off by episode end
-                horizon_len = int(-np.log(20) / np.log(discount_rate))
-
                 sefr = sefr[:-horizon_len]
-
-                self.vf_vals.update({eps_start_i[i - 1] + sefr_i: v for sefr_i, v in enumerate(sefr)})
+                self.vf_vals[ep_start:ep_start + len(sefr)] = sefr
         else:
             self.vf_vals = None
 
-        self.returns = traj_data['episode_returns'][:traj_limit_idx]
+        self.num_traj = int(np.count_nonzero(episode_start_idxs < traj_limit_idx))
+        self.returns = np.asarray(traj_data['episode_returns'][:self.num_traj])
         self.avg_ret = sum(self.returns) / len(self.returns)
         self.std_ret = np.std(np.array(self.returns))
         self.verbose = verbose
 
         assert len(self.observations) == len(self.actions), "The number of actions and observations differ " \
                                                             "please check your expert dataset"
-        self.num_traj = min(traj_limitation, np.sum(episode_starts))
         self.num_transition = len(self.observations)
         self.randomize = randomize
         self.sequential_preprocessing = sequential_preprocessing
+        self.n_workers = n_workers
+        self.seed = seed
 
         self.dataloader = None
         self.train_loader = DataLoader(train_indices, self.observations, self.actions, batch_size, vf_vals=self.vf_vals,
-                                       shuffle=self.randomize, start_process=False,
-                                       sequential=sequential_preprocessing)
+                                       n_workers=n_workers, shuffle=self.randomize, start_process=False,
+                                       sequential=sequential_preprocessing, seed=seed)
         self.val_loader = DataLoader(val_indices, self.observations, self.actions, batch_size, vf_vals=self.vf_vals,
-                                     shuffle=self.randomize, start_process=False,
-                                     sequential=sequential_preprocessing)
+                                     n_workers=n_workers, shuffle=self.randomize, start_process=False,
+                                     sequential=sequential_preprocessing, seed=seed)
 
         if self.verbose >= 1:
             self.log_info()
@@ -131,8 +257,8 @@ class ExpertDataset(object):
         """
         indices = np.random.permutation(len(self.observations)).astype(np.int64)
         self.dataloader = DataLoader(indices, self.observations, self.actions, batch_size,
-                                     shuffle=self.randomize, start_process=False,
-                                     sequential=self.sequential_preprocessing)
+                                     n_workers=self.n_workers, shuffle=self.randomize, start_process=False,
+                                     sequential=self.sequential_preprocessing, seed=self.seed)
 
     def __del__(self):
         del self.dataloader, self.train_loader, self.val_loader
@@ -165,7 +291,7 @@ class ExpertDataset(object):
             'val': self.val_loader
         }[split]
 
-        if dataloader.process is None:
+        if dataloader.processes is None:
             dataloader.start_process()
         try:
             return next(dataloader)
@@ -184,11 +310,72 @@ class ExpertDataset(object):
         plt.show()
 
 
+class _SharedBatchSlots(object):
+    """
+    Ring of minibatch slots in shared memory: the prefetching processes write the minibatches in the slots,
+    the main process copies them out, without pickling.
+
+    :param ctx: (multiprocessing context)
+    :param n_slots: (int) number of slots
+    :param batch_size: (int) max number of samples per minibatch
+    :param fields: ([(tuple, np.dtype)]) shape and dtype of a sample of each field (observations, actions, ...)
+    """
+
+    def __init__(self, ctx, n_slots, batch_size, fields):
+        self.n_slots = n_slots
+        self.batch_size = batch_size
+        self.fields = [(tuple(shape), np.dtype(dtype)) for shape, dtype in fields]
+        self._buffers = [ctx.RawArray('b', n_slots * batch_size * int(np.prod(shape)) * dtype.itemsize)
+                         for shape, dtype in self.fields]
+        # Number of samples of the minibatch in each slot
+        self._sizes = ctx.RawArray('l', n_slots)
+        # The main process waits for the slots to be ready, the prefetching processes for them to be free
+        self.ready = [ctx.Semaphore(0) for _ in range(n_slots)]
+        self.free = [ctx.Semaphore(1) for _ in range(n_slots)]
+        self._views = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = None
+        return state
+
+    @property
+    def views(self):
+        """
+        :return: ([np.ndarray]) numpy views of the buffers, of shape (n_slots, batch_size) + sample shape
+        """
+        if self._views is None:
+            self._views = [np.frombuffer(buffer, dtype=dtype).reshape((self.n_slots, self.batch_size) + shape)
+                           for buffer, (shape, dtype) in zip(self._buffers, self.fields)]
+        return self._views
+
+    def write(self, slot, size):
+        """
+        :param slot: (int) slot index
+        :param size: (int) number of samples of the minibatch written in the slot
+        :return: ([np.ndarray]) views of the slot for each field, to be filled
+        """
+        self._sizes[slot] = size
+        return [view[slot, :size] for view in self.views]
+
+    def read(self, slot):
+        """
+        :param slot: (int) slot index
+        :return: ([np.ndarray]) copies of the minibatch in the slot
+        """
+        size = self._sizes[slot]
+        return [view[slot, :size].copy() for view in self.views]
+
+
 class DataLoader(object):
     """
     A custom dataloader to preprocessing observations (including images)
     and feed them to the network.
 
+    The minibatches are prefetched by a pool of processes, that write them in a ring of shared memory slots
+    (minibatch ``i`` is prepared by the process ``i % n_workers``). The minibatches are returned in order,
+    and the order is deterministic given the seed.
+
     Original code for the dataloader from https://github.com/araffin/robotics-rl-srl
     (MIT licence)
     Authors: Antonin Raffin, René Traoré, Ashley Hill
@@ -197,24 +384,27 @@ class DataLoader(object):
     :param observations: (np.ndarray) observations or images path
     :param actions: (np.ndarray) actions
     :param batch_size: (int) Number of samples per minibatch
-    :param n_workers: (int) number of preprocessing worker (for loading the images)
+    :param vf_vals: (np.ndarray) value targets (NaN when there is no target), if None they are not returned
+    :param n_workers: (int) number of preprocessing processes
     :param infinite_loop: (bool) whether to have an iterator that can be reset
     :param max_queue_len: (int) Max number of minibatches that can be preprocessed at the same time
+        (rounded up to a multiple of n_workers)
     :param shuffle: (bool) Shuffle the minibatch after each epoch
     :param start_process: (bool) Start the preprocessing process (default: True)
-    :param backend: (str) joblib backend (one of 'multiprocessing', 'sequential', 'threading'
-        or 'loky' in newest versions)
+    :param backend: (str) Unused, kept for backward compatibility (the images are decoded by the preprocessing
+        processes)
     :param sequential: (bool) Do not use subprocess to preprocess the data
         (slower but use less memory for the CI)
     :param partial_minibatch: (bool) Allow partial minibatches (minibatches with a number of element
         lesser than the batch_size)
+    :param seed: (int) Seed of the shuffling (if None, drawn from the global numpy random generator)
     """
 
     def __init__(self, indices, observations, actions, batch_size, vf_vals=None, n_workers=1,
                  infinite_loop=True, max_queue_len=1, shuffle=False,
-                 start_process=True, backend='threading', sequential=False, partial_minibatch=True):
+                 start_process=True, backend='threading', sequential=False, partial_minibatch=True, seed=None):
         super(DataLoader, self).__init__()
-        self.n_workers = n_workers
+        self.n_workers = max(1, n_workers)
         self.infinite_loop = infinite_loop
         self.indices = indices
         self.original_indices = indices.copy()
@@ -227,26 +417,63 @@ class DataLoader(object):
         self.observations = observations
         self.actions = actions
         self.shuffle = shuffle
-        self.queue = Queue(max_queue_len)
-        self.process = None
+        # Each slot is only written by one process, which prepares its minibatches in order
+        self.n_slots = self.n_workers * int(np.ceil(max(1, max_queue_len) / self.n_workers))
+        self.processes = None
         self.load_images = isinstance(observations[0], str)
         self.backend = backend
         self.sequential = sequential
         self.start_idx = 0
         self.vf_vals = vf_vals
+        self.seed = np.random.randint(2 ** 31 - 1) if seed is None else seed
+        self._epoch = -1
+        # Index of the next minibatch returned by the prefetching processes, counted across epochs
+        self._minibatch_count = 0
+        self._epoch_ended = False
+        self._slots = None
         if start_process:
             self.start_process()
 
+    def _epoch_indices(self, epoch):
+        """
+        :param epoch: (int) epoch index
+        :return: (np.ndarray) the indices of the samples, in the order of the epoch
+        """
+        if not self.shuffle:
+            return self.original_indices
+        return np.random.RandomState([self.seed, epoch]).permutation(self.original_indices)
+
+    def _sample_fields(self):
+        """
+        :return: ([(tuple, np.dtype)]) shape and dtype of a sample of each field of the minibatches
+        """
+        if self.load_images:
+            image = self._make_batch_element(self.observations[0])
+            fields = [(image.shape[1:], image.dtype)]
+        else:
+            fields = [(self.observations.shape[1:], self.observations.dtype)]
+        fields.append((self.actions.shape[1:], self.actions.dtype))
+        if self.vf_vals is not None:
+            fields.append(((), np.float64))
+        return fields
+
     def start_process(self):
-        """Start preprocessing process"""
+        """Start preprocessing processes"""
         # Skip if in sequential mode
         if self.sequential:
             return
-        self.process = Process(target=self._run)
-        # Make it a deamon, so it will be deleted at the same time
-        # of the main process
-        self.process.daemon = True
-        self.process.start()
+        ctx = multiprocessing.get_context()
+        self._slots = _SharedBatchSlots(ctx, self.n_slots, self.batch_size, self._sample_fields())
+        self._minibatch_count = 0
+        self._epoch_ended = False
+        self.processes = []
+        for worker_idx in range(self.n_workers):
+            process = ctx.Process(target=self._run, args=(worker_idx,))
+            # Make it a deamon, so it will be deleted at the same time
+            # of the main process
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
 
     @property
     def _minibatch_indices(self):
@@ -257,77 +484,72 @@ class DataLoader(object):
         """
         return self.indices[self.start_idx:self.start_idx + self.batch_size]
 
-    # TODO: Fix reward return for value function pretraining
-    # Have to sum up future rewards
-    # process entire array at start is probably best idea
-    # cumulative sum up until each episode start
-    # what to do at episode start?
-    #
+    def _gather_minibatch(self):
+        """
+        Gather the data of the current minibatch. The indices are sorted, so that the data is read
+        in the order of the (possibly memory-mapped) arrays.
+
+        :return: (np.ndarray, np.ndarray, np.ndarray) observations (or images path), actions
+            and value targets (None if not used)
+        """
+        minibatch_indices = np.sort(self._minibatch_indices)
+        obs = self.observations[minibatch_indices]
+        actions = self.actions[minibatch_indices]
+        vf_vals = self.vf_vals[minibatch_indices] if self.vf_vals is not None else None
+        return obs, actions, vf_vals
 
     def sequential_next(self):
         """
         Sequential version of the pre-processing.
         """
-        if self.start_idx > len(self.indices):
+        if self.start_idx >= self.n_minibatches * self.batch_size:
             raise StopIteration
 
         if self.start_idx == 0:
-            if self.shuffle:
-                # Shuffle indices
-                np.random.shuffle(self.indices)
+            self._epoch += 1
+            self.indices = self._epoch_indices(self._epoch)
 
-        obs = self.observations[self._minibatch_indices]
+        obs, actions, vf_vals = self._gather_minibatch()
         if self.load_images:
             obs = np.concatenate([self._make_batch_element(image_path) for image_path in obs],
                                  axis=0)
 
-        actions = self.actions[self._minibatch_indices]
-        if self.vf_vals is not None:
-            vf_vals = [self.vf_vals[ind] if ind in self.vf_vals else np.nan for ind in self._minibatch_indices]
-
         self.start_idx += self.batch_size
         if self.vf_vals is not None:
             return obs, actions, vf_vals
         else:
             return obs, actions
 
-    def _run(self):
-        start = True
-        with Parallel(n_jobs=self.n_workers, batch_size="auto", backend=self.backend) as parallel:
-            while start or self.infinite_loop:
-                start = False
-
-                if self.shuffle:
-                    np.random.shuffle(self.indices)
-
-                for minibatch_idx in range(self.n_minibatches):
-
-                    self.start_idx = minibatch_idx * self.batch_size
-
-                    obs = self.observations[self._minibatch_indices]
-                    if self.load_images:
-                        if self.n_workers <= 1:
-                            obs = [self._make_batch_element(image_path)
-                                   for image_path in obs]
-
-                        else:
-                            obs = parallel(delayed(self._make_batch_element)(image_path)
-                                           for image_path in obs)
-
-                        obs = np.concatenate(obs, axis=0)
-
-                    actions = self.actions[self._minibatch_indices]
-                    if self.vf_vals is not None:
-                        vf_vals = [self.vf_vals[ind] if ind in self.vf_vals else np.nan for ind in self._minibatch_indices]
-
-                        self.queue.put((obs, actions, vf_vals))
-                    else:
-                        self.queue.put((obs, actions))
-
-                    # Free memory
-                    del obs
+    def _run(self, worker_idx):
+        """
+        Loop of a preprocessing process: prepare the minibatches ``worker_idx + k * n_workers``.
 
-                self.queue.put(None)
+        :param worker_idx: (int) index of the process
+        """
+        epoch = None
+        minibatch_count = worker_idx
+        while self.infinite_loop or minibatch_count < self.n_minibatches:
+            minibatch_epoch, minibatch_idx = divmod(minibatch_count, self.n_minibatches)
+            if minibatch_epoch != epoch:
+                epoch = minibatch_epoch
+                self.indices = self._epoch_indices(epoch)
+            self.start_idx = minibatch_idx * self.batch_size
+            obs, actions, vf_vals = self._gather_minibatch()
+
+            slot = minibatch_count % self.n_slots
+            self._slots.free[slot].acquire()
+            slot_views = self._slots.write(slot, len(actions))
+            if self.load_images:
+                for sample_idx, image_path in enumerate(obs):
+                    slot_views[0][sample_idx] = self._make_batch_element(image_path)[0]
+            else:
+                slot_views[0][...] = obs
+            slot_views[1][...] = actions
+            if vf_vals is not None:
+                slot_views[2][...] = vf_vals
+            self._slots.ready[slot].release()
+
+            minibatch_count += self.n_workers
 
     @classmethod
     def _make_batch_element(cls, image_path):
@@ -364,19 +586,27 @@ class DataLoader(object):
         if self.sequential:
             return self.sequential_next()
 
-        if self.process is None:
+        if self.processes is None:
             raise ValueError("You must call .start_process() before using the dataloader")
-        while True:
-            try:
-                val = self.queue.get_nowait()
-                break
-            except queue.Empty:
-                time.sleep(0.001)
-                continue
-        if val is None:
+        # The end of each epoch is signaled once
+        if self._minibatch_count > 0 and self._minibatch_count % self.n_minibatches == 0 and not self._epoch_ended:
+            self._epoch_ended = True
+            raise StopIteration
+        if not self.infinite_loop and self._minibatch_count >= self.n_minibatches:
             raise StopIteration
-        return val
+        self._epoch_ended = False
+
+        slot = self._minibatch_count % self.n_slots
+        # Blocking wait for the slot, with a timeout to detect the death of the preprocessing processes
+        while not self._slots.ready[slot].acquire(timeout=1.):
+            if not all(process.is_alive() for process in self.processes):
+                raise RuntimeError("A preprocessing process of the dataloader died")
+        minibatch = tuple(self._slots.read(slot))
+        self._slots.free[slot].release()
+        self._minibatch_count += 1
+        return minibatch
 
     def __del__(self):
-        if self.process is not None:
-            self.process.terminate()
+        if self.processes is not None:
+            for process in self.processes:
+                process.terminate()
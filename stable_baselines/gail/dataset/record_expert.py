@@ -10,10 +10,11 @@ from gym import spaces
 from stable_baselines.common.base_class import BaseRLModel
 from stable_baselines.common.base_class import _UnvecWrapper
 from stable_baselines.common.vec_env import VecEnv, VecFrameStack
+from stable_baselines.gail.dataset.dataset import ExpertDatasetWriter, load_expert_traj
 
 
 def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
-                         n_episodes=100, image_folder='recorded_images'):
+                         n_episodes=100, image_folder='recorded_images', save_format='npz'):
     """
     Train expert controller (if needed) and record expert trajectories.
 
@@ -32,7 +33,10 @@ def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
     :param n_timesteps: (int) Number of training timesteps
     :param n_episodes: (int) Number of trajectories (episodes) to record
     :param image_folder: (str) When using images, folder that will be used to record images.
-    :return: (dict) the generated expert trajectories.
+    :param save_format: (str) 'npz' to save a numpy archive, or 'npy' to write the transitions incrementally
+        in the folder ``save_path``, one ".npy" file per key (see ``ExpertDatasetWriter``), so that large datasets
+        do not have to fit in memory
+    :return: (dict) the generated expert trajectories (memory-mapped arrays with the 'npy' format).
     """
 
     # Retrieve the environment using the RL model
@@ -40,6 +44,8 @@ def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
         env = model.get_env()
 
     assert env is not None, "You must set the env in the model or pass it to the function."
+    assert save_format in ('npz', 'npy'), "Unknown save format: {}".format(save_format)
+    assert save_format == 'npz' or save_path is not None, "The 'npy' format needs a save path"
 
     is_vec_env = False
     if isinstance(env, VecEnv) and not isinstance(env, _UnvecWrapper):
@@ -76,7 +82,7 @@ def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
             #                          "VecFrameStack with n_stack > 4"
             image_ext = 'png'
 
-        folder_path = os.path.dirname(save_path)
+        folder_path = save_path if save_format == 'npy' else os.path.dirname(save_path)
         image_folder = os.path.join(folder_path, image_folder)
         os.makedirs(image_folder, exist_ok=True)
         print("=" * 10)
@@ -92,11 +98,17 @@ def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
     rewards = []
     episode_returns = np.zeros((n_episodes,))
     episode_starts = []
+    writer = None
+    if save_format == 'npy':
+        # The paths of the images are stored as fixed-length strings
+        obs_dtype = 'U{}'.format(len(image_folder) + 32) if record_images else None
+        writer = ExpertDatasetWriter(save_path, obs_dtype=obs_dtype)
 
     pbar = tqdm.tqdm(desc="Generating expert dataset", total=n_episodes)
     ep_idx = 0
     obs = env.reset()
     episode_starts.append(True)
+    episode_start = True
     reward_sum = 0.0
     idx = 0
     # state and mask for recurrent policies
@@ -114,9 +126,13 @@ def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
             if obs_.shape[-1] == 3:
                 obs_ = cv2.cvtColor(obs_, cv2.COLOR_RGB2BGR)
             cv2.imwrite(image_path, obs_)
-            observations.append(image_path)
+            obs_record = image_path
+        elif isinstance(env.observation_space, spaces.Box):
+            obs_record = np.reshape(obs, (-1,) + env.observation_space.shape)[0] if writer is not None else obs
         else:
-            observations.append(obs)
+            obs_record = np.reshape(obs, (-1,))[:1] if writer is not None else obs
+        if writer is None:
+            observations.append(obs_record)
 
         if isinstance(model, BaseRLModel):
             action, state = model.predict(obs, state=state, mask=mask)
@@ -132,12 +148,22 @@ def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
             reward = np.array([reward[0]])
             done = np.array([done[0]])
 
-        actions.append(action)
-        rewards.append(reward)
-        episode_starts.append(done)
+        if writer is not None:
+            if isinstance(env.action_space, spaces.Box):
+                action_record = np.reshape(action, (-1,) + env.action_space.shape)[0]
+            else:
+                action_record = np.reshape(action, (-1,))[:1]
+            writer.add(obs_record, action_record, np.reshape(reward, (-1,))[0], episode_start)
+        else:
+            actions.append(action)
+            rewards.append(reward)
+            episode_starts.append(done)
+        episode_start = bool(np.any(done))
         reward_sum += reward
         idx += 1
         if done:
+            if writer is not None:
+                writer.end_episode(np.reshape(reward_sum, (-1,))[0])
             if not is_vec_env:
                 obs = env.reset()
                 # Reset the state in case of a recurrent policy
@@ -148,6 +174,14 @@ def generate_expert_traj(model, save_path=None, env=None, n_timesteps=0,
             ep_idx += 1
             pbar.update()
 
+    if writer is not None:
+        writer.close()
+        numpy_dict = load_expert_traj(save_path)  # type: Dict[str, np.ndarray]
+        for key, val in numpy_dict.items():
+            print(key, val.shape)
+        env.close()
+        return numpy_dict
+
     if isinstance(env.observation_space, spaces.Box) and not record_images:
         observations = np.concatenate(observations).reshape((-1,) + env.observation_space.shape)
     elif isinstance(env.observation_space, spaces.Discrete):
@@ -18,10 +18,12 @@ class HER(BaseRLModel):
         currently supported: DQN, DDPG, SAC
     :param n_sampled_goal: (int)
     :param goal_selection_strategy: (GoalSelectionStrategy or str)
+    :param relabel_at_sample: (bool) Relabel the sampled transitions with new goals instead of storing
+        `n_sampled_goal` artificial transitions per transition (see HindsightExperienceReplayWrapper)
     """
 
     def __init__(self, policy, env, model_class, n_sampled_goal=4,
-                 goal_selection_strategy='future', norm=False, *args, **kwargs):
+                 goal_selection_strategy='future', norm=False, relabel_at_sample=False, *args, **kwargs):
 
         assert not isinstance(env, VecEnvWrapper), "HER does not support VecEnvWrapper"
 
@@ -42,6 +44,7 @@ class HER(BaseRLModel):
 
         self.n_sampled_goal = n_sampled_goal
         self.goal_selection_strategy = goal_selection_strategy
+        self.relabel_at_sample = relabel_at_sample
 
         if self.env is not None:
             self._create_replay_wrapper(self.env, norm)
@@ -69,7 +72,8 @@ class HER(BaseRLModel):
         self.replay_wrapper = functools.partial(HindsightExperienceReplayWrapper,
                                                 n_sampled_goal=self.n_sampled_goal,
                                                 goal_selection_strategy=self.goal_selection_strategy,
-                                                wrapped_env=self.env)
+                                                wrapped_env=self.env,
+                                                relabel_at_sample=self.relabel_at_sample)
 
     def set_env(self, env):
         assert not isinstance(env, VecEnvWrapper), "HER does not support VecEnvWrapper"
@@ -135,6 +139,7 @@ class HER(BaseRLModel):
         # it will not work with VecEnv
         data['n_sampled_goal'] = self.n_sampled_goal
         data['goal_selection_strategy'] = self.goal_selection_strategy
+        data['relabel_at_sample'] = self.relabel_at_sample
         data['model_class'] = self.model_class
         data['her_obs_space'] = self.observation_space
         data['her_action_space'] = self.action_space
@@ -155,6 +160,7 @@ class HER(BaseRLModel):
         model = cls(policy=data["policy"], env=env, model_class=data['model_class'],
                     n_sampled_goal=data['n_sampled_goal'],
                     goal_selection_strategy=data['goal_selection_strategy'],
+                    relabel_at_sample=data.get('relabel_at_sample', False),
                     _init_setup_model=False)
         model.__dict__['observation_space'] = data['her_obs_space']
         model.__dict__['action_space'] = data['her_action_space']
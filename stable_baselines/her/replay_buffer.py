@@ -53,10 +53,14 @@ class HindsightExperienceReplayWrapper(object):
         the goals for the artificial transitions.
     :param wrapped_env: (HERGoalEnvWrapper) the GoalEnv wrapped using HERGoalEnvWrapper,
         that enables to convert observation to dict, and vice versa
+    :param relabel_at_sample: (bool) Only store the actual transitions (with their achieved goal) and relabel
+        the sampled transitions with new goals, instead of storing the artificial transitions. The replay buffer
+        must be a ReplayBuffer and the `compute_reward` method of the env must accept batches of goals.
     """
     __name__ = "HindsightExperienceReplayWrapper"
 
-    def __init__(self, replay_buffer, n_sampled_goal, goal_selection_strategy, wrapped_env, her_starts=0):
+    def __init__(self, replay_buffer, n_sampled_goal, goal_selection_strategy, wrapped_env, her_starts=0,
+                 relabel_at_sample=False):
         super(HindsightExperienceReplayWrapper, self).__init__()
 
         assert isinstance(goal_selection_strategy, GoalSelectionStrategy), "Invalid goal selection strategy," \
@@ -83,6 +87,16 @@ class HindsightExperienceReplayWrapper(object):
         else:
             self.recurrent = False
 
+        self.relabel_at_sample = relabel_at_sample
+        if self.relabel_at_sample:
+            assert replay_buffer.__name__ == "ReplayBuffer", "Relabeling at sample time requires a ReplayBuffer"
+            assert self.goal_selection_strategy != GoalSelectionStrategy.FUTURE_STABLE, \
+                "The future_stable strategy is not supported when relabeling at sample time"
+            # Achieved goal, timestep in the episode and episode length of each stored transition
+            self._achieved_goals = None
+            self._ep_t = np.zeros((replay_buffer.buffer_size,), dtype=np.int64)
+            self._ep_len = np.zeros((replay_buffer.buffer_size,), dtype=np.int64)
+
     def add(self, obs_t, action, reward, obs_tp1, done, bootstrap=None, **extra_data):
         """
         add a new transition to the buffer
@@ -106,6 +120,8 @@ class HindsightExperienceReplayWrapper(object):
             self.episode_transitions = []
 
     def sample(self, *args, **kwargs):
+        if self.relabel_at_sample:
+            return self._sample_relabeled(*args, **kwargs)
         batch = self.replay_buffer.sample(*args, **kwargs)
         if self.replay_buffer.__name__ == "RecurrentReplayBuffer" and self.replay_buffer.scan_length > 0 and False:
             # TODO: i think it is guaranteed that there are always scan_length instances but im not sure
@@ -118,6 +134,63 @@ class HindsightExperienceReplayWrapper(object):
 
         return batch
 
+    def _sample_relabeled(self, batch_size, env=None, **_kwargs):
+        """
+        Sample a batch of actual transitions and replace the goal of a part of them
+        (as many as when storing `n_sampled_goal` artificial transitions per actual transition).
+
+        :param batch_size: (int) How many transitions to sample.
+        :param env: (Optional[VecNormalize]) associated gym VecEnv to normalize the observations/rewards
+        :return: the batch, as returned by ReplayBuffer.sample
+        """
+        buffer = self.replay_buffer
+        idxes = np.random.randint(0, len(buffer), size=batch_size)
+        obs, actions, rewards, next_obs, dones, extra_data = buffer._encode_sample(idxes)
+        rewards = rewards.astype(np.result_type(rewards.dtype, np.float32))
+
+        ep_t, ep_len = self._ep_t[idxes], self._ep_len[idxes]
+        relabel = np.random.random(batch_size) < self.n_sampled_goal / (self.n_sampled_goal + 1)
+        uniform = np.random.random(batch_size)
+        if self.goal_selection_strategy in [GoalSelectionStrategy.FUTURE, GoalSelectionStrategy.HORIZON]:
+            # We cannot sample a goal from the future in the last step of an episode
+            relabel &= ep_t < ep_len - 1
+            if self.goal_selection_strategy == GoalSelectionStrategy.FUTURE:
+                high = ep_len
+            else:
+                high = np.minimum((ep_t + 2 + 0.05 * ep_len).astype(np.int64), ep_len)
+            goal_t = ep_t + 1 + (uniform * (high - ep_t - 1)).astype(np.int64)
+        elif self.goal_selection_strategy == GoalSelectionStrategy.FINAL:
+            goal_t = ep_len - 1
+        elif self.goal_selection_strategy == GoalSelectionStrategy.EPISODE:
+            # The first transitions of the episode may have been overwritten
+            age = (buffer._next_idx - 1 - idxes) % buffer.buffer_size
+            first_t = ep_t - np.minimum(ep_t, len(buffer) - 1 - age)
+            goal_t = first_t + (uniform * (ep_len - first_t)).astype(np.int64)
+        if self.goal_selection_strategy == GoalSelectionStrategy.RANDOM:
+            goal_idxes = np.random.randint(0, len(buffer), size=batch_size)
+        else:
+            goal_idxes = (idxes - ep_t + goal_t) % buffer.buffer_size
+
+        relabel_idxes = np.flatnonzero(relabel)
+        if len(relabel_idxes) > 0:
+            goals = self._achieved_goals[goal_idxes[relabel_idxes]]
+            achieved_slice = slice(self.env.obs_dim, self.env.obs_dim + self.env.goal_dim)
+            desired_slice = slice(self.env.obs_dim + self.env.goal_dim, None)
+            obs[relabel_idxes, ..., desired_slice] = goals
+            next_obs[relabel_idxes, ..., desired_slice] = goals
+
+            prev_state = obs[relabel_idxes, ..., achieved_slice]
+            achieved_goal = next_obs[relabel_idxes, ..., achieved_slice]
+            desired_goal = goals
+            if getattr(self.env, "multi_dimensional_obs", False):
+                prev_state, achieved_goal, desired_goal = prev_state[:, 0], achieved_goal[:, 0], desired_goal[:, 0]
+            info = {"step": ep_t[relabel_idxes], "prev_state": prev_state, "action": actions[relabel_idxes]}
+            rewards[relabel_idxes] = np.reshape(self.env.compute_reward(achieved_goal, desired_goal, info), (-1,))
+            dones[relabel_idxes] = False
+
+        obs, next_obs = buffer._normalize_obs_pair(obs, next_obs, env)
+        return obs, actions, buffer._normalize_reward(rewards, env), next_obs, dones, extra_data
+
     def can_sample(self, n_samples):
         """
         Check if n_samples samples can be sampled
@@ -187,6 +260,10 @@ class HindsightExperienceReplayWrapper(object):
         episode in the replay buffer.
         This method is called only after each end of episode.
         """
+        if self.relabel_at_sample:
+            self._store_actual_episode()
+            return
+
         # For each transition in the last episode,
         # create a set of artificial transitions
         if self.replay_buffer.__name__ == "StableReplayBuffer" or self.goal_selection_strategy == GoalSelectionStrategy.FUTURE_STABLE:
@@ -307,5 +384,24 @@ class HindsightExperienceReplayWrapper(object):
             if self.replay_buffer.__name__ == "RecurrentReplayBuffer":
                 self.replay_buffer.store_episode()
 
+    def _store_actual_episode(self):
+        """
+        Store the transitions of the last episode in one batch, with their achieved goal and
+        their timestep in the episode (relabel_at_sample mode).
+        """
+        n_steps = len(self.episode_transitions)
+        assert n_steps <= self.replay_buffer.buffer_size, "The episode is longer than the replay buffer"
+        idxes = (self.replay_buffer._next_idx + np.arange(n_steps)) % self.replay_buffer.buffer_size
+        episode_data = [np.array(values) for values in zip(*self.episode_transitions)]
+        self.replay_buffer.extend(*episode_data)
+
+        achieved_goals = episode_data[0][..., self.env.obs_dim:self.env.obs_dim + self.env.goal_dim]
+        if self._achieved_goals is None:
+            self._achieved_goals = np.zeros((self.replay_buffer.buffer_size,) + achieved_goals.shape[1:],
+                                            dtype=achieved_goals.dtype)
+        self._achieved_goals[idxes] = achieved_goals
+        self._ep_t[idxes] = np.arange(n_steps)
+        self._ep_len[idxes] = n_steps
+
     def update_state(self, *args, **kwargs):
         return self.replay_buffer.update_state(*args, **kwargs)
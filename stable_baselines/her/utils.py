@@ -1,6 +1,6 @@
 from collections import OrderedDict
 
-from stable_baselines.common.running_mean_std import RunningMeanStdSerial, RunningMeanStd
+from stable_baselines.common.running_mean_std import RunningMeanStd
 import pickle
 
 import numpy as np
@@ -76,10 +76,11 @@ class HERGoalEnvWrapper(object):
         if norm:
             obs_norm_shape = [self.observation_space.shape[-1]]
             obs_norm_shape[-1] -= self.goal_dim
-            self.obs_rms = RunningMeanStd(shape=obs_norm_shape)
+            # The observations of an episode are buffered until its end (see `step`)
+            max_episode_steps = getattr(getattr(env, 'spec', None), 'max_episode_steps', None)
+            self.obs_rms = RunningMeanStd(shape=obs_norm_shape, buffer_size=max_episode_steps or 1024)
             self.ret_rms = RunningMeanStd(shape=())
             self.clip_obs = clip_obs
-            self.ep_obs_data = []
 
     def convert_dict_to_obs(self, obs_dict):
         """
@@ -121,9 +122,9 @@ class HERGoalEnvWrapper(object):
             self.orig_obs = np.copy(obs)
             obs = self.normalize_observation(obs, update=True)
             if done:
-                if len(self.ep_obs_data) > 0:
-                    self.obs_rms.update(np.stack(self.ep_obs_data, axis=0))
-                    self.ep_obs_data = []
+                # The statistics are updated with the observations of the episode at its end (or also every
+                # `buffer_size` steps, when the episode length is not bounded by the spec of the environment)
+                self.obs_rms.flush()
         return obs, reward, done, info
 
     def normalize_observation(self, obs, update):
@@ -137,9 +138,9 @@ class HERGoalEnvWrapper(object):
                 obs = self.convert_dict_to_obs(obs)
             if self.training and update:
                 if len(obs.shape) == 2:
-                    self.ep_obs_data.append(obs[0, :-self.goal_dim])
+                    self.obs_rms.push(obs[0, :-self.goal_dim])
                 else:
-                    self.ep_obs_data.append(obs[:-self.goal_dim])
+                    self.obs_rms.push(obs[:-self.goal_dim])
             obs[..., :-self.goal_dim] = np.clip((obs[..., :-self.goal_dim] - self.obs_rms.mean) /
                                            np.sqrt(self.obs_rms.var + self.epsilon),
                                            -self.clip_obs, self.clip_obs)
@@ -1,4 +1,5 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import gym
 import numpy as np
@@ -7,7 +8,11 @@ import tensorflow as tf
 from stable_baselines import logger
 from stable_baselines.common import explained_variance, ActorCriticRLModel, tf_util, SetVerbosity, TensorboardWriter
 from stable_baselines.common.runners import AbstractEnvRunner
+from stable_baselines.common.rollout_storage import RolloutStorage
+from stable_baselines.common.scenario_pool import ScenarioPool
 from stable_baselines.common.policies import ActorCriticPolicy, RecurrentActorCriticPolicy
+from stable_baselines.common.distributions import make_proba_dist_type
+from stable_baselines.common.input import observation_input
 from stable_baselines.common.schedules import get_schedule_fn
 from stable_baselines.common.tf_util import total_episode_reward_logger
 from stable_baselines.common.math_util import safe_mean
@@ -48,11 +53,29 @@ class PPO2(ActorCriticRLModel):
         results, you must set `n_cpu_tf_sess` to 1.
     :param n_cpu_tf_sess: (int) The number of threads for TensorFlow operations
         If None, the number of cpu of the current machine will be used.
+    :param pipeline_rollouts: (bool) Collect the next rollout in a background thread while the model is trained
+        on the current one. The rollouts are then collected with parameters that are one update behind (and
+        updated during the collection), which is corrected by the importance ratio of the recorded neglogpacs.
+        The rollout callbacks (`on_rollout_start`, `on_step`, `on_rollout_end`) are called from the background
+        thread, around each collection: they run while the model is trained on the previous rollout. The logged
+        timesteps are the ones at the end of the collection of the rollout trained on.
+    :param scenario_pool_size: (int) With active sampling, max number of candidate initial states
+        (default: 50 per environment). The candidates are generated in advance by the SubprocVecEnv workers. Once
+        the pool is full, the ones with the lowest critic discrepancy are queued in the environments with
+        `add_scenarios` (n_envs per episode start of the last rollout).
+    :param scenario_scoring_batch_size: (int) With active sampling, max number of candidates (re)scored against
+        the current critic at each update, the unscored and least recently scored ones first
+        (default: all the candidates)
+    :param rollout_on_device: (bool) Upload each rollout once into variables of the TensorFlow session: the
+        minibatches are shuffled and gathered in the graph, so that the training steps only feed scalars
+        (feed-forward policies only, the policy must accept an `obs_default` keyword argument like
+        `FeedForwardPolicy`)
     """
     def __init__(self, policy, env, gamma=0.99, n_steps=128, ent_coef=0.01, learning_rate=2.5e-4, vf_coef=0.5,
                  max_grad_norm=0.5, lam=0.95, nminibatches=4, noptepochs=4, cliprange=0.2, cliprange_vf=None,
                  verbose=0, tensorboard_log=None, _init_setup_model=True, policy_kwargs=None,
-                 full_tensorboard_log=False, seed=None, n_cpu_tf_sess=None):
+                 full_tensorboard_log=False, seed=None, n_cpu_tf_sess=None, pipeline_rollouts=False,
+                 scenario_pool_size=None, scenario_scoring_batch_size=None, rollout_on_device=False):
 
         self.learning_rate = learning_rate
         self.cliprange = cliprange
@@ -67,6 +90,10 @@ class PPO2(ActorCriticRLModel):
         self.noptepochs = noptepochs
         self.tensorboard_log = tensorboard_log
         self.full_tensorboard_log = full_tensorboard_log
+        self.pipeline_rollouts = pipeline_rollouts
+        self.scenario_pool_size = scenario_pool_size
+        self.scenario_scoring_batch_size = scenario_scoring_batch_size
+        self.rollout_on_device = rollout_on_device
 
         self.action_ph = None
         self.advs_ph = None
@@ -87,12 +114,18 @@ class PPO2(ActorCriticRLModel):
         self.value = None
         self.n_batch = None
         self.summary = None
+        self.minibatch_idx_ph = None
+        self._rollout_phs = None
+        self._upload_rollout_op = None
+        self._shuffle_rollout_op = None
 
         super().__init__(policy=policy, env=env, verbose=verbose, requires_vec_env=True,
                          _init_setup_model=_init_setup_model, policy_kwargs=policy_kwargs,
                          seed=seed, n_cpu_tf_sess=n_cpu_tf_sess)
 
         self.active_sampling = False
+        # Whether the environments currently gather reset data for active sampling
+        self._gather_reset_data = False
 
         if _init_setup_model:
             self.setup_model()
@@ -131,20 +164,38 @@ class PPO2(ActorCriticRLModel):
                     n_batch_step = self.n_envs
                     n_batch_train = self.n_batch // self.nminibatches
 
+                # Minibatch gathered from the rollout stored on the device, used when the inputs are not fed
+                minibatch = {}
+                train_policy_kwargs = self.policy_kwargs
+                if self.rollout_on_device:
+                    assert n_batch_train is None, "The rollout can only be stored on the device with feed-forward " \
+                                                  "policies"
+                    with tf.variable_scope("rollout", reuse=False):
+                        minibatch = self._setup_rollout_on_device()
+                    train_policy_kwargs = dict(self.policy_kwargs, obs_default=minibatch["obs"])
+
                 act_model = self.policy(self.sess, self.observation_space, self.action_space, self.n_envs, 1,
                                         n_batch_step, reuse=False, **self.policy_kwargs)
                 with tf.variable_scope("train_model", reuse=True,
                                        custom_getter=tf_util.outer_scope_getter("train_model")):
                     train_model = self.policy(self.sess, self.observation_space, self.action_space,
                                               self.n_envs // self.nminibatches, self.n_steps, n_batch_train,
-                                              reuse=True, **self.policy_kwargs)
+                                              reuse=True, **train_policy_kwargs)
+
+                def _input_ph(dtype, shape, name, minibatch_key):
+                    # With the rollout on the device, the inputs of the loss can still be fed (e.g. by `pretrain`)
+                    if minibatch_key in minibatch:
+                        return tf.placeholder_with_default(minibatch[minibatch_key], shape, name=name)
+                    return tf.placeholder(dtype, shape, name=name)
 
                 with tf.variable_scope("loss", reuse=False):
-                    self.action_ph = train_model.pdtype.sample_placeholder([None], name="action_ph")
-                    self.advs_ph = tf.placeholder(tf.float32, [None], name="advs_ph")
-                    self.rewards_ph = tf.placeholder(tf.float32, [None], name="rewards_ph")
-                    self.old_neglog_pac_ph = tf.placeholder(tf.float32, [None], name="old_neglog_pac_ph")
-                    self.old_vpred_ph = tf.placeholder(tf.float32, [None], name="old_vpred_ph")
+                    pdtype = train_model.pdtype
+                    self.action_ph = _input_ph(pdtype.sample_dtype(), [None] + pdtype.sample_shape(), "action_ph",
+                                               "actions")
+                    self.advs_ph = _input_ph(tf.float32, [None], "advs_ph", "advs")
+                    self.rewards_ph = _input_ph(tf.float32, [None], "rewards_ph", "returns")
+                    self.old_neglog_pac_ph = _input_ph(tf.float32, [None], "old_neglog_pac_ph", "neglogpacs")
+                    self.old_vpred_ph = _input_ph(tf.float32, [None], "old_vpred_ph", "values")
                     self.learning_rate_ph = tf.placeholder(tf.float32, [], name="learning_rate_ph")
                     self.clip_range_ph = tf.placeholder(tf.float32, [], name="clip_range_ph")
 
@@ -245,8 +296,53 @@ class PPO2(ActorCriticRLModel):
 
                 self.summary = tf.summary.merge_all()
 
+    def _setup_rollout_on_device(self):
+        """
+        Create the variables holding a rollout in the session, the op uploading a rollout in them
+        (fed with `_rollout_phs`) and the op shuffling their order at each optimization epoch.
+
+        :return: (dict) the fields of the minibatch `minibatch_idx_ph` of the shuffled rollout, gathered in the
+            graph, with the advantages normalized over the minibatch
+        """
+        batch_size = self.n_batch // self.nminibatches
+        pdtype = make_proba_dist_type(self.action_space)
+        self._rollout_phs = {
+            "obs": observation_input(self.observation_space, self.n_batch, name="obs_ph")[0],
+            "actions": pdtype.sample_placeholder([self.n_batch], name="actions_ph"),
+        }
+        for key in ("returns", "values", "neglogpacs"):
+            self._rollout_phs[key] = tf.placeholder(tf.float32, [self.n_batch], name=key + "_ph")
+        rollout = {key: tf.Variable(tf.zeros(placeholder.shape, placeholder.dtype), trainable=False, name=key)
+                   for key, placeholder in self._rollout_phs.items()}
+        self._upload_rollout_op = tf.group(*[tf.assign(rollout[key], placeholder)
+                                             for key, placeholder in self._rollout_phs.items()])
+
+        indices = tf.Variable(tf.range(self.n_batch), trainable=False, name="indices")
+        self._shuffle_rollout_op = tf.assign(indices, tf.random_shuffle(indices))
+        self.minibatch_idx_ph = tf.placeholder(tf.int32, [], name="minibatch_idx_ph")
+        start = self.minibatch_idx_ph * batch_size
+        minibatch = {key: tf.gather(variable, indices[start:start + batch_size]) for key, variable in rollout.items()}
+
+        advs = minibatch["returns"] - minibatch["values"]
+        advs_mean, advs_var = tf.nn.moments(advs, axes=[0])
+        minibatch["advs"] = (advs - advs_mean) / (tf.sqrt(advs_var) + 1e-8)
+        return minibatch
+
+    def _upload_rollout(self, obs, returns, actions, values, neglogpacs):
+        """
+        Upload a rollout into the variables of the session (with `rollout_on_device`).
+
+        :param obs: (np.ndarray) the observations
+        :param returns: (np.ndarray) the returns
+        :param actions: (np.ndarray) the actions
+        :param values: (np.ndarray) the values
+        :param neglogpacs: (np.ndarray) Negative Log-likelihood probability of Actions
+        """
+        fields = {"obs": obs, "returns": returns, "actions": actions, "values": values, "neglogpacs": neglogpacs}
+        self.sess.run(self._upload_rollout_op, {self._rollout_phs[key]: value for key, value in fields.items()})
+
     def _train_step(self, learning_rate, cliprange, obs, returns, masks, actions, values, neglogpacs, update,
-                    writer, states=None, cliprange_vf=None):
+                    writer, states=None, cliprange_vf=None, minibatch_idx=None):
         """
         Training of PPO2 Algorithm
 
@@ -264,13 +360,19 @@ class PPO2(ActorCriticRLModel):
         :return: policy gradient loss, value function loss, policy entropy,
                 approximation of kl divergence, updated clipping range, training update operation
         :param cliprange_vf: (float) Clipping factor for the value function
+        :param minibatch_idx: (int) With `rollout_on_device`, index of the minibatch of the uploaded rollout
+            (the observations, returns, masks, actions, values and neglogpacs are then None)
         """
-        advs = returns - values
-        advs = (advs - advs.mean()) / (advs.std() + 1e-8)
-        td_map = {self.train_model.obs_ph: obs, self.action_ph: actions,
-                  self.advs_ph: advs, self.rewards_ph: returns,
-                  self.learning_rate_ph: learning_rate, self.clip_range_ph: cliprange,
-                  self.old_neglog_pac_ph: neglogpacs, self.old_vpred_ph: values}
+        if minibatch_idx is not None:
+            td_map = {self.minibatch_idx_ph: minibatch_idx,
+                      self.learning_rate_ph: learning_rate, self.clip_range_ph: cliprange}
+        else:
+            advs = returns - values
+            advs = (advs - advs.mean()) / (advs.std() + 1e-8)
+            td_map = {self.train_model.obs_ph: obs, self.action_ph: actions,
+                      self.advs_ph: advs, self.rewards_ph: returns,
+                      self.learning_rate_ph: learning_rate, self.clip_range_ph: cliprange,
+                      self.old_neglog_pac_ph: neglogpacs, self.old_vpred_ph: values}
         if states is not None:
             td_map[self.train_model.states_ph] = states
             td_map[self.train_model.dones_ph] = masks
@@ -310,8 +412,6 @@ class PPO2(ActorCriticRLModel):
         self.cliprange = get_schedule_fn(self.cliprange)
         cliprange_vf = get_schedule_fn(self.cliprange_vf)
 
-        samples = deque(maxlen=5 * self.env.num_envs * 10)
-
         new_tb_log = self._init_num_timesteps(reset_num_timesteps)
         callback = self._init_callback(callback)
 
@@ -324,112 +424,174 @@ class PPO2(ActorCriticRLModel):
 
             callback.on_training_start(locals(), globals())
 
-            for update in range(1, n_updates + 1):
-                assert self.n_batch % self.nminibatches == 0, ("The number of minibatches (`nminibatches`) "
-                                                               "is not a factor of the total number of samples "
-                                                               "collected per rollout (`n_batch`), "
-                                                               "some samples won't be used."
-                                                               )
-                batch_size = self.n_batch // self.nminibatches
-                t_start = time.time()
-                frac = 1.0 - (update - 1.0) / n_updates
-                lr_now = self.learning_rate(frac)
-                cliprange_now = self.cliprange(frac)
-                cliprange_vf_now = cliprange_vf(frac)
-
-                callback.on_rollout_start()
-                # true_reward is the reward without discount
-                rollout = self.runner.run(callback)
-                # Unpack
-                obs, returns, masks, actions, values, neglogpacs, states, ep_infos, true_reward = rollout
-
-                callback.on_rollout_end()
-
-                # Early stopping due to the callback
-                if not self.runner.continue_training:
-                    break
-
-                self.ep_info_buf.extend(ep_infos)
-                mb_loss_vals = []
-                if states is None:  # nonrecurrent version
-                    update_fac = max(self.n_batch // self.nminibatches // self.noptepochs, 1)
-                    inds = np.arange(self.n_batch)
-                    for epoch_num in range(self.noptepochs):
-                        np.random.shuffle(inds)
-                        for start in range(0, self.n_batch, batch_size):
-                            timestep = self.num_timesteps // update_fac + ((epoch_num *
-                                                                            self.n_batch + start) // batch_size)
-                            end = start + batch_size
-                            mbinds = inds[start:end]
-                            slices = (arr[mbinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
-                            mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, writer=writer,
-                                                                 update=timestep, cliprange_vf=cliprange_vf_now))
-                else:  # recurrent version
-                    update_fac = max(self.n_batch // self.nminibatches // self.noptepochs // self.n_steps, 1)
-                    assert self.n_envs % self.nminibatches == 0
-                    env_indices = np.arange(self.n_envs)
-                    flat_indices = np.arange(self.n_envs * self.n_steps).reshape(self.n_envs, self.n_steps)
-                    envs_per_batch = batch_size // self.n_steps
-                    for epoch_num in range(self.noptepochs):
-                        np.random.shuffle(env_indices)
-                        for start in range(0, self.n_envs, envs_per_batch):
-                            timestep = self.num_timesteps // update_fac + ((epoch_num *
-                                                                            self.n_envs + start) // envs_per_batch)
-                            end = start + envs_per_batch
-                            mb_env_inds = env_indices[start:end]
-                            mb_flat_inds = flat_indices[mb_env_inds].ravel()
-                            slices = (arr[mb_flat_inds] for arr in (obs, returns, masks, actions, values, neglogpacs))
-                            mb_states = states[mb_env_inds]
-                            mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, update=timestep,
-                                                                 writer=writer, states=mb_states,
-                                                                 cliprange_vf=cliprange_vf_now))
-
-                loss_vals = np.mean(mb_loss_vals, axis=0)
-                t_now = time.time()
-                fps = int(self.n_batch / (t_now - t_start))
-
-                if writer is not None:
-                    total_episode_reward_logger(self.episode_reward,
-                                                true_reward.reshape((self.n_envs, self.n_steps)),
-                                                masks.reshape((self.n_envs, self.n_steps)),
-                                                writer, self.num_timesteps)
-
-                if self.verbose >= 1 and (update % log_interval == 0 or update == 1):
-                    explained_var = explained_variance(values, returns)
-                    logger.logkv("serial_timesteps", update * self.n_steps)
-                    logger.logkv("n_updates", update)
-                    logger.logkv("total_timesteps", self.num_timesteps)
-                    logger.logkv("fps", fps)
-                    logger.logkv("explained_variance", float(explained_var))
-                    if len(self.ep_info_buf) > 0 and len(self.ep_info_buf[0]) > 0:
-                        logger.logkv('ep_reward_mean', safe_mean([ep_info['r'] for ep_info in self.ep_info_buf]))
-                        logger.logkv('ep_len_mean', safe_mean([ep_info['l'] for ep_info in self.ep_info_buf]))
-                    logger.logkv('time_elapsed', t_start - t_first_start)
-                    for (loss_val, loss_name) in zip(loss_vals, self.loss_names):
-                        logger.logkv(loss_name, loss_val)
-                    logger.dumpkvs()
-
-                if self.active_sampling:
-                    if len(samples) < samples.maxlen:
-                        samples.extendleft(self.env.get_reset_data())
+            # Collection of the next rollout in the background, with the pipelined rollouts
+            executor = ThreadPoolExecutor(max_workers=1) if self.pipeline_rollouts else None
+            next_rollout = None
+            # The rollout being collected must not overwrite the one used for training
+            self.runner.double_buffering = self.pipeline_rollouts
+            # Active sampling candidates
+            scenario_pool = ScenarioPool(self.scenario_pool_size or 50 * self.n_envs)
+
+            try:
+                for update in range(1, n_updates + 1):
+                    assert self.n_batch % self.nminibatches == 0, ("The number of minibatches (`nminibatches`) "
+                                                                   "is not a factor of the total number of samples "
+                                                                   "collected per rollout (`n_batch`), "
+                                                                   "some samples won't be used."
+                                                                   )
+                    batch_size = self.n_batch // self.nminibatches
+                    t_start = time.time()
+                    frac = 1.0 - (update - 1.0) / n_updates
+                    lr_now = self.learning_rate(frac)
+                    cliprange_now = self.cliprange(frac)
+                    cliprange_vf_now = cliprange_vf(frac)
+
+                    if executor is None:
+                        rollout, num_timesteps = self._collect_rollout(callback)
                     else:
-                        resets = np.count_nonzero(masks)
-                        if resets > 0:
-                            sample_obs = [s["obs"] for s in samples]
-                            scores = self.train_model.get_critic_discrepancy(sample_obs)
-                            samples = deque(
-                                [sample for _, sample in sorted(zip(scores, samples), key=lambda pair: pair[0])],
-                                maxlen=5 * self.env.num_envs * 10)
-                            scenarios = []
-                            for i in range(self.env.num_envs * resets):
-                                scenarios.append(samples.popleft()["initial_state"])
-
-                            self.env.add_scenarios(scenarios)
-
-                            samples.extendleft(self.env.get_reset_data())
+                        if next_rollout is None:
+                            next_rollout = executor.submit(self._collect_rollout, callback)
+                        rollout, num_timesteps = next_rollout.result()
+                        next_rollout = None
+                    # Unpack
+                    obs, returns, masks, actions, values, neglogpacs, states, ep_infos, true_reward = rollout
+
+                    # Early stopping due to the callback
+                    if not self.runner.continue_training:
+                        break
+
+                    if executor is not None:
+                        # The environments are idle: interact with them before the next collection
+                        self._active_sampling_step(scenario_pool, masks)
+                        if update < n_updates:
+                            next_rollout = executor.submit(self._collect_rollout, callback)
+
+                    self.ep_info_buf.extend(ep_infos)
+                    mb_loss_vals = []
+                    if states is None:  # nonrecurrent version
+                        update_fac = max(self.n_batch // self.nminibatches // self.noptepochs, 1)
+                        inds = np.arange(self.n_batch)
+                        if self.rollout_on_device:
+                            # One upload per update, the minibatches are shuffled and gathered in the graph
+                            self._upload_rollout(obs, returns, actions, values, neglogpacs)
+                        for epoch_num in range(self.noptepochs):
+                            if self.rollout_on_device:
+                                self.sess.run(self._shuffle_rollout_op)
+                            else:
+                                np.random.shuffle(inds)
+                            for start in range(0, self.n_batch, batch_size):
+                                timestep = num_timesteps // update_fac + ((epoch_num *
+                                                                           self.n_batch + start) // batch_size)
+                                end = start + batch_size
+                                minibatch_idx = None
+                                if self.rollout_on_device:
+                                    slices = (None,) * 6
+                                    minibatch_idx = start // batch_size
+                                else:
+                                    mbinds = inds[start:end]
+                                    slices = (arr[mbinds] for arr in (obs, returns, masks, actions, values, neglogpacs))
+                                mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, writer=writer,
+                                                                     update=timestep, cliprange_vf=cliprange_vf_now,
+                                                                     minibatch_idx=minibatch_idx))
+                    else:  # recurrent version
+                        update_fac = max(self.n_batch // self.nminibatches // self.noptepochs // self.n_steps, 1)
+                        assert self.n_envs % self.nminibatches == 0
+                        env_indices = np.arange(self.n_envs)
+                        flat_indices = np.arange(self.n_envs * self.n_steps).reshape(self.n_envs, self.n_steps)
+                        envs_per_batch = batch_size // self.n_steps
+                        for epoch_num in range(self.noptepochs):
+                            np.random.shuffle(env_indices)
+                            for start in range(0, self.n_envs, envs_per_batch):
+                                timestep = num_timesteps // update_fac + ((epoch_num *
+                                                                           self.n_envs + start) // envs_per_batch)
+                                end = start + envs_per_batch
+                                mb_env_inds = env_indices[start:end]
+                                mb_flat_inds = flat_indices[mb_env_inds].ravel()
+                                slices = (arr[mb_flat_inds]
+                                          for arr in (obs, returns, masks, actions, values, neglogpacs))
+                                mb_states = states[mb_env_inds]
+                                mb_loss_vals.append(self._train_step(lr_now, cliprange_now, *slices, update=timestep,
+                                                                     writer=writer, states=mb_states,
+                                                                     cliprange_vf=cliprange_vf_now))
+
+                    loss_vals = np.mean(mb_loss_vals, axis=0)
+                    t_now = time.time()
+                    fps = int(self.n_batch / (t_now - t_start))
+
+                    if writer is not None:
+                        total_episode_reward_logger(self.episode_reward,
+                                                    true_reward.reshape((self.n_envs, self.n_steps)),
+                                                    masks.reshape((self.n_envs, self.n_steps)),
+                                                    writer, num_timesteps)
+
+                    if self.verbose >= 1 and (update % log_interval == 0 or update == 1):
+                        explained_var = explained_variance(values, returns)
+                        logger.logkv("serial_timesteps", update * self.n_steps)
+                        logger.logkv("n_updates", update)
+                        logger.logkv("total_timesteps", num_timesteps)
+                        logger.logkv("fps", fps)
+                        logger.logkv("explained_variance", float(explained_var))
+                        if len(self.ep_info_buf) > 0 and len(self.ep_info_buf[0]) > 0:
+                            logger.logkv('ep_reward_mean', safe_mean([ep_info['r'] for ep_info in self.ep_info_buf]))
+                            logger.logkv('ep_len_mean', safe_mean([ep_info['l'] for ep_info in self.ep_info_buf]))
+                        logger.logkv('time_elapsed', t_start - t_first_start)
+                        for (loss_val, loss_name) in zip(loss_vals, self.loss_names):
+                            logger.logkv(loss_name, loss_val)
+                        logger.dumpkvs()
+
+                    if executor is None:
+                        self._active_sampling_step(scenario_pool, masks)
+            finally:
+                if executor is not None:
+                    # Wait for the collection in progress (if training was interrupted) before leaving
+                    executor.shutdown()
             callback.on_training_end()
             return self
 
+    def _collect_rollout(self, callback):
+        """
+        Collect a rollout, between the rollout callbacks (in the background thread, with the pipelined rollouts)
+
+        :param callback: (BaseCallback) the callback of the training
+        :return: (tuple, int) the rollout, and the number of timesteps at the end of its collection
+        """
+        callback.on_rollout_start()
+        # true_reward is the reward without discount
+        rollout = self.runner.run(callback)
+        callback.on_rollout_end()
+        return rollout, self.num_timesteps
+
+    def _active_sampling_step(self, scenario_pool, masks):
+        """
+        Active sampling, between two rollouts: once the scenario pool is full, score the candidates against the
+        current critic and queue the ones with the lowest critic discrepancy in the environments (n_envs per episode
+        start of the last rollout), then add the reset data of the environments to the pool. The environments are
+        not waited for: the reset data requested at the end of this step is received during the next rollout.
+
+        :param scenario_pool: (ScenarioPool) the candidate scenarios
+        :param masks: (np.ndarray) the episode starts of the last rollout
+        """
+        if self.active_sampling != self._gather_reset_data:
+            self._gather_reset_data = self.active_sampling
+            self.env.set_gather_reset_data(self._gather_reset_data)
+        if not self.active_sampling:
+            return
+
+        reset_data = self.env.collect_reset_data()
+        if len(scenario_pool) == scenario_pool.capacity:
+            n_resets = np.count_nonzero(masks)
+            if n_resets > 0:
+                # The pool pops the highest scores first
+                scenario_pool.score(lambda obs: -np.asarray(self.train_model.get_critic_discrepancy(obs)),
+                                    batch_size=self.scenario_scoring_batch_size)
+                self.env.add_scenarios(scenario_pool.pop(self.n_envs * n_resets))
+        if len(reset_data) > 0:
+            scenario_pool.add(np.array([data["obs"] for data in reset_data]),
+                              [data["initial_state"] for data in reset_data])
+        # New candidates are only gathered while the pool is not full
+        if len(scenario_pool) < scenario_pool.capacity:
+            self.env.request_reset_data()
+
     def save(self, save_path, cloudpickle=False):
         data = {
             "gamma": self.gamma,
@@ -452,7 +614,11 @@ class PPO2(ActorCriticRLModel):
             "seed": self.seed,
             "_vectorize_action": self._vectorize_action,
             "policy_kwargs": self.policy_kwargs,
-            "num_timesteps": self.num_timesteps
+            "num_timesteps": self.num_timesteps,
+            "pipeline_rollouts": self.pipeline_rollouts,
+            "scenario_pool_size": self.scenario_pool_size,
+            "scenario_scoring_batch_size": self.scenario_scoring_batch_size,
+            "rollout_on_device": self.rollout_on_device
         }
 
         params_to_save = self.get_parameters()
@@ -474,11 +640,26 @@ class Runner(AbstractEnvRunner):
         super().__init__(env=env, model=model, n_steps=n_steps)
         self.lam = lam
         self.gamma = gamma
+        self.storage = self._make_storage()
+        # Alternate between two storages, when a rollout is collected while the previous one is used
+        self.double_buffering = False
+        self._spare_storage = None
+
+    def _make_storage(self):
+        """
+        :return: (RolloutStorage) storage of the rollouts
+        """
+        return RolloutStorage(self.n_envs, self.n_steps, dtypes={'obs': self.obs.dtype, 'rewards': np.float32,
+                                                                 'values': np.float32, 'dones': np.bool_,
+                                                                 'neglogpacs': np.float32})
 
     def _run(self):
         """
         Run a learning step of the model
 
+        The transitions are written in place in the rollout storage of the runner: the returned arrays are views
+        of the storage, overwritten by the next rollout (or the one after, with double buffering).
+
         :return:
             - observations: (np.ndarray) the observations
             - rewards: (np.ndarray) the rewards
@@ -489,18 +670,17 @@ class Runner(AbstractEnvRunner):
             - states: (np.ndarray) the internal states of the recurrent policies
             - infos: (dict) the extra information of the model
         """
-        # mb stands for minibatch
-        mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_neglogpacs, mb_envterms = [], [], [], [], [], [], []
+        if self.double_buffering:
+            if self._spare_storage is None:
+                self._spare_storage = self._make_storage()
+            self.storage, self._spare_storage = self._spare_storage, self.storage
+        storage = self.storage
         mb_states = self.states
         ep_infos = []
 
-        for _ in range(self.n_steps):
+        for step in range(self.n_steps):
             actions, values, self.states, neglogpacs = self.model.step(self.obs, self.states, self.dones)
-            mb_obs.append(self.obs.copy())
-            mb_actions.append(actions)
-            mb_values.append(values)
-            mb_neglogpacs.append(neglogpacs)
-            mb_dones.append(self.dones)
+            storage.add(step, obs=self.obs, actions=actions, values=values, neglogpacs=neglogpacs, dones=self.dones)
             clipped_actions = actions
             # Clip the actions to avoid out of bound error
             if isinstance(self.env.action_space, gym.spaces.Box):
@@ -515,43 +695,19 @@ class Runner(AbstractEnvRunner):
                     # Return dummy values
                     return [None] * 9
 
-            env_terms = []
             for info in infos:
                 maybe_ep_info = info.get('episode')
-                termination_reason = info.get("termination", None)
                 if maybe_ep_info is not None:
                     ep_infos.append(maybe_ep_info)
-                env_terms.append(termination_reason is not None and termination_reason != "steps")
-            env_terms = np.array(env_terms)
-            mb_envterms.append(env_terms)
-            mb_rewards.append(rewards)
-        # batch of steps to batch of rollouts
-        mb_obs = np.asarray(mb_obs, dtype=self.obs.dtype)
-        mb_rewards = np.asarray(mb_rewards, dtype=np.float32)
-        mb_actions = np.asarray(mb_actions)
-        mb_values = np.asarray(mb_values, dtype=np.float32)
-        mb_neglogpacs = np.asarray(mb_neglogpacs, dtype=np.float32)
-        mb_dones = np.asarray(mb_dones, dtype=np.bool)
+            storage.add(step, rewards=rewards)
+
         last_values = self.model.value(self.obs, self.states, self.dones)
         # discount/bootstrap off value fn
-        mb_advs = np.zeros_like(mb_rewards)
-        true_reward = np.copy(mb_rewards)
-        last_gae_lam = 0
-        for step in reversed(range(self.n_steps)):
-            if step == self.n_steps - 1:
-                nextnonterminal = 1.0 - self.dones
-                #nextnonterminal = 1.0 - env_terms
-                nextvalues = last_values
-            else:
-                nextnonterminal = 1.0 - mb_dones[step + 1]
-                #nextnonterminal = 1.0 - mb_envterms[step + 1]
-                nextvalues = mb_values[step + 1]
-            delta = mb_rewards[step] + self.gamma * nextvalues * nextnonterminal - mb_values[step]
-            mb_advs[step] = last_gae_lam = delta + self.gamma * self.lam * nextnonterminal * last_gae_lam
-        mb_returns = mb_advs + mb_values
+        storage.compute_returns_and_advantages(last_values, self.dones, self.gamma, self.lam)
 
+        # true_reward is the reward without discount
         mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_neglogpacs, true_reward = \
-            map(swap_and_flatten, (mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_neglogpacs, true_reward))
+            map(storage.flat, ('obs', 'returns', 'dones', 'actions', 'values', 'neglogpacs', 'rewards'))
 
         return mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_neglogpacs, mb_states, ep_infos, true_reward
 
@@ -69,7 +69,7 @@ class SAC(OffPolicyRLModel):
 
         super(SAC, self).__init__(policy=policy, env=env, replay_buffer=None, verbose=verbose, write_freq=write_freq,
                                   policy_base=SACPolicy, requires_vec_env=False, policy_kwargs=policy_kwargs,
-                                  seed=seed, n_cpu_tf_sess=n_cpu_tf_sess)
+                                  seed=seed, n_cpu_tf_sess=n_cpu_tf_sess, supports_vec_env=True)
         self.buffer_type = buffer_type
         self.buffer_size = buffer_size
         self.learning_rate = learning_rate
@@ -375,6 +375,13 @@ class SAC(OffPolicyRLModel):
             # Initial learning rate
             current_lr = self.learning_rate(1)
 
+            if self.n_envs > 1:
+                # The transitions of the environments are interleaved in the replay buffer
+                assert not getattr(self.replay_buffer, "shared_obs", False), \
+                    "Error: replay buffers with shared observations require a single environment"
+                self._learn_vec_env(total_timesteps, callback, writer, log_interval)
+                return self
+
             start_time = time.time()
             episode_rewards = [0.0]
             episode_successes = []
@@ -383,7 +390,7 @@ class SAC(OffPolicyRLModel):
             obs = self.env.reset()
             # Retrieve unnormalized observation for saving into the buffer
             if self._vec_normalize_env is not None:
-                obs_ = self._vec_normalize_env.get_original_obs().squeeze()
+                obs_ = self._vec_normalize_env.get_original_obs(copy=False).squeeze()
 
             n_updates = 0
             infos_values = []
@@ -425,8 +432,8 @@ class SAC(OffPolicyRLModel):
 
                 # Store only the unnormalized version
                 if self._vec_normalize_env is not None:
-                    new_obs_ = self._vec_normalize_env.get_original_obs().squeeze()
-                    reward_ = self._vec_normalize_env.get_original_reward().squeeze()
+                    new_obs_ = self._vec_normalize_env.get_original_obs(copy=False).squeeze()
+                    reward_ = self._vec_normalize_env.get_original_reward(copy=False).squeeze()
                 else:
                     # Avoid changing the original ones
                     obs_, new_obs_, reward_ = obs, new_obs, reward
@@ -520,6 +527,148 @@ class SAC(OffPolicyRLModel):
             callback.on_training_end()
             return self
 
+    def _learn_vec_env(self, total_timesteps, callback, writer, log_interval):
+        """
+        Training loop used when learning from a VecEnv with more than one environment:
+        one action is computed per environment at each step and the resulting batch of transitions
+        is written in the replay buffer with a single call to `extend`. When the VecEnv steps asynchronously,
+        each step only concerns the first environments whose previous step is completed.
+
+        :param total_timesteps: (int) The total number of samples to train on
+        :param callback: (BaseCallback) callback called at every step
+        :param writer: (TensorFlow FileWriter) the writer for tensorboard (can be None)
+        :param log_interval: (int) The number of episodes before logging
+        """
+        start_time = time.time()
+        current_lr = self.learning_rate(1)
+        episode_rewards = [0.0]
+        episode_successes = []
+        running_rewards = np.zeros((self.n_envs,))
+        if self.action_noise is not None:
+            self.action_noise.reset()
+        obs, env_ids = self._vec_env_reset()
+        # Retrieve unnormalized observation for saving into the buffer
+        if self._vec_normalize_env is not None:
+            obs_ = self._vec_normalize_env.get_original_obs(copy=False)
+
+        n_updates = 0
+        infos_values = []
+        initial_step = self.num_timesteps
+
+        callback.on_training_start(locals(), globals())
+        callback.on_rollout_start()
+
+        while self.num_timesteps < initial_step + total_timesteps:
+            step = self.num_timesteps - initial_step
+            if self.num_timesteps < self.learning_starts:
+                unscaled_action = self._sample_vec_env_actions(len(env_ids))
+                action = scale_action(self.action_space, unscaled_action)
+            else:
+                action = self.policy_tf.step(obs, deterministic=False)
+                if self.action_noise is not None:
+                    noise = np.array([self.action_noise() for _ in range(len(env_ids))])
+                    action = np.clip(action + noise, -1, 1)
+                if self.random_exploration > 0:
+                    explore = np.random.rand(len(env_ids)) < self.random_exploration
+                    if np.any(explore):
+                        action[explore] = scale_action(self.action_space,
+                                                       self._sample_vec_env_actions(len(env_ids))[explore])
+                unscaled_action = unscale_action(self.action_space, action)
+
+            obs, action, new_obs, reward, done, infos, env_ids = self._vec_env_step(obs, action, unscaled_action,
+                                                                                     env_ids)
+            n_steps = len(env_ids)
+            self.num_timesteps += n_steps
+
+            if callback.on_step() is False:
+                break
+
+            # Store only the unnormalized version
+            if self._vec_normalize_env is not None:
+                new_obs_ = self._vec_normalize_env.get_original_obs(copy=False)
+                reward_ = self._vec_normalize_env.get_original_reward(copy=False)
+            else:
+                obs_, new_obs_, reward_ = obs, new_obs, reward
+
+            # The terminal observations (before the automatic reset) are the unnormalized ones
+            next_obs_ = self._get_vec_env_next_obs(new_obs_, done, infos)
+            self.replay_buffer.extend(obs_, action, reward_, next_obs_, done.astype(np.float32))
+            obs = new_obs
+            if self._vec_normalize_env is not None:
+                obs_ = new_obs_
+
+            for info in infos:
+                maybe_ep_info = info.get('episode')
+                if maybe_ep_info is not None:
+                    self.ep_info_buf.extend([maybe_ep_info])
+
+            if writer is not None:
+                # The environments that did not step contribute a null reward
+                env_rewards, env_dones = np.zeros((self.n_envs, 1)), np.zeros((self.n_envs, 1), dtype=bool)
+                env_rewards[env_ids, 0] = reward_
+                env_dones[env_ids, 0] = done
+                tf_util.total_episode_reward_logger(self.episode_reward, env_rewards, env_dones, writer,
+                                                    self.num_timesteps)
+
+            # Number of `train_freq` boundaries crossed during this step
+            n_trainings = self.num_timesteps // self.train_freq - \
+                (self.num_timesteps - n_steps) // self.train_freq
+            if n_trainings > 0:
+                callback.on_rollout_end()
+
+                mb_infos_vals = []
+                for grad_step in range(self.gradient_steps * n_trainings):
+                    if not self.replay_buffer.can_sample(self.batch_size) \
+                       or self.num_timesteps < self.learning_starts:
+                        break
+                    n_updates += 1
+                    frac = 1.0 - step / total_timesteps
+                    current_lr = self.learning_rate(frac)
+                    step_writer = writer if grad_step % self.write_freq == 0 else None
+                    mb_infos_vals.append(self._train_step(step, step_writer, current_lr))
+                    if (step + grad_step) % self.target_update_interval == 0:
+                        self.sess.run(self.target_update_op)
+                if len(mb_infos_vals) > 0:
+                    infos_values = np.mean(mb_infos_vals, axis=0)
+
+                callback.on_rollout_start()
+
+            running_rewards[env_ids] += reward_
+            for step_idx in np.flatnonzero(done):
+                env_idx = env_ids[step_idx]
+                episode_rewards[-1] = running_rewards[env_idx]
+                episode_rewards.append(0.0)
+                running_rewards[env_idx] = 0.0
+                maybe_is_success = infos[step_idx].get('is_success')
+                if maybe_is_success is not None:
+                    episode_successes.append(float(maybe_is_success))
+            if np.any(done) and self.action_noise is not None:
+                self.action_noise.reset()
+
+            num_episodes = len(episode_rewards)
+            if self.verbose >= 1 and np.any(done) and log_interval is not None \
+                    and num_episodes // log_interval > (num_episodes - np.sum(done)) // log_interval:
+                mean_reward = round(float(np.mean(episode_rewards[-101:-1])), 1)
+                fps = int(step / (time.time() - start_time))
+                logger.logkv("episodes", num_episodes)
+                logger.logkv("mean 100 episode reward", mean_reward)
+                if len(self.ep_info_buf) > 0 and len(self.ep_info_buf[0]) > 0:
+                    logger.logkv('ep_rewmean', safe_mean([ep_info['r'] for ep_info in self.ep_info_buf]))
+                    logger.logkv('eplenmean', safe_mean([ep_info['l'] for ep_info in self.ep_info_buf]))
+                logger.logkv("n_updates", n_updates)
+                logger.logkv("current_lr", current_lr)
+                logger.logkv("fps", fps)
+                logger.logkv('time_elapsed', int(time.time() - start_time))
+                if len(episode_successes) > 0:
+                    logger.logkv("success rate", np.mean(episode_successes[-100:]))
+                if len(infos_values) > 0:
+                    for (name, val) in zip(self.infos_names, infos_values):
+                        logger.logkv(name, val)
+                logger.logkv("total timesteps", self.num_timesteps)
+                logger.dumpkvs()
+                infos_values = []
+        callback.on_training_end()
+
     def action_probability(self, observation, state=None, mask=None, actions=None, logp=False):
         if actions is not None:
             raise ValueError("Error: SAC does not have action probabilities.")
@@ -10,7 +10,9 @@ from stable_baselines.common import tf_util, OffPolicyRLModel, SetVerbosity, Ten
 from stable_baselines.common.vec_env import VecEnv
 from stable_baselines.common.math_util import safe_mean, unscale_action, scale_action
 from stable_baselines.common.schedules import get_schedule_fn
-from stable_baselines.common.buffers import ReplayBuffer, DiscrepancyReplayBuffer, StableReplayBuffer, PrioritizedReplayBuffer, DRRecurrentReplayBuffer
+from stable_baselines.common.scenario_pool import ScenarioPool
+from stable_baselines.common.buffers import ReplayBuffer, DiscrepancyReplayBuffer, StableReplayBuffer, \
+    PrioritizedReplayBuffer, DRRecurrentReplayBuffer, ColumnarStorage
 from stable_baselines.td3.policies import TD3Policy, RecurrentPolicy, DRPolicy
 from stable_baselines import logger
 from stable_baselines.common.schedules import ExponentialSchedule
@@ -57,21 +59,31 @@ class TD3(OffPolicyRLModel):
         results, you must set `n_cpu_tf_sess` to 1.
     :param n_cpu_tf_sess: (int) The number of threads for TensorFlow operations
         If None, the number of cpu of the current machine will be used.
+    :param prioritization_chunk_size: (int) When switching to a prioritized buffer at `prioritization_starts`,
+        number of stored transitions whose initial priority is computed in one forward pass (one chunk per train step)
+    :param scenario_pool_size: (int) With active sampling, max number of candidate initial states. The candidates
+        are scored against the critic after the training steps, so that the episode resets only pick the best one
+        (with a VecEnv, the scenarios are queued in the environments in advance with `add_scenarios`)
     """
     def __init__(self, policy, env, gamma=0.99, learning_rate=3e-4, buffer_size=50000,
                  buffer_type=ReplayBuffer, buffer_kwargs=None, prioritization_starts=0, beta_schedule=None,
+                 prioritization_chunk_size=10000,
                  learning_starts=100, train_freq=100, gradient_steps=100, batch_size=128,
                  tau=0.005, policy_delay=2, action_noise=None, action_l2_scale=0,
                  target_policy_noise=0.2, target_noise_clip=0.5,
                  random_exploration=0.0, verbose=0, write_freq=1, tensorboard_log=None,
                  _init_setup_model=True, policy_kwargs=None,
                  full_tensorboard_log=False, seed=None, n_cpu_tf_sess=None, time_aware=False,
-                 reward_transformation=None, clip_q_target=None):
+                 reward_transformation=None, clip_q_target=None, scenario_pool_size=100):
         super(TD3, self).__init__(policy=policy, env=env, replay_buffer=None, verbose=verbose, write_freq=write_freq,
                                   policy_base=TD3Policy, requires_vec_env=False, policy_kwargs=policy_kwargs,
-                                  seed=seed, n_cpu_tf_sess=n_cpu_tf_sess)
+                                  seed=seed, n_cpu_tf_sess=n_cpu_tf_sess, supports_vec_env=True)
 
         self.prioritization_starts = prioritization_starts
+        self.prioritization_chunk_size = prioritization_chunk_size
+        self.scenario_pool_size = scenario_pool_size
+        self._scoring_idx = None
+        self._scoring_end = None
         self.beta_schedule = beta_schedule
         self.buffer_is_prioritized = buffer_type.__name__ in ["PrioritizedReplayBuffer", "RankPrioritizedReplayBuffer"]
         self.loss_history = None
@@ -436,6 +448,9 @@ class TD3(OffPolicyRLModel):
                 self.summary = tf.summary.merge_all()
 
     def _train_step(self, step, writer, learning_rate, update_policy):
+        if self._scoring_idx is not None:
+            self._score_prioritized_buffer()
+
         # Sample a batch from the replay buffer
         sample_kw = {}
         if self.buffer_is_prioritized and self.num_timesteps >= self.prioritization_starts:
@@ -547,6 +562,20 @@ class TD3(OffPolicyRLModel):
             # Initial learning rate
             current_lr = self.learning_rate(1)
 
+            if self.n_envs > 1:
+                assert not self.recurrent_policy and replay_wrapper is None, \
+                    "Error: recurrent policies and replay wrappers require a single environment"
+                # The extra data of the policies (e.g. the env parameters "my") is only collected by the
+                # single environment loop
+                assert not hasattr(self.policy, "collect_data") and \
+                    len(getattr(self.policy_tf, "extra_data_names", [])) == 0, \
+                    "Error: policies collecting extra data require a single environment"
+                # The transitions of the environments are interleaved in the replay buffer
+                assert not getattr(self.replay_buffer, "shared_obs", False), \
+                    "Error: replay buffers with shared observations require a single environment"
+                self._learn_vec_env(total_timesteps, callback, writer, log_interval)
+                return self
+
             start_time = time.time()
             episode_rewards = [0.0]
             episode_successes = []
@@ -555,10 +584,11 @@ class TD3(OffPolicyRLModel):
             obs = self.env.reset()
             # Retrieve unnormalized observation for saving into the buffer
             if self._vec_normalize_env is not None:
-                obs_ = self._vec_normalize_env.get_original_obs().squeeze()
+                obs_ = self._vec_normalize_env.get_original_obs(copy=False).squeeze()
             n_updates = 0
             infos_values = []
             self.active_sampling = False
+            scenario_pool = ScenarioPool(self.scenario_pool_size)
             initial_step = self.num_timesteps
             episode_data = []
 
@@ -612,8 +642,8 @@ class TD3(OffPolicyRLModel):
 
                 # Store only the unnormalized version
                 if self._vec_normalize_env is not None:
-                    new_obs_ = self._vec_normalize_env.get_original_obs().squeeze()
-                    reward_ = self._vec_normalize_env.get_original_reward().squeeze()
+                    new_obs_ = self._vec_normalize_env.get_original_obs(copy=False).squeeze()
+                    reward_ = self._vec_normalize_env.get_original_reward(copy=False).squeeze()
                 else:
                     # Avoid changing the original ones
                     obs_, new_obs_, reward_ = obs, new_obs, reward
@@ -690,6 +720,8 @@ class TD3(OffPolicyRLModel):
                     # Log losses and entropy, useful for monitor training
                     if len(mb_infos_vals) > 0:
                         infos_values = np.mean(mb_infos_vals, axis=0)
+                    if self.active_sampling and not isinstance(self.env, VecEnv):
+                        self._refresh_scenario_pool(scenario_pool)
                     callback.on_rollout_start()
 
                 episode_rewards[-1] += reward
@@ -702,10 +734,10 @@ class TD3(OffPolicyRLModel):
                     if self.action_noise is not None:
                         self.action_noise.reset()
                     if not isinstance(self.env, VecEnv):
-                        if self.active_sampling:
-                            sample_obs, sample_state = self.env.get_random_initial_states(25)
-                            obs_discrepancies = self.policy_tf.get_q_discrepancy(sample_obs)
-                            obs = self.env.reset(**sample_state[np.argmax(obs_discrepancies)])
+                        # The scenarios are selected beforehand (see _refresh_scenario_pool)
+                        scenarios = scenario_pool.pop() if self.active_sampling else []
+                        if len(scenarios) > 0:
+                            obs = self.env.reset(**scenarios[0])
                         else:
                             obs = self.env.reset()
                     episode_data = []
@@ -757,6 +789,192 @@ class TD3(OffPolicyRLModel):
             callback.on_training_end()
             return self
 
+    def _learn_vec_env(self, total_timesteps, callback, writer, log_interval):
+        """
+        Training loop used when learning from a VecEnv with more than one environment:
+        one action is computed per environment at each step and the resulting batch of transitions
+        is written in the replay buffer with a single call to `extend`. When the VecEnv steps asynchronously,
+        each step only concerns the first environments whose previous step is completed.
+
+        :param total_timesteps: (int) The total number of samples to train on
+        :param callback: (BaseCallback) callback called at every step
+        :param writer: (TensorFlow FileWriter) the writer for tensorboard (can be None)
+        :param log_interval: (int) The number of episodes before logging
+        """
+        start_time = time.time()
+        current_lr = self.learning_rate(1)
+        episode_rewards = [0.0]
+        episode_successes = []
+        running_rewards = np.zeros((self.n_envs,))
+        if self.action_noise is not None:
+            self.action_noise.reset()
+        obs, env_ids = self._vec_env_reset()
+        n_updates = 0
+        infos_values = []
+        initial_step = self.num_timesteps
+        terminal_obs_fn = self._vec_normalize_env.normalize_obs if self._vec_normalize_env is not None else None
+        # Active sampling: each environment has at most one scenario queued in advance
+        scenario_pool = ScenarioPool(self.scenario_pool_size)
+        queued_scenarios = np.zeros((self.n_envs,), dtype=np.int64)
+        gather_reset_data = False
+
+        callback.on_training_start(locals(), globals())
+        callback.on_rollout_start()
+
+        if self.buffer_is_prioritized and self.replay_buffer.__name__ == "ReplayBuffer" \
+                and self.num_timesteps >= self.prioritization_starts:
+            self._set_prioritized_buffer()
+
+        while self.num_timesteps < total_timesteps:
+            step = self.num_timesteps
+            if self.num_timesteps < self.learning_starts:
+                unscaled_action = self._sample_vec_env_actions(len(env_ids))
+                action = scale_action(self.action_space, unscaled_action)
+            else:
+                action = self.policy_tf.step(obs)
+                if self.action_noise is not None:
+                    noise = np.array([self.action_noise() for _ in range(len(env_ids))])
+                    action = np.clip(action + noise, -1, 1)
+                if self.random_exploration > 0:
+                    explore = np.random.rand(len(env_ids)) < self.random_exploration
+                    if np.any(explore):
+                        action[explore] = scale_action(self.action_space,
+                                                       self._sample_vec_env_actions(len(env_ids))[explore])
+                unscaled_action = unscale_action(self.action_space, action)
+
+            obs, action, new_obs, reward, done, infos, env_ids = self._vec_env_step(obs, action, unscaled_action,
+                                                                                     env_ids)
+            n_steps = len(env_ids)
+            self.num_timesteps += n_steps
+
+            if callback.on_step() is False:
+                break
+
+            if self._vec_normalize_env is not None:
+                reward_ = self._vec_normalize_env.get_original_reward(copy=False)
+            else:
+                reward_ = reward
+
+            if self.reward_transformation is not None:
+                reward = self.reward_transformation(reward)
+
+            # As in the single environment loop, the observations seen by the policy are stored
+            extra_data = {}
+            if self.time_aware:
+                bootstrap = np.ones((n_steps,), dtype=bool)
+                for env_idx in np.flatnonzero(done):
+                    info_time_limit = infos[env_idx].get("TimeLimit.truncated", None)
+                    bootstrap[env_idx] = infos[env_idx].get("termination", None) == "steps" or \
+                        (info_time_limit is not None and info_time_limit)
+                extra_data["bootstrap"] = bootstrap
+            next_obs = self._get_vec_env_next_obs(new_obs, done, infos, terminal_obs_fn=terminal_obs_fn)
+            self.replay_buffer.extend(obs, action, reward, next_obs, done, **extra_data)
+            obs = new_obs
+            queued_scenarios[env_ids[done]] = np.maximum(queued_scenarios[env_ids[done]] - 1, 0)
+
+            for info in infos:
+                maybe_ep_info = info.get('episode')
+                if maybe_ep_info is not None and self.num_timesteps >= self.learning_starts:
+                    self.ep_info_buf.extend([maybe_ep_info])
+
+            if writer is not None:
+                # The environments that did not step contribute a null reward
+                env_rewards, env_dones = np.zeros((self.n_envs, 1)), np.zeros((self.n_envs, 1), dtype=bool)
+                env_rewards[env_ids, 0] = reward_
+                env_dones[env_ids, 0] = done
+                tf_util.total_episode_reward_logger(self.episode_reward, env_rewards, env_dones, writer,
+                                                    self.num_timesteps)
+
+            # Number of `train_freq` boundaries crossed during this step
+            n_trainings = self.num_timesteps // self.train_freq - \
+                (self.num_timesteps - n_steps) // self.train_freq
+            if n_trainings > 0:
+                callback.on_rollout_end()
+
+                mb_infos_vals = []
+                for grad_step in range(self.gradient_steps * n_trainings):
+                    if not self.replay_buffer.can_sample(self.batch_size) \
+                            or self.num_timesteps < self.learning_starts:
+                        break
+                    n_updates += 1
+                    frac = 1.0 - self.num_timesteps / total_timesteps
+                    current_lr = self.learning_rate(frac)
+                    step_writer = writer if grad_step % self.write_freq == 0 else None
+                    mb_infos_vals.append(
+                        self._train_step(step, step_writer, current_lr, (step + grad_step) % self.policy_delay == 0))
+                if len(mb_infos_vals) > 0:
+                    infos_values = np.mean(mb_infos_vals, axis=0)
+                if self.active_sampling != gather_reset_data:
+                    gather_reset_data = self.active_sampling
+                    self.env.set_gather_reset_data(gather_reset_data)
+                if self.active_sampling:
+                    self._refresh_scenario_pool(scenario_pool)
+                    idle_envs = np.flatnonzero(queued_scenarios == 0)
+                    scenarios = scenario_pool.pop(len(idle_envs))
+                    if len(scenarios) > 0:
+                        self.env.add_scenarios(scenarios, indices=idle_envs[:len(scenarios)])
+                        queued_scenarios[idle_envs[:len(scenarios)]] += 1
+                callback.on_rollout_start()
+
+            running_rewards[env_ids] += reward
+            for step_idx in np.flatnonzero(done):
+                env_idx = env_ids[step_idx]
+                episode_rewards[-1] = running_rewards[env_idx]
+                episode_rewards.append(0.0)
+                running_rewards[env_idx] = 0.0
+                maybe_is_success = infos[step_idx].get('is_success')
+                if maybe_is_success is not None:
+                    episode_successes.append(float(maybe_is_success))
+            if np.any(done) and self.action_noise is not None:
+                self.action_noise.reset()
+
+            if self.buffer_is_prioritized and self.replay_buffer.__name__ == "ReplayBuffer" \
+                    and self.num_timesteps >= self.prioritization_starts:
+                self._set_prioritized_buffer()
+
+            num_episodes = len(episode_rewards)
+            if self.verbose >= 1 and np.any(done) and log_interval is not None \
+                    and num_episodes // log_interval > (num_episodes - np.sum(done)) // log_interval:
+                mean_reward = round(float(np.mean(episode_rewards[-101:-1])), 1)
+                fps = int((self.num_timesteps - initial_step) / (time.time() - start_time))
+                logger.logkv("episodes", num_episodes)
+                logger.logkv("mean 100 episode reward", mean_reward)
+                if len(self.ep_info_buf) > 0 and len(self.ep_info_buf[0]) > 0:
+                    logger.logkv('ep_rewmean', safe_mean([ep_info['r'] for ep_info in self.ep_info_buf]))
+                    logger.logkv('eplenmean', safe_mean([ep_info['l'] for ep_info in self.ep_info_buf]))
+                logger.logkv("n_updates", n_updates)
+                logger.logkv("current_lr", current_lr)
+                logger.logkv("fps", fps)
+                logger.logkv('time_elapsed', int(time.time() - start_time))
+                if len(episode_successes) > 0:
+                    logger.logkv("success rate", np.mean(episode_successes[-100:]))
+                if len(infos_values) > 0:
+                    for (name, val) in zip(self.infos_names, infos_values):
+                        logger.logkv(name, val)
+                logger.logkv("total timesteps", self.num_timesteps)
+                logger.dumpkvs()
+                infos_values = []
+
+        callback.on_training_end()
+
+    def _refresh_scenario_pool(self, scenario_pool):
+        """
+        Add candidate initial states to the active sampling scenario pool and score them against the current critic.
+        With a VecEnv the candidates are generated in advance by the workers (see `get_reset_data`), otherwise
+        `get_random_initial_states` of the environment is called when the pool is running low.
+
+        :param scenario_pool: (ScenarioPool) the scenario pool
+        """
+        if isinstance(self.env, VecEnv):
+            reset_data = self.env.get_reset_data()
+            if len(reset_data) > 0:
+                scenario_pool.add(np.array([data["obs"] for data in reset_data]),
+                                  [data["initial_state"] for data in reset_data])
+        elif len(scenario_pool) < scenario_pool.capacity // 2:
+            sample_obs, sample_states = self.env.get_random_initial_states(25)
+            scenario_pool.add(sample_obs, sample_states)
+        scenario_pool.score(self.policy_tf.get_q_discrepancy)
+
     def action_probability(self, observation, state=None, mask=None, actions=None, logp=False):
         _ = np.array(observation)
 
@@ -803,24 +1021,58 @@ class TD3(OffPolicyRLModel):
             return self.env.get_simulator_parameters()
 
     def _set_prioritized_buffer(self):
+        """
+        Switch to the prioritized buffer type: the new buffer takes over the storage of the current one in place.
+        The initial priorities (Q-value discrepancies) are computed by chunks of `prioritization_chunk_size`
+        transitions, the first one now and the next ones at each train step (see `_score_prioritized_buffer`).
+        """
         buffer_kw = {"size": self.buffer_size, "alpha": 0.7}
         if self.buffer_type.__name__ == "RankPrioritizedReplayBuffer":
             buffer_kw.update({"learning_starts": self.prioritization_starts, "batch_size": self.batch_size})
         r_buf = self.buffer_type(**buffer_kw)
 
-        for i, transition in enumerate(self.replay_buffer._storage):
-            r_buf.add(*transition)
-            r_buf.update_priorities([i], self.policy_tf.get_q_discrepancy(transition[0])[0])
-        if r_buf.__name__ == "RankPrioritizedReplayBuffer":
-            r_buf.rebalance()
         if isinstance(self.replay_buffer, HindsightExperienceReplayWrapper):
+            r_buf.adopt_storage(self.replay_buffer.replay_buffer)
             self.replay_buffer.replay_buffer = r_buf
         else:
+            r_buf.adopt_storage(self.replay_buffer)
             self.replay_buffer = r_buf
+        if len(r_buf) > 0:
+            self._scoring_idx = 0
+            self._scoring_end = len(r_buf)
+            self._score_prioritized_buffer()
         self.learning_rate = get_schedule_fn(self.learning_rate(1) / 4)  # TODO: will not work with non-constant
         self.beta_schedule = get_schedule_fn(self.beta_schedule)
         print("Enabled prioritized replay buffer")
 
+    def _score_prioritized_buffer(self):
+        """
+        Compute the initial priorities of the next chunk of transitions taken over by the prioritized buffer.
+        Until they are scored, the transitions get the mean score of the first chunk.
+        """
+        r_buf = self.replay_buffer
+        if isinstance(r_buf, HindsightExperienceReplayWrapper):
+            r_buf = r_buf.replay_buffer
+        start, end = self._scoring_idx, min(self._scoring_idx + self.prioritization_chunk_size, self._scoring_end)
+        idxes = np.arange(start, end)
+        if isinstance(r_buf._storage, ColumnarStorage):
+            obs = r_buf._storage.gather(idxes)[0]
+        else:
+            obs = np.array([r_buf._storage[idx][0] for idx in idxes])
+        # Priorities must be strictly positive
+        scores = np.maximum(np.reshape(self.policy_tf.get_q_discrepancy(obs), (-1,)), 1e-8)
+        if start == 0 and end < self._scoring_end:
+            r_buf.update_priorities(np.arange(end, self._scoring_end),
+                                    np.full((self._scoring_end - end,), np.mean(scores)))
+        r_buf.update_priorities(idxes, scores)
+
+        if end < self._scoring_end:
+            self._scoring_idx = end
+        else:
+            self._scoring_idx = None
+            if r_buf.__name__ == "RankPrioritizedReplayBuffer":
+                r_buf.rebalance()
+
     def get_parameter_list(self):
         return (self.params +
                 self.target_params)
@@ -853,7 +1105,9 @@ class TD3(OffPolicyRLModel):
             "policy_kwargs": self.policy_kwargs,
             "num_timesteps": self.num_timesteps,
             "buffer_type": self.buffer_type,
-            "buffer_kwargs": self.buffer_kwargs
+            "buffer_kwargs": self.buffer_kwargs,
+            "prioritization_chunk_size": self.prioritization_chunk_size,
+            "scenario_pool_size": self.scenario_pool_size
         }
 
         if save_replay_buffer:
@@ -0,0 +1,82 @@
+import gym
+import numpy as np
+import pytest
+
+from stable_baselines.acer.buffer import Buffer
+from stable_baselines.common.vec_env import DummyVecEnv, VecFrameStack
+
+N_ENVS = 3
+N_STEPS = 5
+
+
+class RandomDoneEnv(gym.Env):
+    def __init__(self, obs_shape):
+        """Environment with random observations and random episode ends"""
+        dtype = np.uint8 if len(obs_shape) > 1 else np.float32
+        self.observation_space = gym.spaces.Box(0, 255, shape=obs_shape, dtype=dtype)
+        self.action_space = gym.spaces.Discrete(2)
+        self.rng = np.random.RandomState(0)
+
+    def seed(self, seed=None):
+        self.rng.seed(seed)
+        self.observation_space.seed(seed)
+
+    def reset(self):
+        return self.observation_space.sample()
+
+    def step(self, action):
+        return self.observation_space.sample(), 1.0, self.rng.rand() < 0.2, {}
+
+
+def _reference_get(stored, idx):
+    """Previous implementation: full stacks stored, and gathered one environment at a time"""
+    outputs = []
+    for arr in stored:
+        out = np.empty([N_ENVS] + list(arr.shape[2:]), dtype=arr.dtype)
+        for i in range(N_ENVS):
+            out[i] = arr[idx[i], i]
+        outputs.append(out)
+    return outputs
+
+
+@pytest.mark.parametrize("obs_shape,n_stack", [((6, 5, 2), 4), ((3,), 3), ((6, 5, 2), 1)])
+def test_acer_buffer(obs_shape, n_stack):
+    env = DummyVecEnv([lambda: RandomDoneEnv(obs_shape) for _ in range(N_ENVS)])
+    env.seed(0)
+    if n_stack > 1:
+        env = VecFrameStack(env, n_stack)
+    buffer = Buffer(env, N_STEPS, size=4 * N_STEPS)
+    assert buffer.n_stack == n_stack
+    rng = np.random.RandomState(0)
+
+    obs, dones = env.reset(), np.zeros(N_ENVS, dtype=bool)
+    # Fields of each loc of the buffer
+    stored = [None] * buffer.size
+    for _ in range(6):
+        # Rollout as collected by the ACER runner
+        enc_obs, mb_dones = [obs], [dones]
+        for _ in range(N_STEPS):
+            obs, _, dones, _ = env.step(np.zeros(N_ENVS, dtype=int))
+            enc_obs.append(obs)
+            mb_dones.append(dones)
+        enc_obs = np.asarray(enc_obs, dtype=buffer.obs_dtype).swapaxes(1, 0)
+        masks = np.asarray(mb_dones, dtype=bool).swapaxes(1, 0)
+        actions = rng.randint(2, size=(N_ENVS, N_STEPS))
+        rewards, mus = rng.rand(N_ENVS, N_STEPS), rng.rand(N_ENVS, N_STEPS, 2)
+        stored[buffer.next_idx] = (enc_obs, actions, rewards, mus, masks[:, 1:], masks)
+        buffer.put(enc_obs, actions, rewards, mus, masks[:, 1:], masks)
+
+    # The frames are stored once
+    assert buffer.enc_obs[0].size == N_ENVS * (N_STEPS + n_stack) * np.prod(obs_shape)
+    stored = [np.stack(field) for field in zip(*stored)]
+    for _ in range(5):
+        state = np.random.get_state()
+        samples = buffer.get()
+        np.random.set_state(state)
+        idx = np.random.randint(0, buffer.num_in_buffer, N_ENVS)
+        expected = _reference_get(stored, idx)
+        expected[0] = expected[0].reshape((N_ENVS, N_STEPS + 1) + buffer.obs_shape)
+        for sample, expected_sample in zip(samples, expected):
+            np.testing.assert_allclose(sample, expected_sample.astype(sample.dtype))
+    # The output arrays are reused
+    assert buffer.get()[1] is samples[1]
@@ -11,6 +11,7 @@ from stable_baselines import A2C, ACKTR, SAC, DDPG, PPO1, PPO2, TRPO, TD3
 from stable_baselines.common.vec_env import DummyVecEnv
 from stable_baselines.common.identity_env import IdentityEnvBox
 from stable_baselines.ddpg import AdaptiveParamNoiseSpec, NormalActionNoise
+from stable_baselines.td3.policies import MlpPolicy as TD3MlpPolicy
 from stable_baselines.common.evaluation import evaluate_policy
 from tests.test_common import _assert_eq
 
@@ -186,3 +187,49 @@ def test_ddpg_popart():
                  normalize_returns=True, nb_rollout_steps=128, nb_train_steps=1,
                  batch_size=64, action_noise=action_noise, enable_popart=True)
     model.learn(1000)
+
+
+@pytest.mark.parametrize("model_class", [SAC, TD3])
+def test_off_policy_multi_env(model_class):
+    """
+    Test that SAC and TD3 can collect transitions from several environments at once
+    """
+    env = DummyVecEnv([lambda: IdentityEnvBox(eps=0.5) for _ in range(4)])
+    model = model_class(policy="MlpPolicy", env=env, learning_starts=100, seed=0)
+    assert model.n_envs == 4
+    model.learn(total_timesteps=1000)
+    assert len(model.replay_buffer) >= 1000
+    actions, _ = model.predict(env.reset())
+    assert actions.shape == (4,) + env.action_space.shape
+
+
+class CollectDataMlpPolicy(TD3MlpPolicy):
+    """TD3 policy storing extra data with each transition, like the domain randomization policies"""
+
+    def __init__(self, *args, **kwargs):
+        super(CollectDataMlpPolicy, self).__init__(*args, **kwargs)
+        self.extra_data_names = ["my"]
+
+    def collect_data(self, _locals, _globals):
+        return {"my": np.zeros(1)}
+
+
+def test_td3_multi_env_collect_data():
+    """
+    Test that TD3 refuses to collect the transitions of several environments without the extra data of the policy
+    """
+    env = DummyVecEnv([lambda: IdentityEnvBox(eps=0.5) for _ in range(2)])
+    model = TD3(policy=CollectDataMlpPolicy, env=env, learning_starts=10, seed=0)
+    with pytest.raises(AssertionError):
+        model.learn(total_timesteps=20)
+
+
+def test_td3_multi_env_shared_obs():
+    """
+    Test that TD3 refuses to interleave the transitions of several environments in a buffer with shared observations
+    """
+    env = DummyVecEnv([lambda: IdentityEnvBox(eps=0.5) for _ in range(2)])
+    model = TD3(policy="MlpPolicy", env=env, learning_starts=10, buffer_kwargs={"shared_obs": True}, seed=0)
+    assert model.replay_buffer.shared_obs
+    with pytest.raises(AssertionError):
+        model.learn(total_timesteps=20)
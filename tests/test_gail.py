@@ -7,9 +7,10 @@ import pytest
 from stable_baselines import A2C, ACER, ACKTR, GAIL, DDPG, DQN, PPO1, PPO2,\
  TD3, TRPO, SAC
 from stable_baselines.common.cmd_util import make_atari_env
-from stable_baselines.common.vec_env import VecFrameStack
+from stable_baselines.common.vec_env import DummyVecEnv, VecFrameStack, VecNormalize
 from stable_baselines.common.evaluation import evaluate_policy
 from stable_baselines.gail import ExpertDataset, generate_expert_traj
+from stable_baselines.gail.dataset.dataset import DataLoader, load_expert_traj
 
 
 EXPERT_PATH_PENDULUM = "stable_baselines/gail/dataset/expert_pendulum.npz"
@@ -102,6 +103,75 @@ def test_pretrain_images():
     del dataset, model, env
 
 
+def test_generate_npy_format(tmp_path):
+    """
+    Test recording expert trajectories incrementally in the memory-mapped format.
+    """
+    env = gym.make("Pendulum-v0")
+    env.seed(0)
+
+    def dummy_expert(_obs):
+        return env.action_space.sample()
+    save_path = str(tmp_path / "expert_pendulum")
+    dataset = generate_expert_traj(dummy_expert, save_path, env, n_episodes=3, save_format='npy')
+
+    n_timesteps = len(dataset['episode_starts'])
+    assert isinstance(dataset['obs'], np.memmap)
+    assert dataset['obs'].shape == (n_timesteps,) + env.observation_space.shape
+    assert dataset['actions'].shape == (n_timesteps,) + env.action_space.shape
+    assert dataset['rewards'].shape == (n_timesteps,)
+    assert np.all(np.flatnonzero(dataset['episode_starts']) == dataset['episode_index'])
+    assert len(dataset['episode_returns']) == 3
+    episode_ends = np.append(dataset['episode_index'][1:], n_timesteps)
+    for start, end, episode_return in zip(dataset['episode_index'], episode_ends, dataset['episode_returns']):
+        assert np.isclose(dataset['rewards'][start:end].sum(), episode_return)
+
+    loaded = load_expert_traj(save_path, mmap_mode=None)
+    expert_dataset = ExpertDataset(traj_data=loaded, traj_limitation=2, batch_size=16, use_vf=True,
+                                   discount_rate=0.9, sequential_preprocessing=True, verbose=0)
+    mapped_dataset = ExpertDataset(expert_path=save_path, traj_limitation=2, batch_size=16, use_vf=True,
+                                   discount_rate=0.9, sequential_preprocessing=True, verbose=0)
+    assert mapped_dataset.num_transition == expert_dataset.num_transition == dataset['episode_index'][2]
+    assert mapped_dataset.num_traj == 2
+    np.testing.assert_array_equal(mapped_dataset.vf_vals, expert_dataset.vf_vals)
+    # The value targets are defined for the timesteps whose horizon is not cut off by the end of the episode
+    horizon_len = int(-np.log(20) / np.log(0.9))
+    first_episode_vf = mapped_dataset.vf_vals[:dataset['episode_index'][1]]
+    assert np.all(np.isnan(first_episode_vf[-horizon_len:]))
+    assert np.isclose(first_episode_vf[0], np.sum(dataset['rewards'][:dataset['episode_index'][1]] *
+                                                  0.9 ** np.arange(dataset['episode_index'][1])))
+
+    obs, actions, vf_vals = mapped_dataset.get_next_batch('train')
+    assert obs.shape == (16,) + env.observation_space.shape and len(actions) == len(vf_vals) == 16
+
+
+@pytest.mark.parametrize("n_workers", [1, 3])
+def test_dataloader_prefetch(n_workers):
+    """
+    The minibatches prefetched by the processes are the ones of the sequential dataloader, in the same order.
+    """
+    traj_data = np.load(EXPERT_PATH_PENDULUM)
+    observations, actions = traj_data['obs'][:1000], traj_data['actions'][:1000]
+    vf_vals = np.where(np.arange(1000) % 3 == 0, np.nan, np.arange(1000.))
+    indices = np.arange(1000)
+    loaders = [DataLoader(indices, observations, actions, 64, vf_vals=vf_vals, n_workers=n_workers,
+                          max_queue_len=2, shuffle=True, sequential=sequential, seed=0)
+               for sequential in [True, False]]
+    # Three epochs, each one ending with a partial minibatch
+    for _ in range(3 * len(loaders[0])):
+        batches = []
+        for loader in loaders:
+            try:
+                batches.append(next(loader))
+            except StopIteration:
+                loader = iter(loader)
+                batches.append(next(loader))
+        for sequential_data, prefetched_data in zip(*batches):
+            np.testing.assert_array_equal(sequential_data, prefetched_data)
+    assert len(batches[1][0]) == 1000 % 64
+    del loaders
+
+
 @pytest.mark.parametrize("model_class", [A2C, ACKTR, GAIL, DDPG, PPO1, PPO2, SAC, TD3, TRPO])
 def test_behavior_cloning_box(model_class):
     """
@@ -115,6 +185,23 @@ def test_behavior_cloning_box(model_class):
     del dataset, model
 
 
+def test_behavior_cloning_vec_normalize_vf():
+    """
+    Behavior cloning of the actor and the value function, with the normalization statistics computed on the dataset.
+    """
+    dataset = ExpertDataset(expert_path=EXPERT_PATH_PENDULUM, traj_limitation=10, use_vf=True,
+                            sequential_preprocessing=True, verbose=0)
+    env = VecNormalize(DummyVecEnv([lambda: gym.make("Pendulum-v0")]))
+    model = PPO2("MlpPolicy", env)
+    model.pretrain(dataset, n_epochs=2, train_vf=True)
+    assert env.training
+    # The statistics are computed on the training set only
+    train_observations = dataset.observations[dataset.train_loader.original_indices]
+    np.testing.assert_allclose(env.obs_rms.mean, train_observations.mean(axis=0), rtol=1e-3, atol=1e-5)
+    np.testing.assert_allclose(env.obs_rms.var, train_observations.var(axis=0), rtol=1e-3, atol=1e-5)
+    del dataset, model
+
+
 @pytest.mark.parametrize("model_class", [A2C, ACER, ACKTR, DQN, GAIL, PPO1, PPO2, TRPO])
 def test_behavior_cloning_discrete(model_class):
     dataset = ExpertDataset(expert_path=EXPERT_PATH_DISCRETE, traj_limitation=10,
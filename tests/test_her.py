@@ -1,10 +1,12 @@
 import os
 
+import numpy as np
 import pytest
 
 from stable_baselines import HER, DQN, SAC, DDPG, TD3
 from stable_baselines.her import GoalSelectionStrategy, HERGoalEnvWrapper
-from stable_baselines.her.replay_buffer import KEY_TO_GOAL_STRATEGY
+from stable_baselines.her.replay_buffer import KEY_TO_GOAL_STRATEGY, HindsightExperienceReplayWrapper
+from stable_baselines.common.buffers import ReplayBuffer
 from stable_baselines.common.bit_flipping_env import BitFlippingEnv
 from stable_baselines.common.vec_env import DummyVecEnv, VecNormalize
 
@@ -117,3 +119,84 @@ def test_model_manipulation(model_class, goal_selection_strategy):
 
     if os.path.isfile('./test_her.zip'):
         os.remove('./test_her.zip')
+
+
+@pytest.mark.parametrize('goal_selection_strategy', ['future', 'final', 'episode', 'random', 'horizon'])
+@pytest.mark.parametrize('discrete_obs_space', [False, True])
+def test_her_relabel_at_sample(goal_selection_strategy, discrete_obs_space):
+    """
+    Only the actual transitions are stored, the sampled ones are relabeled with achieved goals
+    """
+    env = HERGoalEnvWrapper(BitFlippingEnv(N_BITS, continuous=True, max_steps=N_BITS,
+                                           discrete_obs_space=discrete_obs_space))
+    # Not a multiple of the episode length, so that the first stored episode is partially overwritten
+    buffer_size = 95
+    strategy = KEY_TO_GOAL_STRATEGY[goal_selection_strategy]
+    replay_buffer = HindsightExperienceReplayWrapper(ReplayBuffer(buffer_size), n_sampled_goal=4,
+                                                     goal_selection_strategy=strategy,
+                                                     wrapped_env=env, relabel_at_sample=True)
+    buffer = replay_buffer.replay_buffer
+    # Episode and timestep of the transition in each slot of the buffer, tracked independently of the wrapper
+    slot_episode, slot_t = np.full(buffer_size, -1), np.zeros(buffer_size, dtype=np.int64)
+    n_steps = 0
+    for episode in range(20):
+        obs, done, episode_length = env.reset(), False, 0
+        while not done:
+            action = env.action_space.sample()
+            next_obs, reward, done, _ = env.step(action)
+            replay_buffer.add(obs, action, reward, next_obs, done)
+            obs = next_obs
+            n_steps += 1
+            episode_length += 1
+        slots = (buffer._next_idx - episode_length + np.arange(episode_length)) % buffer_size
+        slot_episode[slots], slot_t[slots] = episode, np.arange(episode_length)
+    assert len(replay_buffer) == min(n_steps, buffer_size)
+    np.testing.assert_array_equal(replay_buffer._ep_t[:len(replay_buffer)], slot_t[:len(replay_buffer)])
+
+    # Record the sampled transitions
+    encode_sample, sampled_idxes = buffer._encode_sample, []
+
+    def recorded_encode_sample(idxes):
+        sampled_idxes.append(idxes)
+        return encode_sample(idxes)
+
+    buffer._encode_sample = recorded_encode_sample
+    obs, _, rewards, next_obs, dones, _ = replay_buffer.sample(256)
+    buffer._encode_sample = encode_sample
+    idxes = sampled_idxes[0]
+
+    achieved_goal = slice(env.obs_dim, env.obs_dim + env.goal_dim)
+    desired_goal = slice(env.obs_dim + env.goal_dim, None)
+    assert np.all(obs[:, desired_goal] == next_obs[:, desired_goal])
+    expected_rewards = [env.compute_reward(next_obs[i, achieved_goal], next_obs[i, desired_goal], None)
+                        for i in range(len(obs))]
+    assert np.all(rewards == expected_rewards)
+    # All the desired goals are achieved goals or goals of the env
+    stored_obs = buffer._encode_sample(np.arange(len(replay_buffer)))[0]
+    stored_goals = {tuple(goal) for goal in replay_buffer._achieved_goals[:len(replay_buffer)]} | \
+                   {tuple(obs_[desired_goal]) for obs_ in stored_obs}
+    assert all(tuple(goal) in stored_goals for goal in obs[:, desired_goal])
+
+    # The relabeled goals follow the strategy
+    relabeled = np.flatnonzero(np.any(obs[:, desired_goal] != stored_obs[idxes, desired_goal], axis=1))
+    assert len(relabeled) > 0
+    for i in relabeled:
+        goal, idx = tuple(obs[i, desired_goal]), idxes[i]
+        same_episode = np.flatnonzero(slot_episode[:len(replay_buffer)] == slot_episode[idx])
+        episode_length = replay_buffer._ep_len[idx]
+        if goal_selection_strategy == 'future':
+            # From the same episode, at a later timestep
+            candidates = same_episode[slot_t[same_episode] > slot_t[idx]]
+        elif goal_selection_strategy == 'horizon':
+            horizon = min(int(slot_t[idx] + 2 + 0.05 * episode_length), episode_length)
+            candidates = same_episode[(slot_t[same_episode] > slot_t[idx]) & (slot_t[same_episode] < horizon)]
+        elif goal_selection_strategy == 'final':
+            # The last achieved goal of the episode
+            candidates = same_episode[slot_t[same_episode] == episode_length - 1]
+            assert len(candidates) == 1
+        elif goal_selection_strategy == 'episode':
+            # From a still-stored timestep of the same episode
+            candidates = same_episode
+        else:
+            candidates = np.arange(len(replay_buffer))
+        assert goal in {tuple(stored_obs[j, achieved_goal]) for j in candidates}
@@ -1,8 +1,12 @@
 import os
 
+import numpy as np
 import pytest
+from gym.envs.classic_control import CartPoleEnv
 
 from stable_baselines import PPO2
+from stable_baselines.common import make_vec_env
+from stable_baselines.common.vec_env import SubprocVecEnv
 
 
 @pytest.mark.parametrize("cliprange", [0.2, lambda x: 0.1 * x])
@@ -18,3 +22,90 @@ def test_clipping(cliprange, cliprange_vf):
 
     if os.path.exists('./ppo2_clip.zip'):
         os.remove('./ppo2_clip.zip')
+
+
+@pytest.mark.parametrize("n_envs", [1, 4])
+def test_pipeline_rollouts(n_envs):
+    """Test the collection of the rollouts in the background, while training"""
+    env = make_vec_env('CartPole-v1', n_envs=n_envs, vec_env_cls=SubprocVecEnv if n_envs > 1 else None)
+    model = PPO2('MlpPolicy', env, n_steps=64, pipeline_rollouts=True)
+    # Copies of the collected rollouts, to check that the next collection does not overwrite the one trained on
+    collected = []
+    run, train_step = model.runner.run, model._train_step
+
+    def recorded_run(callback):
+        rollout = run(callback)
+        collected.append((rollout[:6], [arr.copy() for arr in rollout[:6]]))
+        return rollout
+
+    def checked_train_step(*args, **kwargs):
+        # The next collection is started before the training on the current rollout
+        arrays, copies = collected[checked_train_step.n_calls // (model.nminibatches * model.noptepochs)]
+        for arr, copy in zip(arrays, copies):
+            np.testing.assert_array_equal(arr, copy)
+        checked_train_step.n_calls += 1
+        return train_step(*args, **kwargs)
+
+    checked_train_step.n_calls = 0
+    model.runner.run, model._train_step = recorded_run, checked_train_step
+    model.learn(2000)
+    n_updates = 2000 // model.n_batch
+    assert checked_train_step.n_calls == n_updates * model.nminibatches * model.noptepochs
+    assert len(collected) == n_updates
+    assert model.num_timesteps == n_updates * model.n_batch
+    model.save('./ppo2_pipeline.zip')
+    model = PPO2.load('./ppo2_pipeline.zip', env=env)
+    assert model.pipeline_rollouts
+    model.learn(1000)
+    env.close()
+
+    if os.path.exists('./ppo2_pipeline.zip'):
+        os.remove('./ppo2_pipeline.zip')
+
+
+@pytest.mark.parametrize("env_id", ['CartPole-v1', 'Pendulum-v0'])
+def test_rollout_on_device(env_id):
+    """Test the training on minibatches gathered in the graph, from the rollout uploaded once per update"""
+    model = PPO2('MlpPolicy', env_id, n_steps=64, nminibatches=4, noptepochs=2, rollout_on_device=True)
+    params = model.get_parameters()
+    model.learn(1000)
+    assert any(not np.allclose(value, model.get_parameters()[name]) for name, value in params.items())
+    model.save('./ppo2_on_device.zip')
+    model = PPO2.load('./ppo2_on_device.zip', env=model.get_env())
+    assert model.rollout_on_device
+    model.learn(500)
+
+    if os.path.exists('./ppo2_on_device.zip'):
+        os.remove('./ppo2_on_device.zip')
+
+
+class ScenarioCartPole(CartPoleEnv):
+    """CartPole whose initial state can be chosen, as a scenario for active sampling"""
+    def __init__(self):
+        super(ScenarioCartPole, self).__init__()
+        self.n_scenarios = 0
+
+    def reset(self, state=None):
+        obs = super(ScenarioCartPole, self).reset()
+        if state is not None:
+            self.n_scenarios += 1
+            self.state = obs = np.array(state)
+        return obs
+
+    def get_initial_state(self):
+        return {"state": np.array(self.state)}
+
+
+@pytest.mark.parametrize("pipeline_rollouts", [False, True])
+def test_active_sampling(pipeline_rollouts):
+    """Test the active sampling with the scenario pool, the reset data being received during the rollouts"""
+    env = SubprocVecEnv([ScenarioCartPole for _ in range(4)], n_envs_per_worker=2)
+    model = PPO2('MlpPolicy', env, n_steps=64, pipeline_rollouts=pipeline_rollouts, scenario_pool_size=20,
+                 scenario_scoring_batch_size=8, policy_kwargs=dict(dual_critic=True))
+    model.active_sampling = True
+    model.learn(2000)
+    # The episodes start with the scenarios queued in the environments
+    assert sum(env.get_attr('n_scenarios')) > 0
+    model.active_sampling = False
+    model.learn(500)
+    env.close()
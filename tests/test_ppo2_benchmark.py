@@ -0,0 +1,81 @@
+"""Benchmark of the PPO2 optimization with the rollout stored on the device, against the minibatches fed from
+the host.
+
+Run with: pytest tests/test_ppo2_benchmark.py --expensive -s"""
+import time
+
+import gym
+import numpy as np
+import pytest
+
+from stable_baselines import PPO2
+from stable_baselines.common.vec_env import DummyVecEnv
+
+N_ENVS = 8
+N_STEPS = 128
+OBS_SHAPE = (376,)
+N_UPDATES = 5
+
+
+class _BoxEnv(gym.Env):
+    """Environment with large observations, the optimization does not depend on the dynamics"""
+    def __init__(self):
+        self.observation_space = gym.spaces.Box(-np.inf, np.inf, shape=OBS_SHAPE, dtype=np.float32)
+        self.action_space = gym.spaces.Box(-1, 1, shape=(17,), dtype=np.float32)
+
+    def reset(self):
+        return self.observation_space.sample()
+
+    def step(self, action):
+        return self.observation_space.sample(), 0.0, False, {}
+
+
+def _optimization_time(model, rollout):
+    """
+    Time the optimization part of the PPO2 updates (all the epochs on a rollout), as done by `learn`.
+    """
+    obs, returns, masks, actions, values, neglogpacs = rollout
+    batch_size = model.n_batch // model.nminibatches
+    start_time = time.perf_counter()
+    for _ in range(N_UPDATES):
+        inds = np.arange(model.n_batch)
+        if model.rollout_on_device:
+            model._upload_rollout(obs, returns, actions, values, neglogpacs)
+        for _ in range(model.noptepochs):
+            if model.rollout_on_device:
+                model.sess.run(model._shuffle_rollout_op)
+            else:
+                np.random.shuffle(inds)
+            for start in range(0, model.n_batch, batch_size):
+                if model.rollout_on_device:
+                    model._train_step(2.5e-4, 0.2, *(None,) * 6, update=0, writer=None,
+                                      minibatch_idx=start // batch_size)
+                else:
+                    mbinds = inds[start:start + batch_size]
+                    slices = (arr[mbinds] for arr in rollout)
+                    model._train_step(2.5e-4, 0.2, *slices, update=0, writer=None)
+    return (time.perf_counter() - start_time) / N_UPDATES
+
+
+@pytest.mark.expensive
+@pytest.mark.parametrize("nminibatches", [4, 32])
+def test_ppo2_rollout_on_device_benchmark(nminibatches):
+    rng = np.random.RandomState(0)
+    n_batch = N_ENVS * N_STEPS
+    rollout = (rng.randn(n_batch, *OBS_SHAPE).astype(np.float32), rng.randn(n_batch).astype(np.float32),
+               np.zeros(n_batch, dtype=bool), rng.uniform(-1, 1, (n_batch, 17)).astype(np.float32),
+               rng.randn(n_batch).astype(np.float32), rng.rand(n_batch).astype(np.float32))
+
+    times = {}
+    for rollout_on_device in [False, True]:
+        env = DummyVecEnv([_BoxEnv for _ in range(N_ENVS)])
+        model = PPO2('MlpPolicy', env, n_steps=N_STEPS, nminibatches=nminibatches, noptepochs=10, seed=0,
+                     n_cpu_tf_sess=1, rollout_on_device=rollout_on_device)
+        # Warm-up
+        _optimization_time(model, rollout)
+        times[rollout_on_device] = _optimization_time(model, rollout)
+
+    print("{} envs x {} steps, {} minibatches, 10 epochs".format(N_ENVS, N_STEPS, nminibatches))
+    print("optimization per update: {:.1f}ms (fed from the host: {:.1f}ms)".format(times[True] * 1e3,
+                                                                                 times[False] * 1e3))
+    assert times[True] < times[False]
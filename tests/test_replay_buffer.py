@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 
 from stable_baselines.common.buffers import ReplayBuffer, PrioritizedReplayBuffer
 
@@ -70,3 +71,270 @@ def test_extend_prioritized():
     # assert priorities
     assert (baseline._it_min._value == ext._it_min._value).all()
     assert (baseline._it_sum._value == ext._it_sum._value).all()
+
+
+def test_columnar_storage():
+    nvals = 24
+    states = np.random.rand(nvals, 2, 2)
+    actions = np.random.rand(nvals, 2)
+    rewards = np.random.randint(0, 2, size=nvals)
+    newstates = np.random.rand(nvals, 2, 2)
+    dones = np.random.randint(0, 2, size=nvals).astype(bool)
+    states_extra = np.random.rand(nvals, 3)
+
+    size = 16
+    baseline = ReplayBuffer(size, extra_data_names=("state",))
+    columnar = ReplayBuffer(size, extra_data_names=("state",), columnar=True)
+    for data in zip(states, actions, rewards, newstates, dones, states_extra):
+        baseline.add(*data[:5], state=data[5])
+        columnar.add(*data[:5], state=data[5])
+    assert len(baseline) == len(columnar) == size
+    # Integer rewards are stored as floats
+    assert columnar.storage.columns[2].dtype.kind == "f"
+
+    idxes = np.random.randint(0, size, size=32)
+    for expected, value in zip(baseline._encode_sample(idxes), columnar._encode_sample(idxes)):
+        if isinstance(expected, dict):
+            assert expected.keys() == value.keys()
+            for key in expected:
+                assert np.allclose(expected[key], value[key])
+        else:
+            assert np.allclose(expected, value)
+
+    # Bulk writes wrap around the end of the storage like repeated adds
+    ext = ReplayBuffer(size, columnar=True)
+    ext.extend(states[:10], actions[:10], rewards[:10], newstates[:10], dones[:10])
+    ext.extend(states[10:], actions[10:], rewards[10:], newstates[10:], dones[10:])
+    assert len(ext) == size
+    for i in range(size):
+        for j in range(5):
+            assert np.all(baseline.storage[i][j] == ext.storage[i][j])
+
+
+def test_shared_obs_storage():
+    size = 16
+    baseline = ReplayBuffer(size)
+    shared = ReplayBuffer(size, shared_obs=True)
+    obs = np.random.rand(2, 2)
+    for step in range(40):
+        new_obs = np.random.rand(2, 2)
+        done = step % 7 == 6
+        data = (obs, np.random.rand(2), np.random.rand(), new_obs, done)
+        baseline.add(*data)
+        shared.add(*data)
+        # Artificial transition (as added by HER) that does not continue the episode
+        if step % 5 == 0:
+            her_data = (obs + 1, data[1], 0., new_obs + 1, False)
+            baseline.add(*her_data)
+            shared.add(*her_data)
+        obs = np.random.rand(2, 2) if done else new_obs
+
+    # Next observations are only stored at episode ends, for artificial transitions and for the last transition
+    assert shared.storage.n_next_obs < size
+    idxes = np.arange(size)
+    for expected, value in zip(baseline._encode_sample(idxes), shared._encode_sample(idxes)):
+        if not isinstance(expected, dict):
+            assert np.allclose(expected, value)
+    for i in range(size):
+        assert np.allclose(baseline.storage[i][3], shared.storage[i][3])
+
+
+def test_shared_obs_storage_extend():
+    size = 16
+    baseline = ReplayBuffer(size)
+    shared = ReplayBuffer(size, shared_obs=True)
+    obs = np.random.rand(2, 2)
+    step = 0
+    for batch_size in [1, 5, 3, 1, 7, 20, 2, 6]:
+        transitions = []
+        for _ in range(batch_size):
+            new_obs = np.random.rand(2, 2)
+            done = step % 7 == 6
+            transitions.append((obs, np.random.rand(2), np.random.rand(), new_obs, done))
+            obs = np.random.rand(2, 2) if done else new_obs
+            step += 1
+        baseline.extend(*[np.array(values) for values in zip(*transitions)])
+        if batch_size == 1:
+            shared.add(*transitions[0])
+        else:
+            shared.extend(*[np.array(values) for values in zip(*transitions)])
+
+    # Next observations are only stored at episode ends and for the last transition
+    assert shared.storage.n_next_obs <= size // 7 + 2
+    idxes = np.arange(size)
+    for expected, value in zip(baseline._encode_sample(idxes), shared._encode_sample(idxes)):
+        if not isinstance(expected, dict):
+            assert np.allclose(expected, value)
+
+
+def test_extend_extra_data():
+    nvals = 8
+    states, newstates = np.random.rand(nvals, 2), np.random.rand(nvals, 2)
+    actions, rewards = np.random.rand(nvals, 1), np.random.rand(nvals)
+    dones, bootstraps = np.zeros(nvals, dtype=bool), np.ones(nvals, dtype=bool)
+    for columnar in [False, True]:
+        buffer = ReplayBuffer(16, extra_data_names=("bootstrap",), columnar=columnar)
+        buffer.extend(states, actions, rewards, newstates, dones, bootstrap=bootstraps)
+        assert len(buffer) == nvals
+        *_, extra_data = buffer.sample(4)
+        assert np.all(extra_data["bootstrap"])
+
+
+def test_rank_prioritized():
+    """
+    check the array-backed rank-based prioritized buffer: ranks, stratified sampling and ids
+    """
+    from stable_baselines.deepq.rank_based_per import RankPrioritizedReplayBuffer
+
+    size, batch_size = 1000, 16
+    buffer = RankPrioritizedReplayBuffer(size, alpha=0.7, learning_starts=batch_size, batch_size=batch_size)
+    assert not buffer.can_sample()
+    for i in range(size + 200):
+        buffer.add(np.array([i, i]), np.array([i]), float(i), np.array([i + 1, i + 1]), False)
+    assert len(buffer) == size and buffer.isFull
+
+    obs, actions, rewards, obs_tp1, dones, weights, idxes = buffer.sample()
+    assert obs.shape == (batch_size, 2) and weights.shape == (batch_size,) and idxes.shape == (batch_size,)
+    assert np.all(rewards == obs[:, 0]) and np.all(obs_tp1[:, 0] == obs[:, 0] + 1)
+    assert np.all(rewards == np.array([buffer._storage[idx][2] for idx in idxes]))
+    assert np.isclose(weights.max(), 1) and np.all(weights > 0)
+
+    # Priorities given by the reward: the ranks follow the sorted rewards after rebalancing
+    buffer.update_priorities(np.arange(size), np.array([buffer._storage[idx][2] for idx in range(size)]))
+    buffer.rebalance()
+    ranked_rewards = buffer._storage.gather(buffer._get_ranked_idxes())[2]
+    assert np.all(np.diff(ranked_rewards) < 0)
+    # The first stratum only contains the transitions of highest priority
+    _, _, rewards, _, _, weights, _ = buffer.sample()
+    assert rewards[0] >= size + 200 - buffer.distributions[-1][1]
+    assert np.all(np.diff(rewards) <= 0)
+
+    # A new transition has the max priority and is ranked first
+    buffer.add(np.array([-1, -1]), np.array([-1]), -1., np.array([0, 0]), True)
+    assert buffer._get_ranked_idxes()[0] == (size + 200) % size
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_adopt_storage(columnar):
+    """
+    check that the prioritized buffers take over the transitions of a ReplayBuffer in place
+    """
+    from stable_baselines.deepq.rank_based_per import RankPrioritizedReplayBuffer
+
+    size = 64
+    buffer = ReplayBuffer(size, columnar=columnar)
+    for i in range(size + 10):
+        buffer.add(np.array([i]), np.array([i]), float(i), np.array([i + 1]), False)
+
+    prioritized = PrioritizedReplayBuffer(size, alpha=0.7)
+    prioritized.adopt_storage(buffer)
+    assert prioritized.storage is buffer.storage and len(prioritized) == size
+    prioritized.update_priorities(np.arange(size), np.ones(size))
+    obs, _, rewards, _, _, _ = prioritized._encode_sample(np.arange(size))
+    assert np.all(rewards == obs[:, 0])
+    prioritized.add(np.array([-1]), np.array([-1]), -1., np.array([0]), False)
+    assert buffer.storage[10][2] == -1
+
+    rank = RankPrioritizedReplayBuffer(size, alpha=0.7, learning_starts=8, batch_size=8)
+    rank.adopt_storage(buffer)
+    assert len(rank) == size and rank.index == 10
+    rank.update_priorities(np.arange(size), np.arange(1, size + 1))
+    rank.rebalance()
+    obs, _, rewards, _, _, _, idxes = rank.sample()
+    assert np.all(rewards == obs[:, 0]) and np.all(rewards == rank.retrieve(idxes)[2])
+
+
+def test_discrepancy_buffer():
+    """
+    check the batched scoring and the sum tree sampling of DiscrepancyReplayBuffer
+    """
+    from stable_baselines.common.buffers import DiscrepancyReplayBuffer
+
+    scorer_calls = []
+
+    def scorer(obs):
+        scorer_calls.append(len(obs))
+        return obs[:, :1].astype(np.float64)
+
+    size = 100
+    buffer = DiscrepancyReplayBuffer(size, scorer, score_batch_size=8, rescore_chunk_size=32)
+    for i in range(size + 20):
+        buffer.add(np.array([i % size]), np.array([0]), 0., np.array([i % size]), False)
+    assert scorer_calls == [8] * 15
+    assert buffer.min_score == 0 and buffer.max_score == size - 1
+
+    obs = np.concatenate([buffer.sample(50)[0] for _ in range(20)])
+    assert len(scorer_calls) == 15
+    # sampling weights scaled to [0.1, 1], proportional to the score
+    assert np.isclose(buffer._it_sum.sum(), np.sum(buffer._scale_scores(np.arange(size))))
+    assert np.mean(obs[:, 0] >= size // 2) > 0.6
+
+    scorer_calls.clear()
+    buffer.update_priorities()
+    assert scorer_calls == [32, 32, 32, 4]
+
+
+def test_stable_buffer():
+    """
+    check that StableReplayBuffer samples with the cached clipped scores
+    """
+    from stable_baselines.common.buffers import StableReplayBuffer
+
+    size = 100
+    buffer = StableReplayBuffer(size)
+    for i in range(size):
+        buffer.add(np.array([i]), np.array([0]), 0., np.array([i]), False, score=float(i))
+    buffer.sample(10)
+    assert np.isclose(buffer.lower_clip, np.percentile(np.arange(size), 10))
+    assert np.isclose(buffer.upper_clip, np.percentile(np.arange(size), 90))
+    assert np.isclose(buffer._it_sum.sum(), np.sum(np.clip(np.arange(size), buffer.lower_clip, buffer.upper_clip)))
+
+    # The bounds are only updated by update_priorities, new scores are clipped to the cached bounds
+    buffer.add(np.array([0]), np.array([0]), 0., np.array([0]), False, score=1000.)
+    lower_clip, upper_clip = buffer.lower_clip, buffer.upper_clip
+    buffer.sample(10)
+    assert buffer.lower_clip == lower_clip and buffer.upper_clip == upper_clip
+    assert buffer._it_sum[0] == upper_clip
+    buffer.update_priorities()
+    assert buffer.upper_clip > upper_clip
+
+
+def test_recurrent_buffer():
+    """
+    check the sequences sampled from the contiguous episode store of RecurrentReplayBuffer
+    """
+    from stable_baselines.common.buffers import RecurrentReplayBuffer
+
+    size, sequence_length, scan_length = 50, 2, 2
+    buffer = RecurrentReplayBuffer(size, sequence_length=sequence_length, scan_length=scan_length,
+                                   extra_data_names=("pi_state", "bootstrap"), rnn_inputs=("obs",))
+    step = 0
+    for ep_len in [10, 3, 12, 4, 15, 9, 11, 8]:
+        for t in range(ep_len):
+            # obs encodes the step, the state the episode step
+            buffer.add(np.array([step, t]), np.array([0.]), float(step), np.array([step + 1, t + 1]), t == ep_len - 1,
+                       bootstrap=True, pi_state=np.array([t, t], dtype=np.float32))
+            step += 1
+    # The episode of length 3 is too short to be stored, the first ones are overwritten
+    assert len(buffer) == 4 + 15 + 9 + 11 + 8 and buffer.is_full()
+
+    obs, _, rewards, obs_tp1, dones, extra = buffer.sample(20)
+    assert obs.shape == (20, 2) and extra["pi_state"].shape == (10, 2) and extra["scan_obs"].shape == (20, 2)
+    assert np.all(rewards == obs[:, 0]) and np.all(obs_tp1[:, 0] == obs[:, 0] + 1)
+    # Consecutive timesteps of a same episode
+    obs = obs.reshape(10, sequence_length, 2)
+    assert np.all(np.diff(obs[:, :, 0], axis=1) == 1)
+    assert np.all(obs[:, 0, 1] >= scan_length)
+    scan_obs = extra["scan_obs"].reshape(10, scan_length, 2)
+    assert np.all(scan_obs[:, -1, 0] + 1 == obs[:, 0, 0])
+    # The state is the one of the first scan timestep
+    assert np.all(extra["pi_state"][:, 0] == scan_obs[:, 0, 1])
+    assert [ep_t for _, ep_t in extra["state_idxs_scan"]] == list(obs[:, 0, 1])
+
+    # The states are written back to the sampled timesteps, the ones after the end of the episode are ignored
+    new_states = np.full((10, 2), -1, dtype=np.float32)
+    buffer.update_state(extra["state_idxs"], {"pi_state": new_states})
+    state_column = buffer.storage.columns[buffer._data_name_to_idx["pi_state"]]
+    for (ep_idx, t) in extra["state_idxs"]:
+        if t < buffer._ep_len[ep_idx]:
+            assert np.all(state_column[buffer._ep_start[ep_idx] + t] == -1)
@@ -0,0 +1,60 @@
+import numpy as np
+
+from stable_baselines.common.rollout_storage import RolloutStorage, compute_gae
+
+
+def _reference_gae(rewards, values, dones, last_values, last_dones, gamma, lam):
+    """Previous implementation of the PPO2 runner, on (n_steps, n_envs) arrays"""
+    n_steps = len(rewards)
+    advs = np.zeros_like(rewards)
+    last_gae_lam = 0
+    for step in reversed(range(n_steps)):
+        if step == n_steps - 1:
+            nextnonterminal = 1.0 - last_dones
+            nextvalues = last_values
+        else:
+            nextnonterminal = 1.0 - dones[step + 1]
+            nextvalues = values[step + 1]
+        delta = rewards[step] + gamma * nextvalues * nextnonterminal - values[step]
+        advs[step] = last_gae_lam = delta + gamma * lam * nextnonterminal * last_gae_lam
+    return advs
+
+
+def test_compute_gae():
+    rng = np.random.RandomState(0)
+    n_envs, n_steps = 5, 16
+    rewards, values = rng.randn(2, n_steps, n_envs)
+    dones = rng.rand(n_steps, n_envs) < 0.2
+    last_values, last_dones = rng.randn(n_envs), rng.rand(n_envs) < 0.5
+
+    expected = _reference_gae(rewards, values, dones, last_values, last_dones, 0.99, 0.95)
+    advs = compute_gae(rewards.T, values.T, dones.T, last_values, last_dones, 0.99, 0.95)
+    np.testing.assert_allclose(advs, expected.T)
+
+
+def test_rollout_storage():
+    rng = np.random.RandomState(0)
+    n_envs, n_steps = 3, 8
+    storage = RolloutStorage(n_envs, n_steps, dtypes={'rewards': np.float32})
+    obs = rng.randn(n_steps, n_envs, 2)
+    rewards, values = rng.randn(2, n_steps, n_envs)
+    dones = rng.rand(n_steps, n_envs) < 0.2
+    for step in range(n_steps):
+        storage.add(step, obs=obs[step], rewards=rewards[step], values=values[step], dones=dones[step])
+    assert storage['rewards'].dtype == np.float32 and storage['obs'].shape == (n_envs, n_steps, 2)
+
+    # The flattened fields are views, ordered like the previous swap_and_flatten
+    flat_obs = storage.flat('obs')
+    assert np.shares_memory(flat_obs, storage['obs'])
+    np.testing.assert_array_equal(flat_obs, obs.swapaxes(0, 1).reshape(n_envs * n_steps, 2))
+
+    storage.compute_returns_and_advantages(np.zeros(n_envs), np.zeros(n_envs, dtype=bool), 0.99, 0.95)
+    expected = _reference_gae(storage['rewards'].T, values, dones, np.zeros(n_envs), np.zeros(n_envs), 0.99, 0.95)
+    np.testing.assert_allclose(storage['advantages'], expected.T, rtol=1e-6)
+    np.testing.assert_allclose(storage.flat('returns'), (expected + values).T.ravel(), rtol=1e-6)
+
+    # The arrays are reused by the next rollouts
+    advantages = storage['advantages']
+    storage.add(0, obs=obs[0] + 1)
+    storage.compute_returns_and_advantages(np.zeros(n_envs), np.zeros(n_envs, dtype=bool), 0.99, 0.95)
+    assert storage['advantages'] is advantages and np.shares_memory(flat_obs, storage['obs'])
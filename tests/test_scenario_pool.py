@@ -0,0 +1,52 @@
+import numpy as np
+
+from stable_baselines.common.scenario_pool import ScenarioPool
+
+
+def test_scenario_pool():
+    pool = ScenarioPool(capacity=5)
+    assert pool.pop() == []
+    pool.add(np.arange(4).reshape((4, 1)), [{"start": i} for i in range(4)])
+    assert len(pool) == 4 and pool.n_unscored == 4
+
+    pool.score(lambda obs: -obs[:, 0])
+    assert pool.n_unscored == 0
+    assert pool.pop(2) == [{"start": 0}, {"start": 1}]
+    assert len(pool) == 2
+
+    # The unscored candidates are ranked last
+    pool.add(np.arange(10, 12).reshape((2, 1)), [{"start": 10}, {"start": 11}])
+    assert [scenario["start"] for scenario in pool.pop(3)] == [2, 3, 10]
+
+    # When the pool is full, the new candidates replace the lowest-scored ones
+    pool.add(np.arange(20, 24).reshape((4, 1)), [{"start": i} for i in range(20, 24)])
+    pool.score(lambda obs: obs[:, 0])
+    pool.add(np.array([[30], [31]]), [{"start": 30}, {"start": 31}])
+    assert len(pool) == 5
+    pool.score(lambda obs: obs[:, 0])
+    assert [scenario["start"] for scenario in pool.pop(5)] == [31, 30, 23, 22, 21]
+    assert len(pool) == 0
+
+
+def test_scenario_pool_incremental_scoring():
+    pool = ScenarioPool(capacity=6)
+    pool.add(np.arange(4).reshape((4, 1)), [{"start": i} for i in range(4)])
+    scored = []
+
+    def scorer(obs):
+        scored.append(sorted(obs[:, 0]))
+        return obs[:, 0] + 100 * len(scored)
+
+    # The unscored candidates first, then the ones scored the longest ago
+    pool.score(scorer, batch_size=3)
+    assert scored[-1] == [0, 1, 2] and pool.n_unscored == 1
+    pool.add(np.array([[4]]), [{"start": 4}])
+    pool.score(scorer, batch_size=3)
+    assert {3, 4} <= set(scored[-1]) and pool.n_unscored == 0
+    pool.score(scorer, batch_size=3)
+    assert len(set(scored[-2] + scored[-1])) == 5
+
+    # The scoring order follows the candidates moved by `pop`
+    pool.pop(2)
+    pool.score(scorer, batch_size=10)
+    assert len(scored[-1]) == 3
@@ -0,0 +1,106 @@
+"""Benchmark of the array based segment tree against the previous recursive implementation.
+
+Run with: pytest tests/test_segment_tree_benchmark.py --expensive -s"""
+import time
+
+import numpy as np
+import pytest
+
+from stable_baselines.common.segment_tree import SumSegmentTree, MinSegmentTree, unique
+
+CAPACITY = 2 ** 20
+BATCH_SIZE = 256
+N_ITERATIONS = 200
+
+
+class _RecursiveSegmentTree(object):
+    """Previous implementation: recursive reduce and per level `unique` on update."""
+    def __init__(self, capacity, operation, neutral_element):
+        self._capacity = capacity
+        self._value = np.array([neutral_element for _ in range(2 * capacity)])
+        self._operation = operation
+
+    def _reduce_helper(self, start, end, node, node_start, node_end):
+        if start == node_start and end == node_end:
+            return self._value[node]
+        mid = (node_start + node_end) // 2
+        if end <= mid:
+            return self._reduce_helper(start, end, 2 * node, node_start, mid)
+        if mid + 1 <= start:
+            return self._reduce_helper(start, end, 2 * node + 1, mid + 1, node_end)
+        return self._operation(self._reduce_helper(start, mid, 2 * node, node_start, mid),
+                               self._reduce_helper(mid + 1, end, 2 * node + 1, mid + 1, node_end))
+
+    def reduce(self, start=0, end=None):
+        if end is None:
+            end = self._capacity
+        return self._reduce_helper(start, end - 1, 1, 0, self._capacity - 1)
+
+    def __setitem__(self, idx, val):
+        idxs = idx + self._capacity
+        self._value[idxs] = val
+        idxs = unique(idxs // 2)
+        while len(idxs) > 1 or idxs[0] > 0:
+            self._value[idxs] = self._operation(self._value[2 * idxs], self._value[2 * idxs + 1])
+            idxs = unique(idxs // 2)
+
+    def find_prefixsum_idx(self, prefixsum):
+        idx = np.ones(len(prefixsum), dtype=int)
+        cont = np.ones(len(prefixsum), dtype=bool)
+        while np.any(cont):
+            idx[cont] = 2 * idx[cont]
+            prefixsum_new = np.where(self._value[idx] <= prefixsum, prefixsum - self._value[idx], prefixsum)
+            idx = np.where(np.logical_or(self._value[idx] > prefixsum, np.logical_not(cont)), idx, idx + 1)
+            prefixsum = prefixsum_new
+            cont = idx < self._capacity
+        return idx - self._capacity
+
+
+def _run(sum_tree, min_tree, n_filled, seed=0):
+    """
+    Time the operations done by PrioritizedReplayBuffer for one gradient step: priority update of a batch,
+    sampling of a batch and computation of the importance weights.
+    """
+    rng = np.random.RandomState(seed)
+    update_time, sample_time = 0., 0.
+    sampled = []
+    for _ in range(N_ITERATIONS):
+        idxes = rng.randint(0, n_filled, size=BATCH_SIZE)
+        priorities = rng.rand(BATCH_SIZE)
+        start = time.perf_counter()
+        sum_tree[idxes] = priorities
+        min_tree[idxes] = priorities
+        update_time += time.perf_counter() - start
+
+        mass = rng.rand(BATCH_SIZE) * sum_tree.reduce(0, n_filled - 1)
+        start = time.perf_counter()
+        total = sum_tree.reduce(0, n_filled - 1)
+        idxes = sum_tree.find_prefixsum_idx(mass)
+        p_min = min_tree.reduce() / sum_tree.reduce()
+        _ = (sum_tree._value[idxes + CAPACITY] / sum_tree.reduce() / p_min) / total
+        sample_time += time.perf_counter() - start
+        sampled.append(idxes)
+    return update_time / N_ITERATIONS, sample_time / N_ITERATIONS, np.concatenate(sampled)
+
+
+@pytest.mark.expensive
+def test_segment_tree_benchmark():
+    n_filled = CAPACITY
+    initial_priorities = np.random.RandomState(1).rand(n_filled)
+
+    reference_sum = _RecursiveSegmentTree(CAPACITY, np.add, 0.0)
+    reference_min = _RecursiveSegmentTree(CAPACITY, np.minimum, float('inf'))
+    sum_tree, min_tree = SumSegmentTree(CAPACITY), MinSegmentTree(CAPACITY)
+    for tree in [reference_sum, reference_min, sum_tree, min_tree]:
+        tree[np.arange(n_filled)] = initial_priorities
+
+    ref_update, ref_sample, ref_idxes = _run(reference_sum, reference_min, n_filled)
+    update, sample, idxes = _run(sum_tree, min_tree, n_filled)
+
+    print("Capacity 2^20, batch size {}".format(BATCH_SIZE))
+    print("update: {:.3f}ms (recursive: {:.3f}ms)".format(update * 1e3, ref_update * 1e3))
+    print("sample: {:.3f}ms (recursive: {:.3f}ms)".format(sample * 1e3, ref_sample * 1e3))
+
+    assert np.all(idxes == ref_idxes)
+    assert np.allclose(sum_tree._value[1:], reference_sum._value[1:])
+    assert sample < ref_sample
@@ -2,15 +2,20 @@ import collections
 import functools
 import itertools
 import multiprocessing
+import time
 
 import pytest
 import gym
 import numpy as np
 
+from stable_baselines.bench import Monitor, load_results
+from stable_baselines.common.cmd_util import make_vec_env
 from stable_baselines.common.vec_env import DummyVecEnv, SubprocVecEnv, VecNormalize, VecFrameStack
+from stable_baselines.common.vec_env.subproc_vec_env import _CANDIDATE_SEED_OFFSET, _EnvRunner
 
 N_ENVS = 3
-VEC_ENV_CLASSES = [DummyVecEnv, SubprocVecEnv]
+VEC_ENV_CLASSES = [DummyVecEnv, SubprocVecEnv, functools.partial(SubprocVecEnv, shared_memory=True),
+                   functools.partial(SubprocVecEnv, n_envs_per_worker=2)]
 VEC_ENV_WRAPPERS = [None, VecNormalize, VecFrameStack]
 
 
@@ -306,6 +311,248 @@ class CustomWrapperBB(CustomWrapperB):
         CustomWrapperB.__init__(self, venv)
         self.var_bb = 'bb'
 
+def test_subproc_shared_memory_views():
+    """Test the observations returned as views of the shared memory, and resets of a subset of the envs"""
+    vec_env = SubprocVecEnv([functools.partial(StepEnv, max_steps) for max_steps in [3, 5]],
+                            shared_memory=True, copy_obs=False)
+    obs = vec_env.reset()
+    assert np.array_equal(obs, [[0], [0]])
+    vec_env.step_async(np.zeros(2, dtype=int))
+    step_obs, rewards, dones, infos = vec_env.step_wait()
+    # the views are overwritten by the next step
+    assert np.shares_memory(obs, step_obs)
+    assert rewards.dtype == np.float64 and dones.dtype == np.bool_
+    assert len(infos) == 2
+
+    for _ in range(2):
+        step_obs, _, dones, infos = vec_env.step(np.zeros(2, dtype=int))
+    assert list(dones) == [True, False]
+    assert np.array_equal(infos[0]['terminal_observation'], [2])
+    assert np.array_equal(obs, [[0], [2]])
+
+    # a reset of a subset of the envs returns copies of their observations only
+    subset_obs = vec_env.reset(indices=[1])
+    assert np.array_equal(subset_obs, [[0]])
+    assert not np.shares_memory(subset_obs, step_obs)
+    assert np.array_equal(step_obs, [[0], [0]])
+    vec_env.close()
+
+
+@pytest.mark.parametrize('shared_memory', [False, True])
+def test_subproc_envs_per_worker(shared_memory):
+    """Test several environments per worker process, with commands targeting some of the environments"""
+    vec_env = SubprocVecEnv([functools.partial(StepEnv, max_steps) for max_steps in range(2, 7)],
+                            n_envs_per_worker=2, shared_memory=shared_memory)
+    assert len(vec_env.processes) == 3
+    assert vec_env.get_attr('max_steps') == [2, 3, 4, 5, 6]
+    assert vec_env.get_attr('max_steps', indices=[4, 1, 0]) == [6, 3, 2]
+    vec_env.set_attr('max_steps', 1, indices=[1, 2])
+    assert vec_env.get_attr('max_steps') == [2, 1, 1, 5, 6]
+
+    vec_env.reset()
+    vec_env.add_scenarios([{}, {}], indices=[3, 0])
+    _, _, dones, infos = vec_env.step(np.zeros(5, dtype=int))
+    assert list(dones) == [False, True, True, False, False]
+    assert all('terminal_observation' in infos[i] for i in [1, 2])
+    assert len(vec_env.env_method('reset', indices=[2, 3])) == 2
+    assert np.array_equal(vec_env.reset(indices=[4, 1]), [[0], [0]])
+    vec_env.close()
+
+
+class SlowStepEnv(StepEnv):
+    def __init__(self, max_steps, step_duration):
+        """StepEnv whose steps take some time"""
+        super(SlowStepEnv, self).__init__(max_steps)
+        self.step_duration = step_duration
+
+    def step(self, action):
+        time.sleep(self.step_duration)
+        return super(SlowStepEnv, self).step(action)
+
+
+@pytest.mark.parametrize('shared_memory', [False, True])
+@pytest.mark.parametrize('n_envs_per_worker', [1, 2])
+def test_subproc_async_step(shared_memory, n_envs_per_worker):
+    """Test the asynchronous stepping: the slow environment does not stall the others"""
+    step_durations = [0.05, 0.0, 0.0, 0.0]
+    vec_env = SubprocVecEnv([functools.partial(SlowStepEnv, 1000, duration) for duration in step_durations],
+                            shared_memory=shared_memory, n_envs_per_worker=n_envs_per_worker, async_batch_size=2)
+    vec_env.async_reset()
+    n_steps = np.zeros(4, dtype=int)
+    for _ in range(30):
+        obs, rewards, dones, infos, env_ids = vec_env.recv()
+        assert len(env_ids) == 2 and len(set(env_ids)) == 2
+        assert len(infos) == 2 and not np.any(dones)
+        # StepEnv observations are the number of steps before the last one
+        assert np.array_equal(obs[:, 0], np.maximum(n_steps[env_ids] - 1, 0))
+        n_steps[env_ids] += 1
+        vec_env.send(np.zeros(2, dtype=int), env_ids)
+    # With one env per worker, the slow env steps at most once per 0.05s
+    if n_envs_per_worker == 1:
+        assert n_steps[0] < n_steps[1:].min()
+    vec_env.close()
+
+
+class ScenarioStepEnv(StepEnv):
+    def __init__(self, max_steps):
+        """StepEnv whose initial step can be chosen, as a scenario for active sampling"""
+        super(ScenarioStepEnv, self).__init__(max_steps)
+        self.n_resets = 0
+
+    def reset(self, start=0):
+        self.n_resets += 1
+        self.current_step = start
+        return np.array([self.current_step], dtype='int')
+
+    def get_initial_state(self):
+        return {"start": self.n_resets}
+
+
+def test_subproc_reset_data():
+    """Test the reset data generated by idle workers, and the scenarios run at the end of the episodes"""
+    env_fns = [functools.partial(ScenarioStepEnv, 3) for _ in range(4)]
+    vec_env = SubprocVecEnv(env_fns, n_envs_per_worker=2, reset_data_size=3, async_batch_size=2,
+                            candidate_env_fns=env_fns)
+    vec_env.reset()
+    vec_env.set_gather_reset_data(True, indices=[0, 1, 2])
+    time.sleep(1.0)
+    reset_data = vec_env.get_reset_data()
+    assert len(reset_data) == 9
+    # the candidates are generated by another instance of the envs
+    assert vec_env.get_attr('n_resets') == [1] * 4
+    assert all(data["obs"][0] == 0 and data["initial_state"]["start"] >= 1 for data in reset_data)
+
+    vec_env.add_scenarios([{"start": 100}, {"start": 200}], indices=[1, 3])
+    for _ in range(3):
+        obs, _, dones, _ = vec_env.step(np.zeros(4, dtype=int))
+    assert np.all(dones)
+    assert np.array_equal(obs[:, 0], [0, 100, 0, 200])
+
+    vec_env.async_reset()
+    env_ids = np.arange(4)
+    for _ in range(4):
+        vec_env.send(np.zeros(len(env_ids), dtype=int), env_ids)
+        # commands drain the pending asynchronous steps
+        assert vec_env.get_attr('max_steps') == [3] * 4
+        _, _, _, _, env_ids = vec_env.recv()
+    vec_env.close()
+
+
+def test_subproc_request_reset_data():
+    """Test the reset data requests, whose replies are received during the next steps"""
+    env_fns = [functools.partial(ScenarioStepEnv, 3) for _ in range(4)]
+    vec_env = SubprocVecEnv(env_fns, n_envs_per_worker=2, reset_data_size=2, candidate_env_fns=env_fns)
+    vec_env.reset()
+    vec_env.set_gather_reset_data(True)
+    time.sleep(1.0)
+    vec_env.request_reset_data()
+    obs, _, _, _ = vec_env.step(np.zeros(4, dtype=int))
+    assert np.array_equal(obs[:, 0], [0] * 4)
+    # the replies were received by the step
+    assert not any(vec_env._in_flight)
+    reset_data = vec_env.collect_reset_data()
+    assert len(reset_data) == 8 and vec_env.collect_reset_data() == []
+
+    vec_env.request_reset_data(indices=[0, 3])
+    assert vec_env.get_attr('max_steps') == [3] * 4
+    reset_data = vec_env.collect_reset_data()
+    assert len(reset_data) == 4
+
+    vec_env.request_reset_data(indices=[1])
+    assert len(vec_env.collect_reset_data(block=True)) == 2
+    vec_env.close()
+
+
+class SeededResetEnv(StepEnv):
+    def __init__(self, max_steps, seed=0):
+        """StepEnv that seeds itself (like the envs of `make_vec_env`), with a random initial step"""
+        super(SeededResetEnv, self).__init__(max_steps)
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.np_random, seed = gym.utils.seeding.np_random(seed)
+        return [seed]
+
+    def reset(self):
+        self.current_step = self.np_random.randint(100)
+        return np.array([self.current_step], dtype='int')
+
+    def get_initial_state(self):
+        return {}
+
+
+def test_subproc_reset_data_seed():
+    """Test that the candidate environments do not replay the resets of the environments"""
+    env_fns = [functools.partial(SeededResetEnv, 3) for _ in range(2)]
+    vec_env = SubprocVecEnv(env_fns, reset_data_size=5, candidate_env_fns=env_fns)
+    vec_env.set_gather_reset_data(True)
+    time.sleep(1.0)
+    candidates = [data["obs"][0] for data in vec_env.get_reset_data()]
+    reference_env = SeededResetEnv(3)
+    # The environments seed themselves identically
+    resets = [reference_env.reset()[0] for _ in range(5)]
+    assert candidates[:5] != resets and candidates[5:] != resets
+
+    # Seeded through the worker: the candidates use an offset seed, the items generated before are discarded
+    vec_env.seed(10)
+    time.sleep(1.0)
+    candidates = [data["obs"][0] for data in vec_env.get_reset_data()]
+    for env_idx in range(2):
+        reference_env.seed(10 + env_idx + _CANDIDATE_SEED_OFFSET)
+        assert candidates[5 * env_idx:5 * (env_idx + 1)] == [reference_env.reset()[0] for _ in range(5)]
+    vec_env.close()
+
+
+def test_subproc_reset_data_monitor(tmp_path):
+    """Test that the reset data does not affect the monitor files of the environments"""
+    vec_env = make_vec_env(ScenarioStepEnv, n_envs=2, monitor_dir=str(tmp_path), env_kwargs={"max_steps": 3},
+                           vec_env_cls=SubprocVecEnv, vec_env_kwargs={"reset_data_size": 4})
+    vec_env.reset()
+    vec_env.set_gather_reset_data(True)
+    for _ in range(6):
+        _, _, dones, _ = vec_env.step(np.zeros(2, dtype=int))
+    assert np.all(dones)
+    # Without candidate environments, the environments generate the reset data at the end of their episodes
+    assert len(vec_env.get_reset_data()) == 8
+    assert vec_env.get_attr('n_resets') == [7] * 2
+    vec_env.close()
+    monitor = load_results(str(tmp_path))
+    assert len(monitor) == 4 and np.all(monitor['l'] == 3)
+
+    # Candidate environments wrapped in a Monitor would overwrite the monitor files
+    runner = _EnvRunner(functools.partial(ScenarioStepEnv, 3),
+                        candidate_env_fn=lambda: Monitor(ScenarioStepEnv(3), str(tmp_path / "candidate")))
+    with pytest.raises(AssertionError):
+        runner.generate_reset_data()
+
+
+def test_vec_frame_stack():
+    """Test the frame stacking against a stack shifted at every step"""
+    n_stack = 3
+    max_steps = np.array([2, 3, 5])
+    frame_stack = VecFrameStack(DummyVecEnv([functools.partial(StepEnv, n) for n in max_steps]), n_stack=n_stack)
+    obs = frame_stack.reset()
+    expected = np.zeros((3, n_stack), dtype=obs.dtype)
+    assert np.array_equal(obs, expected)
+    n_steps = np.zeros(3, dtype=int)
+    for _ in range(12):
+        obs, _, dones, infos = frame_stack.step(np.zeros(3, dtype=int))
+        # StepEnv observations are the number of steps before the last one
+        n_steps += 1
+        raw_obs = n_steps - 1
+        assert np.array_equal(dones, n_steps == max_steps)
+        expected = np.roll(expected, -1, axis=-1)
+        for i in np.flatnonzero(dones):
+            terminal = np.concatenate((expected[i, :-1], [raw_obs[i]]))
+            assert np.array_equal(infos[i]['terminal_observation'], terminal)
+            expected[i] = 0
+            raw_obs[i] = n_steps[i] = 0
+        expected[:, -1] = raw_obs
+        assert np.array_equal(obs, expected)
+        # a new array is returned at every step
+        assert not np.shares_memory(obs, frame_stack.stackedobs)
+
+
 def test_vecenv_wrapper_getattr():
     def make_env():
         return CustomGymEnv(gym.spaces.Box(low=np.zeros(2), high=np.ones(2)))
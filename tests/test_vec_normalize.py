@@ -5,7 +5,7 @@ import numpy as np
 import pytest
 
 from stable_baselines import DDPG, DQN, SAC, TD3
-from stable_baselines.common.running_mean_std import RunningMeanStd
+from stable_baselines.common.running_mean_std import RunningMeanStd, RunningMeanStdSerial
 from stable_baselines.common.vec_env import (DummyVecEnv, VecNormalize, VecFrameStack,
     sync_envs_normalization, unwrap_vec_normalize)
 from .test_common import _assert_eq
@@ -34,6 +34,35 @@ def test_runningmeanstd():
         assert np.allclose(moments_1, moments_2)
 
 
+def test_runningmeanstd_buffer():
+    """Test the buffered updates of RunningMeanStd"""
+    samples = np.random.randn(25, 3) * 2 + 1
+    rms = RunningMeanStd(epsilon=0.0, shape=(3,), buffer_size=10)
+    for sample in samples[:12]:
+        rms.push(sample)
+    # The buffer was merged once full
+    assert rms.count == 10 and rms.n_buffered == 2
+    rms.push(samples[12:])
+    rms.flush()
+    assert rms.count == 25 and rms.n_buffered == 0
+    assert np.allclose([rms.mean, rms.var], [samples.mean(axis=0), samples.var(axis=0)])
+
+
+def test_runningmeanstd_serial():
+    """Test the per-sample and the buffered updates of RunningMeanStdSerial"""
+    samples = np.random.randn(20, 3) * 2 + 1
+    rms = RunningMeanStdSerial(epsilon=0.0, shape=(3,))
+    for idx, sample in enumerate(samples):
+        rms.update(sample)
+        # The statistics include each sample as soon as it is added
+        assert np.allclose([rms.mean, rms.var], [samples[:idx + 1].mean(axis=0), samples[:idx + 1].var(axis=0)])
+    rms.push(samples)
+    rms.flush()
+    rms.update(samples[0])
+    all_samples = np.concatenate([samples, samples, samples[:1]])
+    assert np.allclose([rms.mean, rms.var], [all_samples.mean(axis=0), all_samples.var(axis=0)])
+
+
 def check_rms_equal(rmsa, rmsb):
     assert np.all(rmsa.mean == rmsb.mean)
     assert np.all(rmsa.var == rmsb.var)
@@ -125,6 +154,52 @@ def test_normalize_external():
     assert obs.shape == norm_obs.shape
 
 
+def test_normalize_obs_cache():
+    """Test the cached observation scale and the in-place normalization"""
+    venv = _make_warmstart_cartpole()
+    obs_rms = venv.obs_rms
+
+    def reference(obs):
+        return np.clip((obs - obs_rms.mean) / np.sqrt(obs_rms.var + venv.epsilon), -venv.clip_obs, venv.clip_obs)
+
+    obs = np.random.randn(8, 4).astype(np.float32) * 5
+    norm_obs = venv.normalize_obs(obs)
+    assert norm_obs is not obs and norm_obs.dtype == np.float64
+    np.testing.assert_allclose(norm_obs, reference(obs))
+    scale = venv._get_obs_scale()
+    assert venv._get_obs_scale() is scale
+
+    # The batches of floats are normalized in place, the other ones are copied
+    obs_copy, int_obs = obs.copy(), np.ones((8, 4), dtype=np.int64)
+    norm_obs, norm_int_obs = venv.normalize_obs_batches(obs_copy, int_obs)
+    assert norm_obs is obs_copy and norm_int_obs is not int_obs
+    np.testing.assert_allclose(norm_obs, reference(obs), rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(norm_int_obs, reference(int_obs))
+
+    # The scale is recomputed when the statistics are updated
+    venv.step([venv.action_space.sample()])
+    assert venv._get_obs_scale() is not scale
+    obs_rms = venv.obs_rms
+    np.testing.assert_allclose(venv.normalize_obs(obs), reference(obs))
+    assert venv.get_original_obs(copy=False) is venv.old_obs
+
+
+def test_vec_normalize_reused_obs():
+    """Test the normalization of the observations into a reused output array"""
+    venv = VecNormalize(DummyVecEnv([make_env, make_env]))
+    reused_venv = VecNormalize(DummyVecEnv([make_env, make_env]), copy_obs=False)
+    venv.seed(0)
+    reused_venv.seed(0)
+    obs, reused_obs = venv.reset(), reused_venv.reset()
+    np.testing.assert_allclose(obs, reused_obs)
+    for _ in range(5):
+        actions = [venv.action_space.sample() for _ in range(2)]
+        obs, _, _, _ = venv.step(actions)
+        next_obs, _, _, _ = reused_venv.step(actions)
+        assert next_obs is reused_obs and next_obs.shape == (2,) + venv.observation_space.shape
+        np.testing.assert_allclose(obs, next_obs)
+
+
 @pytest.mark.parametrize("model_class", [DDPG, DQN, SAC, TD3])
 def test_offpolicy_normalization(model_class):
     if model_class == DQN:
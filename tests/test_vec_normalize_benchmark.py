@@ -0,0 +1,67 @@
+"""Benchmark of the VecNormalize observation normalization against the previous implementation.
+
+Run with: pytest tests/test_vec_normalize_benchmark.py --expensive -s"""
+import time
+
+import gym
+import numpy as np
+import pytest
+
+from stable_baselines.common.vec_env import DummyVecEnv, VecNormalize
+
+N_ENVS = 16
+OBS_SHAPE = (376,)
+BATCH_SIZE = 256
+N_ITERATIONS = 2000
+
+
+def _previous_normalize_obs(vec_normalize, obs):
+    """Previous implementation: temporaries for the subtraction, sqrt, division and clip."""
+    obs_rms = vec_normalize.obs_rms
+    return np.clip((obs - obs_rms.mean) / np.sqrt(obs_rms.var + vec_normalize.epsilon),
+                   -vec_normalize.clip_obs, vec_normalize.clip_obs)
+
+
+def _time(function, *args):
+    start = time.perf_counter()
+    for _ in range(N_ITERATIONS):
+        function(*args)
+    return (time.perf_counter() - start) / N_ITERATIONS
+
+
+@pytest.mark.expensive
+def test_vec_normalize_benchmark():
+    space = gym.spaces.Box(low=-np.inf, high=np.inf, shape=OBS_SHAPE, dtype=np.float32)
+
+    class _Env(gym.Env):
+        observation_space = space
+        action_space = gym.spaces.Discrete(2)
+
+    vec_normalize = VecNormalize(DummyVecEnv([_Env for _ in range(N_ENVS)]))
+    rng = np.random.RandomState(0)
+    vec_normalize.obs_rms.update(rng.randn(1000, *OBS_SHAPE) * 3 + 1)
+
+    step_obs = rng.randn(N_ENVS, *OBS_SHAPE).astype(np.float32)
+    batch_obs = rng.randn(BATCH_SIZE, *OBS_SHAPE).astype(np.float32)
+    batch_next_obs = rng.randn(BATCH_SIZE, *OBS_SHAPE).astype(np.float32)
+
+    # Per step: normalization of the observations of all the envs, then original observations for the buffer
+    ref_step = _time(lambda: (_previous_normalize_obs(vec_normalize, step_obs), step_obs.copy()))
+    step = _time(lambda: (vec_normalize.normalize_obs(step_obs), vec_normalize.get_original_obs(copy=False)))
+    # Per step, without copy_obs: normalization into the reused output array
+    step_out = np.empty((N_ENVS,) + OBS_SHAPE)
+    step_reused = _time(lambda: (vec_normalize.normalize_obs(step_obs, out=step_out),
+                                 vec_normalize.get_original_obs(copy=False)))
+    # Per gradient step: normalization of the sampled observations and next observations (already gathered)
+    ref_sample = _time(lambda: (_previous_normalize_obs(vec_normalize, batch_obs.copy()),
+                                _previous_normalize_obs(vec_normalize, batch_next_obs.copy())))
+    sample = _time(lambda: vec_normalize.normalize_obs_batches(batch_obs.copy(), batch_next_obs.copy()))
+
+    print("{} envs, observation shape {}, batch size {}".format(N_ENVS, OBS_SHAPE, BATCH_SIZE))
+    print("step: {:.1f}us (previous: {:.1f}us)".format(step * 1e6, ref_step * 1e6))
+    print("step, reused output array: {:.1f}us".format(step_reused * 1e6))
+    print("sample: {:.1f}us (previous: {:.1f}us)".format(sample * 1e6, ref_sample * 1e6))
+
+    np.testing.assert_allclose(vec_normalize.normalize_obs(step_obs), _previous_normalize_obs(vec_normalize, step_obs))
+    assert step < ref_step
+    assert sample < ref_sample